@@ -87,6 +87,19 @@ class DFSClient(object):
             return False
         return self.set_data(key, new_data)
 
+    def batch_cas(self, kvs):
+        # not atomic across the keys, the same as cas
+        for key, old_data, _ in kvs:
+            org_data = self.get_data(key)
+            if isinstance(org_data, bytes):
+                org_data = org_data.decode('utf-8')
+            if isinstance(old_data, bytes):
+                old_data = old_data.decode('utf-8')
+            if org_data != old_data:
+                fl_logging.warning("batch CAS failed at key %s", key)
+                return False
+        return all(self.set_data(key, new_data) for key, _, new_data in kvs)
+
     def get_prefix_kvs(self, prefix, ignore_prefix=False):
         kvs = []
         target_path = self._generate_path(prefix, with_meta=False)
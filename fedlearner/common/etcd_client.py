@@ -76,6 +76,25 @@ class EtcdClient(object):
                 return clnt.put_if_not_exists(etcd_path, new_data)
             return clnt.replace(etcd_path, old_data, new_data)
 
+    def batch_cas(self, kvs):
+        """cas of (key, old_data, new_data) in kvs in one transaction,
+        either all of them are applied or none"""
+        addr = self._get_next_addr()
+        with EtcdClient.closing(self._name, addr, self._use_mock_etcd) as clnt:
+            compare, success = [], []
+            for key, old_data, new_data in kvs:
+                etcd_path = self._generate_path(key)
+                if old_data is None:
+                    compare.append(clnt.transactions.version(etcd_path) == 0)
+                else:
+                    compare.append(
+                            clnt.transactions.value(etcd_path) == old_data
+                        )
+                success.append(clnt.transactions.put(etcd_path, new_data))
+            succeeded, _ = clnt.transaction(compare=compare, success=success,
+                                            failure=[])
+            return succeeded
+
     def watch_key(self, key):
         addr = self._get_next_addr()
         with EtcdClient.closing(self._name, addr, self._use_mock_etcd) as clnt:
@@ -44,5 +44,8 @@ class LevelDB(object):
     def cas(self, key, old_data, new_data):
         raise NotImplementedError
 
+    def batch_cas(self, kvs):
+        raise NotImplementedError
+
     def get_prefix_kvs(self, prefix, ignore_prefix=False):
         raise NotImplementedError
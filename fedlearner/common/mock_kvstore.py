@@ -43,6 +43,34 @@ class MockKVStore(object):
                 return self._value.encode()
             return self._value
 
+    class Compare(object):
+        def __init__(self, key, target):
+            self.key = key
+            self.target = target
+            self.value = None
+
+        def __eq__(self, value):
+            self.value = value
+            return self
+
+        __hash__ = None
+
+    class Transactions(object):
+        # builders of the compares and the requests of etcd3 transactions
+        @staticmethod
+        def version(key):
+            return MockKVStore.Compare(key, 'version')
+
+        @staticmethod
+        def value(key):
+            return MockKVStore.Compare(key, 'value')
+
+        @staticmethod
+        def put(key, value):
+            return (key, value)
+
+    transactions = Transactions()
+
     class EventNotifier(object):
         def __init__(self, clnt):
             self._queue = queue.Queue()
@@ -141,6 +169,21 @@ class MockKVStore(object):
             self._sync_to_disk()
             return True
 
+    def transaction(self, compare, success, failure):
+        with self._lock:
+            succeeded = all(self._check_compare(cmp) for cmp in compare)
+            for key, value in success if succeeded else failure:
+                self._data[key] = value
+                self._notify_if_need(key)
+            self._sync_to_disk()
+            return succeeded, []
+
+    def _check_compare(self, cmp):
+        if cmp.target == 'version':
+            # the version of a key is 0 iff it doesn't exist
+            return (1 if cmp.key in self._data else 0) == cmp.value
+        return self._data.get(cmp.key) == cmp.value
+
     def watch(self, key, clnt):
         with self._lock:
             en = MockKVStore.EventNotifier(clnt)
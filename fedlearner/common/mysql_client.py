@@ -139,6 +139,29 @@ class MySQLClient(object):
                 sess.rollback()
                 return False
 
+    def batch_cas(self, kvs):
+        with self.closing(self._engine) as sess:
+            try:
+                for key, old_data, new_data in kvs:
+                    if old_data is None:
+                        sess.add(DatasourceMeta(
+                            kv_key=self._generate_key(key),
+                            kv_value=new_data))
+                        continue
+                    context = sess.query(DatasourceMeta).filter(
+                        DatasourceMeta.kv_key ==\
+                        self._generate_key(key)).one()
+                    if context.kv_value != old_data:
+                        sess.rollback()
+                        return False
+                    context.kv_value = new_data
+                sess.commit()
+                return True
+            except Exception as e: # pylint: disable=broad-except
+                fl_logging.error('failed to batch cas. msg[%s]', e)
+                sess.rollback()
+                return False
+
     def get_prefix_kvs(self, prefix, ignor_prefix=False):
         kvs = []
         path = self._generate_key(prefix)
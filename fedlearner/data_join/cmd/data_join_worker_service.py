@@ -68,6 +68,11 @@ if __name__ == "__main__":
     parser.add_argument('--example_id_dump_threshold', type=int, default=4096,
                         help='dump a data block if N example id, <=0'\
                              'means no size limit for dumping example id')
+    parser.add_argument('--example_id_filter_false_positive_rate',
+                        type=float, default=0.01,
+                        help='the false positive rate of the bloom filter '\
+                             'of dumped example ids used to skip the raw '\
+                             'data never joined, <=0 means no filter')
     parser.add_argument('--data_block_builder', type=str, default='TF_RECORD',
                         choices=['TF_RECORD', 'CSV_DICT'],
                         help='the file type for data block')
@@ -95,6 +100,10 @@ if __name__ == "__main__":
     parser.add_argument('--raw_data_cache_type', type=str, default="memory",
                         choices=["memory", "disk"],
                         help="the space to store the raw data")
+    parser.add_argument('--record_index_interval', type=int, default=4096,
+                        help='index the offset of every N records in a '\
+                             'hidden file next to the raw data file to '\
+                             'seek it directly, <=0 means no index')
     parser.add_argument('--optional_fields', type=str, default='',
                         help='optional stat fields used in joiner, separated '
                              'by comma between fields, e.g. "label,rit". '
@@ -113,7 +122,8 @@ if __name__ == "__main__":
                     read_ahead_size=args.read_ahead_size,
                     read_batch_size=args.read_batch_size,
                     optional_fields=optional_fields,
-                    raw_data_cache_type=args.raw_data_cache_type
+                    raw_data_cache_type=args.raw_data_cache_type,
+                    record_index_interval=args.record_index_interval
                 ),
             example_joiner_options=dj_pb.ExampleJoinerOptions(
                     example_joiner=args.example_joiner,
@@ -134,7 +144,9 @@ if __name__ == "__main__":
                 ),
             example_id_dump_options=dj_pb.ExampleIdDumpOptions(
                     example_id_dump_interval=args.example_id_dump_interval,
-                    example_id_dump_threshold=args.example_id_dump_threshold
+                    example_id_dump_threshold=args.example_id_dump_threshold,
+                    example_id_filter_false_positive_rate=\
+                        args.example_id_filter_false_positive_rate
                 ),
             batch_processor_options=dj_pb.BatchProcessorOptions(
                     batch_size=4096,
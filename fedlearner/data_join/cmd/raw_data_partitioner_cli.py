@@ -71,6 +71,10 @@ if __name__ == "__main__":
     parser.add_argument('--memory_limit_ratio', type=int, default=70,
                         choices=range(40, 81),
                         help='the ratio(*100) of memory used for map&reduce')
+    parser.add_argument('--partitioner_process_num', type=int, default=1,
+                        help='the number of processes partitioning the '\
+                             'input files in parallel, 1 for partitioning '\
+                             'in the main process')
 
     args = parser.parse_args()
     set_logger()
@@ -123,7 +127,8 @@ if __name__ == "__main__":
                 batch_size=4096,
                 max_flying_item=-1
             ),
-            memory_limit_ratio=args.memory_limit_ratio/100
+            memory_limit_ratio=args.memory_limit_ratio/100,
+            partitioner_process_num=args.partitioner_process_num
         )
     partitioner = RawDataPartitioner(partitioner_options, args.part_field,
                                      args.kvstore_type)
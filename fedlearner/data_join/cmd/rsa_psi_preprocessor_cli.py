@@ -91,6 +91,19 @@ if __name__ == "__main__":
     parser.add_argument('--preprocessor_offload_processor_number',
                         type=int, default=-1,
                         help='the offload processor for preprocessor')
+    parser.add_argument('--blinding_pool_size', type=int, default=1<<17,
+                        help='the max number of blinding factors the '\
+                             'follower precomputes, 0 to disable')
+    parser.add_argument('--sort_run_memory_budget', type=int, default=1<<30,
+                        help='the max bytes of items buffered for a sort '\
+                             'run, 0 for no limit')
+    parser.add_argument('--sort_run_compressed_type', type=str,
+                        default='', choices=['', 'ZLIB', 'GZIP'],
+                        help='the compressed type for the TF_RECORD sort '\
+                             'runs, empty to follow the builder')
+    parser.add_argument('--sort_run_merge_fan_in', type=int, default=64,
+                        help='the max number of sort runs merged at once, '\
+                             'more runs are merged in several passes')
 
     args = parser.parse_args()
     set_logger()
@@ -133,6 +146,10 @@ if __name__ == "__main__":
             sign_rpc_timeout_ms=args.sign_rpc_timeout_ms,
             stub_fanout=args.stub_fanout,
             slow_sign_threshold=args.slow_sign_threshold,
+            blinding_pool_size=args.blinding_pool_size,
+            sort_run_memory_budget=args.sort_run_memory_budget,
+            sort_run_compressed_type=args.sort_run_compressed_type,
+            sort_run_merge_fan_in=args.sort_run_merge_fan_in,
             sort_run_merger_read_ahead_buffer=\
                 args.sort_run_merger_read_ahead_buffer,
             sort_run_merger_read_batch_size=\
@@ -14,6 +14,7 @@
 
 # coding: utf-8
 
+import base64
 import os
 import logging
 import uuid
@@ -168,6 +169,27 @@ def raw_data_pub_kvstore_key(pub_base_dir, partition_id, process_index):
     return os.path.join(pub_base_dir, partition_repr(partition_id),
                         '{:08}{}'.format(process_index, RawDataPubSuffix))
 
+RawDataPubBinaryPrefix = 'pb64:'
+
+def encode_raw_data_pub(raw_data_pub):
+    """The binary protobuf of raw_data_pub in base64, so the value is
+    still a string for the kvstores keeping text"""
+    return RawDataPubBinaryPrefix + \
+            base64.b64encode(raw_data_pub.SerializeToString()).decode()
+
+def decode_raw_data_pub(data):
+    """Decode the RawDatePub published as encode_raw_data_pub or as text
+    format by the previous publishers"""
+    if isinstance(data, bytes):
+        data = data.decode()
+    raw_data_pub = dj_pb.RawDatePub()
+    if data.startswith(RawDataPubBinaryPrefix):
+        raw_data_pub.ParseFromString(
+                base64.b64decode(data[len(RawDataPubBinaryPrefix):])
+            )
+        return raw_data_pub
+    return text_format.Parse(data, raw_data_pub, allow_unknown_field=True)
+
 _valid_basic_feature_type = (int, str, float)
 def convert_dict_to_tf_example(src_dict):
     assert isinstance(src_dict, dict)
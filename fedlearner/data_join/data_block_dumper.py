@@ -15,6 +15,7 @@
 # coding: utf-8
 import logging
 import os
+import queue
 import threading
 import time
 import traceback
@@ -27,6 +28,159 @@ from fedlearner.data_join.data_block_manager import \
 from fedlearner.data_join.joiner_impl.optional_stats import OptionalStats
 from fedlearner.data_join.raw_data_visitor import RawDataVisitor
 
+# items are passed between the stages in batches of PIPELINE_BATCH_SIZE,
+# a queue between two stages holds at most PIPELINE_QUEUE_SIZE batches
+PIPELINE_BATCH_SIZE = 256
+PIPELINE_QUEUE_SIZE = 16
+
+
+class _RawDataReader(object):
+    """Read-ahead stage of the dumper. A thread iterates the raw data
+    visitor and queues the (index, item) pairs in batches, the visitor must
+    not be touched by others until the reader is stopped"""
+    def __init__(self, raw_data_visitor):
+        self._raw_data_visitor = raw_data_visitor
+        self._queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        self._stopped = threading.Event()
+        self._batch = []
+        self._pos = 0
+        self._eof = False
+        self._last_index = None
+        self._thread = threading.Thread(target=self._read_routine,
+                                         name='RawDataReader', daemon=True)
+        self._thread.start()
+
+    @property
+    def last_index(self):
+        """The index of the last item consumed from the reader"""
+        return self._last_index
+
+    def eof(self):
+        return self._eof
+
+    def stop(self):
+        self._stopped.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._pos >= len(self._batch):
+            if self._eof:
+                raise StopIteration()
+            batch = self._queue.get()
+            if isinstance(batch, Exception):
+                self._eof = True
+                raise batch
+            if batch is None:
+                self._eof = True
+                raise StopIteration()
+            self._batch, self._pos = batch, 0
+        index, item = self._batch[self._pos]
+        self._pos += 1
+        self._last_index = index
+        return index, item
+
+    def _put(self, elem):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(elem, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read_routine(self):
+        batch = []
+        try:
+            for index, item in self._raw_data_visitor:
+                batch.append((index, item))
+                if len(batch) >= PIPELINE_BATCH_SIZE:
+                    if not self._put(batch):
+                        return
+                    batch = []
+        except Exception as e: # pylint: disable=broad-except
+            logging.warning("raw data reader failed, reason %s", e)
+            if batch and not self._put(batch):
+                return
+            self._put(e)
+            return
+        if batch and not self._put(batch):
+            return
+        self._put(None)
+
+
+class _DataBlockWriter(object):
+    """Writer stage of the dumper. A thread builds the data blocks from the
+    matched items, and finishes a data block once all of its items are
+    written"""
+    def __init__(self, new_data_block_builder, on_data_block_dumped):
+        self._new_data_block_builder = new_data_block_builder
+        self._on_data_block_dumped = on_data_block_dumped
+        self._queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        self._error = None
+        self._thread = threading.Thread(target=self._write_routine,
+                                         name='DataBlockWriter', daemon=True)
+        self._thread.start()
+
+    def begin(self, meta):
+        self._put(('begin', (meta, time.time())))
+
+    def write(self, items):
+        if items:
+            self._put(('write', items))
+
+    def finish(self, meta):
+        self._put(('finish', meta))
+
+    def close(self):
+        """Wait for the queued data blocks to be dumped"""
+        self._queue.put(None)
+        self._thread.join()
+        self._check_error()
+
+    def _put(self, task):
+        self._check_error()
+        self._queue.put(task)
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _write_routine(self):
+        builder, start_tm = None, None
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            if self._error is not None:
+                # drain the queue so the matching stage is never blocked
+                continue
+            try:
+                op, arg = task
+                if op == 'begin':
+                    meta, start_tm = arg
+                    builder = self._new_data_block_builder(meta)
+                elif op == 'write':
+                    for item in arg:
+                        builder.write_item(item)
+                else:
+                    dumped_meta = builder.finish_data_block(True)
+                    assert dumped_meta == arg, "the generated dumped meta "\
+                                               "should be the same with "\
+                                               "input mata"
+                    builder = None
+                    self._on_data_block_dumped(arg, start_tm)
+            except Exception as e: # pylint: disable=broad-except
+                logging.warning("data block writer failed, reason %s", e)
+                self._error = e
+
 
 class DataBlockDumperManager(object):
     def __init__(self, kvstore, data_source, partition_id,
@@ -91,16 +245,21 @@ class DataBlockDumperManager(object):
         self._release_state_stale()
 
     def _dump_data_blocks(self):
-        while self.need_dump():
+        # the raw data is read, matched against the metas and written to
+        # data blocks by three stages overlapping with each other. The
+        # consecutive metas are dumped in one sequential pass of raw data
+        reader = None
+        writer = _DataBlockWriter(self._new_data_block_builder,
+                                  self._on_data_block_dumped)
+        try:
             meta = self._get_next_data_block_meta()
-            if meta is not None:
-                start_tm = time.time()
-                self._raw_data_visitor.active_visitor()
-                self._dump_data_block_by_meta(meta)
-                dump_duration = time.time() - start_tm
-                metrics.emit_timer(name='data_block_dump_duration',
-                                   value=int(dump_duration),
-                                   tags=self._metrics_tags)
+            while meta is not None:
+                reader = self._dump_data_block_by_meta(meta, reader, writer)
+                meta = self._get_data_block_meta_after(meta)
+        finally:
+            if reader is not None:
+                reader.stop()
+            writer.close()
 
     def data_block_meta_sync_finished(self):
         with self._lock:
@@ -120,57 +279,81 @@ class DataBlockDumperManager(object):
                 return None
             return self._fly_data_block_meta[0]
 
-    @contextmanager
-    def _make_data_block_builder(self, meta):
+    def _get_data_block_meta_after(self, meta):
+        with self._lock:
+            for fly_meta in self._fly_data_block_meta:
+                if fly_meta.data_block_index > meta.data_block_index:
+                    return fly_meta
+            return None
+
+    def _new_data_block_builder(self, meta):
         assert self._partition_id == meta.partition_id, \
             "partition id of building data block meta mismatch "\
             "{} != {}".format(self._partition_id, meta.partition_id)
-        builder = None
-        expt = None
+        builder = DataBlockBuilder(
+                common.data_source_data_block_dir(self._data_source),
+                self._data_source.data_source_meta.name,
+                self._partition_id,
+                meta.data_block_index,
+                self._data_block_builder_options
+            )
+        builder.init_by_meta(meta)
+        builder.set_data_block_manager(self._data_block_manager)
+        return builder
+
+    def _on_data_block_dumped(self, meta, start_tm):
+        with self._lock:
+            assert self._fly_data_block_meta[0] == meta
+            self._fly_data_block_meta.pop(0)
+        metrics.emit_timer(name='data_block_dump_duration',
+                           value=int(time.time() - start_tm),
+                           tags=self._metrics_tags)
+
+    def _start_raw_data_reader(self, target_index):
+        """Position the raw data visitor at target_index, then read ahead
+        from the item after it"""
+        self._raw_data_visitor.active_visitor()
         try:
-            builder = DataBlockBuilder(
-                    common.data_source_data_block_dir(self._data_source),
-                    self._data_source.data_source_meta.name,
-                    self._partition_id,
-                    meta.data_block_index,
-                    self._data_block_builder_options
-                )
-            builder.init_by_meta(meta)
-            builder.set_data_block_manager(self._data_block_manager)
-            yield builder
-        except Exception as e: # pylint: disable=broad-except
-            logging.warning("Failed make data block builder, " \
-                             "reason %s", e)
-            expt = e
-        if builder is not None:
-            del builder
-        if expt is not None:
-            raise expt
-
-    def _dump_data_block_by_meta(self, meta):
+            if target_index < 0:
+                self._raw_data_visitor.reset()
+            else:
+                self._raw_data_visitor.seek(target_index)
+        except StopIteration:
+            logging.fatal("raw data finished before when seek to %d",
+                          target_index)
+            traceback.print_stack()
+            os._exit(-1) # pylint: disable=protected-access
+        return _RawDataReader(self._raw_data_visitor)
+
+    def _dump_data_block_by_meta(self, meta, reader, writer):
+        """Match the items of meta from the reader and pass them to the
+        writer. The reader is kept reading if the meta starts after the
+        items it has been consumed, otherwise it is restarted at the meta.
+        Return the reader for the next meta"""
         assert meta is not None, "input data block must not be None"
-        with self._make_data_block_builder(meta) as data_block_builder:
-            try:
-                if meta.leader_start_index == 0:
-                    self._raw_data_visitor.reset()
-                else:
-                    assert meta.leader_start_index > 0, \
-                        "leader start index must be positive"
-                    self._raw_data_visitor.seek(meta.leader_start_index-1)
-            except StopIteration:
-                logging.fatal("raw data finished before when seek to %d",
-                              meta.leader_start_index-1)
-                traceback.print_stack()
-                os._exit(-1) # pylint: disable=protected-access
-            match_index = 0
-            example_num = len(meta.example_ids)
-            is_v2 = len(meta.indices) > 0
-            def if_match(meta, match_index, index, example_id, is_v2):
-                if is_v2:
-                    return meta.indices[match_index] == index
-                return example_id == meta.example_ids[match_index]
-
-            for (index, item) in self._raw_data_visitor:
+        assert meta.leader_start_index >= 0, \
+            "leader start index must be non-negative"
+        if reader is not None and (reader.last_index is None or
+                reader.last_index >= meta.leader_start_index):
+            reader.stop()
+            reader = None
+        if reader is None:
+            reader = self._start_raw_data_reader(meta.leader_start_index - 1)
+        writer.begin(meta)
+        match_index = 0
+        example_num = len(meta.example_ids)
+        is_v2 = len(meta.indices) > 0
+        def if_match(meta, match_index, index, example_id, is_v2):
+            if is_v2:
+                return meta.indices[match_index] == index
+            return example_id == meta.example_ids[match_index]
+
+        items = []
+        reader_restarted = False
+        while True:
+            for (index, item) in reader:
+                if index < meta.leader_start_index:
+                    continue
                 example_id = item.example_id
                 joined = False
                 # Elements in meta.example_ids maybe duplicated
@@ -179,31 +362,42 @@ class DataBlockDumperManager(object):
                     if len(meta.joined) > 0:
                         item.add_extra_fields({
                             'joined': meta.joined[match_index]}, True)
-                    data_block_builder.write_item(item)
+                    items.append(item)
                     self._optional_stats.update_stats(item, kind='joined')
                     match_index += 1
                     joined = True
                 if not joined:
                     self._optional_stats.update_stats(item, kind='unjoined')
+                if len(items) >= PIPELINE_BATCH_SIZE:
+                    writer.write(items)
+                    items = []
                 if match_index >= example_num:
                     break
                 if index >= meta.leader_end_index:
                     break
-            if match_index < example_num:
-                logging.fatal(
-                        "Data lose corrupt! only match %d/%d example "
-                        "for data block %s",
-                        match_index, example_num, meta.block_id
-                    )
-                traceback.print_stack()
-                os._exit(-1) # pylint: disable=protected-access
-            dumped_meta = data_block_builder.finish_data_block(True)
-            self._optional_stats.emit_optional_stats()
-            assert dumped_meta == meta, "the generated dumped meta should "\
-                                        "be the same with input mata"
-            with self._lock:
-                assert self._fly_data_block_meta[0] == meta
-                self._fly_data_block_meta.pop(0)
+            if match_index >= example_num or not reader.eof() or \
+                    reader_restarted:
+                break
+            # the raw data may be appended after the reader started
+            last_index = reader.last_index
+            reader.stop()
+            reader = self._start_raw_data_reader(
+                    meta.leader_start_index - 1 if last_index is None
+                    else last_index
+                )
+            reader_restarted = True
+        if match_index < example_num:
+            logging.fatal(
+                    "Data lose corrupt! only match %d/%d example "
+                    "for data block %s",
+                    match_index, example_num, meta.block_id
+                )
+            traceback.print_stack()
+            os._exit(-1) # pylint: disable=protected-access
+        writer.write(items)
+        writer.finish(meta)
+        self._optional_stats.emit_optional_stats()
+        return reader
 
     def _is_state_stale(self):
         with self._lock:
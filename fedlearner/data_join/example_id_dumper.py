@@ -25,10 +25,14 @@ import tensorflow_io # pylint: disable=unused-import
 from tensorflow.compat.v1 import gfile
 
 from fedlearner.common import metrics
+from fedlearner.common import data_join_service_pb2 as dj_pb
 
 from fedlearner.data_join.example_id_visitor import (
     ExampleIdManager, encode_example_id_dumped_fname
 )
+from fedlearner.data_join.example_id_filter import (
+    ExampleIdBloomFilter, example_id_filter_fpath
+)
 from fedlearner.data_join import visitor, common
 
 class ExampleIdDumperManager(object):
@@ -105,6 +109,9 @@ class ExampleIdDumperManager(object):
                 example_id_dump_options.example_id_dump_interval
         self._dump_threshold = \
                 example_id_dump_options.example_id_dump_threshold
+        self._filter_false_positive_rate = \
+                example_id_dump_options.example_id_filter_false_positive_rate
+        self._example_id_filter_published = False
         self._fly_example_id_batch = []
         self._example_id_sync_finished = False
         self._latest_dump_timestamp = time.time()
@@ -156,7 +163,9 @@ class ExampleIdDumperManager(object):
         with self._lock:
             if len(self._fly_example_id_batch) > 0:
                 return True
-            return self._need_finish_dumper(self._example_id_sync_finished)
+            if self._need_finish_dumper(self._example_id_sync_finished):
+                return True
+            return self._need_publish_example_id_filter()
 
     def finish_sync_example_id(self):
         with self._lock:
@@ -172,6 +181,10 @@ class ExampleIdDumperManager(object):
             is_batch_finisehd = self._is_batch_finished()
             if self._need_finish_dumper(is_batch_finisehd):
                 self._finish_example_id_dumper()
+        with self._lock:
+            need_publish = self._need_publish_example_id_filter()
+        if need_publish:
+            self._publish_example_id_filter()
 
     def _acquire_state_stale(self):
         with self._lock:
@@ -199,6 +212,51 @@ class ExampleIdDumperManager(object):
             return True
         return False
 
+    def _need_publish_example_id_filter(self):
+        return self._filter_false_positive_rate > 0 and \
+                self._example_id_sync_finished and \
+                not self._example_id_filter_published and \
+                len(self._fly_example_id_batch) == 0 and \
+                self._example_id_dumper is None
+
+    def _publish_example_id_filter(self):
+        """Build the bloom filter of all dumped example ids and write it
+        next to the dumped files, so the joiner could drop the raw data
+        never matching a synced example id"""
+        start_tm = time.time()
+        dumped_dir = self._example_id_manager.get_example_dumped_dir()
+        fpaths = [os.path.join(dumped_dir, f)
+                  for f in gfile.ListDirectory(dumped_dir)
+                  if f.endswith(common.DoneFileSuffix)]
+        end_index = self.get_dumped_index()
+        example_id_filter = ExampleIdBloomFilter.create(
+                end_index + 1, self._filter_false_positive_rate
+            )
+        for fpath in fpaths:
+            with common.make_tf_record_iter(fpath) as record_iter:
+                for record in record_iter:
+                    lite_example_ids = dj_pb.LiteExampleIds()
+                    lite_example_ids.ParseFromString(record)
+                    feature = lite_example_ids.features.feature
+                    example_id_filter.add_batch(
+                            feature['example_id'].bytes_list.value
+                        )
+        example_id_filter.set_end_index(end_index)
+        example_id_filter.dump(example_id_filter_fpath(dumped_dir))
+        with self._lock:
+            self._example_id_filter_published = True
+        logging.info("publish example id filter of %d example ids, %d "\
+                     "bytes for partition %d, cost %f seconds",
+                     example_id_filter.count,
+                     example_id_filter.size_in_bytes,
+                     self._partition_id, time.time() - start_tm)
+        metrics.emit_store(name='example_id_filter_size',
+                           value=example_id_filter.size_in_bytes,
+                           tags=self._metrics_tags)
+        metrics.emit_store(name='example_id_filter_false_positive_rate',
+                           value=example_id_filter.false_positive_rate(),
+                           tags=self._metrics_tags)
+
     def _is_batch_finished(self):
         with self._lock:
             if not self._example_id_sync_finished:
@@ -0,0 +1,161 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import hashlib
+import logging
+import math
+import os
+import struct
+
+import numpy as np
+from tensorflow.compat.v1 import gfile
+
+from fedlearner.data_join import common
+
+ExampleIdFilterFname = 'example_id_filter.bloom'
+
+_FILTER_MAGIC = b'EIBF'
+_FILTER_HEADER = struct.Struct('<4sIQQq')
+_MAX_HASH_NUM = 30
+
+
+def _hash_example_ids(example_ids):
+    digests = b''.join(hashlib.blake2b(eid, digest_size=8).digest()
+                       for eid in example_ids)
+    return np.frombuffer(digests, dtype='<u8')
+
+
+def _normalize_example_id(example_id):
+    if isinstance(example_id, str):
+        return example_id.encode()
+    return example_id
+
+
+class ExampleIdBloomFilter(object):
+    """Bloom filter of the example ids synced from the peer. Positions of
+    an id are h1 + i * h2 mod num_bits for i < hash_num, h1 and h2 being
+    the halves of its 64 bits blake2b digest, so the filter built on one
+    worker answers the same on any other"""
+    def __init__(self, num_bits, hash_num, count=0, end_index=-1, bits=None):
+        self._num_bits = max(num_bits, 8)
+        self._hash_num = hash_num
+        self._count = count
+        self._end_index = end_index
+        if bits is None:
+            bits = np.zeros((self._num_bits + 7) // 8, dtype=np.uint8)
+        self._bits = bits
+
+    @classmethod
+    def create(cls, capacity, false_positive_rate):
+        """Size the filter for capacity ids at the given false positive
+        rate"""
+        capacity = max(capacity, 1)
+        num_bits = int(math.ceil(-capacity * math.log(false_positive_rate) /
+                                 (math.log(2) ** 2)))
+        num_bits = max((num_bits + 7) // 8 * 8, 8)
+        hash_num = int(round(num_bits / capacity * math.log(2)))
+        return cls(num_bits, min(max(hash_num, 1), _MAX_HASH_NUM))
+
+    @property
+    def num_bits(self):
+        return self._num_bits
+
+    @property
+    def hash_num(self):
+        return self._hash_num
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def end_index(self):
+        return self._end_index
+
+    @property
+    def size_in_bytes(self):
+        return len(self._bits)
+
+    def set_end_index(self, end_index):
+        self._end_index = end_index
+
+    def false_positive_rate(self):
+        """The expected false positive rate with the ids added so far"""
+        return (1.0 - math.exp(-self._hash_num * self._count /
+                               self._num_bits)) ** self._hash_num
+
+    def add_batch(self, example_ids):
+        example_ids = [_normalize_example_id(eid) for eid in example_ids]
+        if not example_ids:
+            return
+        positions = self._positions(_hash_example_ids(example_ids))
+        np.bitwise_or.at(self._bits, positions >> 3,
+                         np.left_shift(1, positions & 7).astype(np.uint8))
+        self._count += len(example_ids)
+
+    def __contains__(self, example_id):
+        digest = hashlib.blake2b(_normalize_example_id(example_id),
+                                 digest_size=8).digest()
+        h = int.from_bytes(digest, 'little')
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        bits = self._bits
+        for i in range(self._hash_num):
+            pos = (h1 + i * h2) % self._num_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def _positions(self, hashes):
+        h1 = hashes & np.uint64(0xffffffff)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        steps = np.arange(self._hash_num, dtype=np.uint64)
+        positions = (h1[:, None] + steps[None, :] * h2[:, None]) % \
+                np.uint64(self._num_bits)
+        return positions.ravel().astype(np.int64)
+
+    def dump(self, fpath):
+        """Write the filter to fpath through a tmp file"""
+        tmp_fpath = common.gen_tmp_fpath(os.path.dirname(fpath))
+        with gfile.GFile(tmp_fpath, 'wb') as fh:
+            fh.write(_FILTER_HEADER.pack(_FILTER_MAGIC, self._hash_num,
+                                         self._num_bits, self._count,
+                                         self._end_index))
+            fh.write(self._bits.tobytes())
+        gfile.Rename(tmp_fpath, fpath, True)
+
+    @classmethod
+    def load(cls, fpath):
+        """Return the filter dumped to fpath, None if there is no valid
+        filter"""
+        if not gfile.Exists(fpath):
+            return None
+        with gfile.GFile(fpath, 'rb') as fh:
+            data = fh.read()
+        if len(data) < _FILTER_HEADER.size:
+            logging.warning("example id filter %s is truncated", fpath)
+            return None
+        magic, hash_num, num_bits, count, end_index = \
+                _FILTER_HEADER.unpack_from(data)
+        bits = np.frombuffer(data, dtype=np.uint8,
+                             offset=_FILTER_HEADER.size)
+        if magic != _FILTER_MAGIC or len(bits) != (num_bits + 7) // 8:
+            logging.warning("example id filter %s is corrupted", fpath)
+            return None
+        return cls(num_bits, hash_num, count, end_index, bits)
+
+
+def example_id_filter_fpath(example_dumped_dir):
+    return os.path.join(example_dumped_dir, ExampleIdFilterFname)
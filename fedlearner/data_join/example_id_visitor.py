@@ -17,12 +17,13 @@
 import logging
 import os
 import traceback
+from collections import OrderedDict
 
+import numpy as np
 from google.protobuf import text_format, empty_pb2
 
 import tensorflow_io # pylint: disable=unused-import
 from tensorflow.compat.v1 import gfile
-import tensorflow.compat.v1 as tf
 
 from fedlearner.common import data_join_service_pb2 as dj_pb
 from fedlearner.data_join import visitor
@@ -30,8 +31,7 @@ from fedlearner.data_join.common import (
     DoneFileSuffix, make_tf_record_iter,
     partition_repr, example_id_anchor_kvstore_key,
     data_source_example_dumped_dir,
-    SYNC_ALLOWED_OPTIONAL_FIELDS,
-    convert_tf_example_to_dict
+    SYNC_ALLOWED_OPTIONAL_FIELDS, ALLOWED_FIELDS, InvalidEventTime
 )
 from fedlearner.data_join.raw_data_iter_impl import (
     tf_record_iter, raw_data_iter
@@ -241,14 +241,132 @@ class ExampleIdManager(visitor.IndexMetaManager):
             traceback.print_stack()
             os._exit(-1) # pylint: disable=protected-access
 
+class ExampleIdBlock(object):
+    """Columns of the example ids in one LiteExampleIds record. The int
+    fields are numpy arrays, the bytes fields are lists of bytes, and the
+    index column holds the index of every example id"""
+    def __init__(self, begin_index, columns):
+        self._begin_index = begin_index
+        self._columns = columns
+
+    @classmethod
+    def from_lite_example_ids(cls, lite_example_ids):
+        feature = lite_example_ids.features.feature
+        begin_index = lite_example_ids.begin_index
+        num = len(feature['example_id'].bytes_list.value) \
+                if 'example_id' in feature else 0
+        columns = OrderedDict()
+        for fn in SYNC_ALLOWED_OPTIONAL_FIELDS:
+            if fn not in feature:
+                continue
+            kind = feature[fn].WhichOneof('kind')
+            if kind == 'bytes_list':
+                column = list(feature[fn].bytes_list.value)
+            elif kind == 'int64_list':
+                column = np.array(feature[fn].int64_list.value,
+                                  dtype=np.int64)
+            elif kind == 'float_list':
+                column = np.array(feature[fn].float_list.value,
+                                  dtype=np.float32)
+            else:
+                continue
+            if len(column) == 0:
+                continue
+            if len(column) != num:
+                logging.warning("ignore field %s of example ids from %d "\
+                                "since %d values for %d example ids", fn,
+                                begin_index, len(column), num)
+                continue
+            columns[fn] = column
+        columns['index'] = np.arange(begin_index, begin_index + num,
+                                     dtype=np.int64)
+        return cls(begin_index, columns)
+
+    @property
+    def begin_index(self):
+        return self._begin_index
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @property
+    def indices(self):
+        return self._columns['index']
+
+    @property
+    def example_ids(self):
+        return self._columns.get('example_id', [])
+
+    @property
+    def event_times(self):
+        """The event times as an int64 array, InvalidEventTime for the
+        example ids without one"""
+        if 'event_time' in self._columns:
+            return self._columns['event_time']
+        return np.full(len(self), InvalidEventTime, dtype=np.int64)
+
+    def column(self, name):
+        return self._columns.get(name)
+
+    def slice(self, begin, end):
+        columns = OrderedDict((name, column[begin:end])
+                              for name, column in self._columns.items())
+        return ExampleIdBlock(self._begin_index + begin, columns)
+
+    def item(self, pos):
+        return ExampleIdVisitor.ExampleIdItem(self, pos)
+
+    def __len__(self):
+        return len(self._columns['index'])
+
 class ExampleIdVisitor(visitor.Visitor):
     class ExampleIdItem(raw_data_iter.RawDataIter.Item):
-        def __init__(self, index, row):
-            super().__init__()
-            row['index'] = index
-            self._features.update(row)
+        """Row pos of an ExampleIdBlock. Fields are read from the columns
+        of the block, the row dict is only built if it is required"""
+        def __init__(self, block, pos): # pylint: disable=super-init-not-called
+            self._block = block
+            self._pos = pos
+            self._row = None
+
+        @property
+        def _features(self):
+            if self._row is None:
+                self._row = OrderedDict()
+                for name, column in self._block.columns.items():
+                    value = column[self._pos]
+                    if isinstance(value, np.generic):
+                        value = value.item()
+                    self._row[name] = value
+            return self._row
+
+        @property
+        def block(self):
+            return self._block
+
+        @property
+        def pos(self):
+            return self._pos
+
+        def __getattr__(self, item):
+            if item.startswith('_'):
+                raise AttributeError(item)
+            column = self._block.column(item)
+            if column is None or self._row is not None:
+                return super().__getattr__(item)
+            value = column[self._pos]
+            if isinstance(value, np.generic):
+                value = value.item()
+            if not isinstance(value, ALLOWED_FIELDS[item].type):
+                value = ALLOWED_FIELDS[item].type(value)
+            return value
 
     class ExampleIdIter(tf_record_iter.TfRecordIter):
+        def __init__(self, options):
+            super().__init__(options)
+            self._block = None
+            self._pos = None
+
         @classmethod
         def name(cls):
             return 'EXAMPLE_ID_TF_RECORD'
@@ -258,26 +376,31 @@ class ExampleIdVisitor(visitor.Visitor):
                 for record in record_iter:
                     lite_example_ids = dj_pb.LiteExampleIds()
                     lite_example_ids.ParseFromString(record)
-                    tf_example = tf.train.Example(
-                        features=lite_example_ids.features)
-                    rows = convert_tf_example_to_dict(tf_example)
-
-                    example_id_num = len(rows['example_id'])
-                    index = 0
-                    while index < example_id_num:
-                        row = dict()
-                        for fn in SYNC_ALLOWED_OPTIONAL_FIELDS:
-                            if fn not in rows:
-                                continue
-                            value_list = rows[fn]
-                            if len(value_list) > 0:
-                                row[fn] = value_list[index]
-                        example_id_item = ExampleIdVisitor.ExampleIdItem(
-                                index + lite_example_ids.begin_index,
-                                row
-                            )
-                        yield example_id_item
-                        index += 1
+                    block = ExampleIdBlock.from_lite_example_ids(
+                            lite_example_ids
+                        )
+                    self._block, self._pos = block, 0
+                    # next_block moves self._pos forward to skip the rows
+                    # it returns
+                    while self._pos < len(block):
+                        yield block.item(self._pos)
+                        self._pos += 1
+
+        def next_block(self, max_count):
+            """Return the block of at most max_count example ids following
+            the current one. The block does not go across the record of the
+            current one unless the current one is the last of its record"""
+            self._check_valid()
+            if self._iter_failed or self._pos + 1 >= len(self._block):
+                next(self)
+                begin = self._pos
+            else:
+                begin = self._pos + 1
+            end = min(len(self._block), begin + max(max_count, 1))
+            self._index += end - 1 - self._pos
+            self._pos = end - 1
+            self._item = self._block.item(self._pos)
+            return self._block.slice(begin, end)
 
     def __init__(self, kvstore, data_source, partition_id):
         super(ExampleIdVisitor, self).__init__(
@@ -292,5 +415,30 @@ class ExampleIdVisitor(visitor.Visitor):
             self._set_end_index(end_index)
             self._finished = False
 
+    def get_example_dumped_dir(self):
+        return self._index_mata_manager.get_example_dumped_dir()
+
+    def get_last_dumped_index(self):
+        return self._index_mata_manager.get_last_dumped_index()
+
+    def next_block(self, max_count):
+        """Return the block of at most max_count example ids following the
+        current one, raise StopIteration as next if there is no more. This
+        is the batched version of next for the joiners consuming columns
+        rather than items"""
+        if self._iter is not None and self._end_index is not None:
+            max_count = min(max_count,
+                            self._end_index - self._iter.get_index())
+        if not self._finished and self._iter is not None and max_count > 0:
+            try:
+                block = self._iter.next_block(max_count)
+                self._update_visited_max_index()
+                return block
+            except StopIteration:
+                pass
+        # go across the dumped files or finish by the per item path
+        _, item = self._next_internal()
+        return item.block.slice(item.pos, item.pos + 1)
+
     def _new_iter(self):
         return ExampleIdVisitor.ExampleIdIter(None)
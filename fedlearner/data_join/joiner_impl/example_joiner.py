@@ -24,6 +24,9 @@ from fedlearner.common import metrics
 from fedlearner.data_join import common
 from fedlearner.data_join.data_block_manager import \
     DataBlockManager, DataBlockBuilder
+from fedlearner.data_join.example_id_filter import (
+    ExampleIdBloomFilter, example_id_filter_fpath
+)
 from fedlearner.data_join.example_id_visitor import ExampleIdVisitor
 from fedlearner.data_join.joiner_impl.joiner_stats import JoinerStats
 from fedlearner.data_join.joiner_impl.optional_stats import OptionalStats
@@ -61,6 +64,8 @@ class ExampleJoiner(object):
         self._sync_example_id_finished = False
         self._raw_data_finished = False
         self._join_finished = False
+        self._example_id_filter_checked = False
+        self._emitted_skipped_count = 0
         ds_name = self._data_source.data_source_meta.name
         self._metrics_tags = {'data_source_name': ds_name,
                               'partition': partition_id,
@@ -133,6 +138,50 @@ class ExampleJoiner(object):
         self._active_visitors()
         return sync_example_id_finished, raw_data_finished
 
+    def _install_example_id_filter(self, sync_example_id_finished,
+                                   skip_fn=None):
+        """Let the follower visitor skip the raw data whose example id is
+        not synced, once the bloom filter of all the synced example ids is
+        published. skip_fn is called with every skipped item"""
+        if self._example_id_filter_checked or not sync_example_id_finished:
+            return
+        self._example_id_filter_checked = True
+        fpath = example_id_filter_fpath(
+                self._leader_visitor.get_example_dumped_dir()
+            )
+        example_id_filter = ExampleIdBloomFilter.load(fpath)
+        if example_id_filter is None:
+            return
+        dumped_index = self._leader_visitor.get_last_dumped_index()
+        dumped_index = -1 if dumped_index is None else dumped_index
+        if example_id_filter.end_index != dumped_index:
+            logging.warning("ignore example id filter for partition %d "\
+                            "since it covers to %d rather than %d",
+                            self._partition_id, example_id_filter.end_index,
+                            dumped_index)
+            return
+        self._follower_visitor.set_example_id_filter(example_id_filter,
+                                                     skip_fn)
+        logging.info("install example id filter of %d bytes for partition "\
+                     "%d", example_id_filter.size_in_bytes,
+                     self._partition_id)
+        metrics.emit_store(name='example_id_filter_size',
+                           value=example_id_filter.size_in_bytes,
+                           tags=self._metrics_tags)
+        metrics.emit_store(name='example_id_filter_false_positive_rate',
+                           value=example_id_filter.false_positive_rate(),
+                           tags=self._metrics_tags)
+
+    def _emit_example_id_filter_metrics(self):
+        skipped_count = self._follower_visitor.get_skipped_count()
+        if skipped_count > self._emitted_skipped_count:
+            metrics.emit_counter(
+                    name='example_id_filter_skipped_rows',
+                    value=skipped_count - self._emitted_skipped_count,
+                    tags=self._metrics_tags
+                )
+            self._emitted_skipped_count = skipped_count
+
     def _inner_joiner(self, reset_state):
         raise NotImplementedError(
                 "_inner_joiner not implement for base class: %s" %
@@ -193,6 +242,7 @@ class ExampleJoiner(object):
                     True, self._metrics_tags
                 )
             self._optional_stats.emit_optional_stats()
+            self._emit_example_id_filter_metrics()
             self._reset_data_block_builder()
             self._update_latest_dump_timestamp()
             return meta
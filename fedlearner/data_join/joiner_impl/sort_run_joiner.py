@@ -28,6 +28,7 @@ class SortRunExampleJoiner(ExampleJoiner):
             return
         sync_example_id_finished, raw_data_finished = \
                 self._prepare_join(state_stale)
+        self._install_example_id_filter(sync_example_id_finished)
         for fi, li, fe in self._make_joined_generator():
             builder = self._get_data_block_builder(True)
             assert builder is not None
@@ -17,6 +17,8 @@
 import logging
 import time
 
+import numpy as np
+
 import fedlearner.data_join.common as common
 from fedlearner.common import metrics
 from fedlearner.data_join.joiner_impl.example_joiner import ExampleJoiner
@@ -25,9 +27,17 @@ from fedlearner.data_join.negative_example_generator \
 
 
 class _CmpCtnt(object):
-    def __init__(self, item):
-        self._event_time = item.event_time
-        self._example_id = item.example_id
+    def __init__(self, event_time, example_id):
+        self._event_time = event_time
+        self._example_id = example_id
+
+    @property
+    def event_time(self):
+        return self._event_time
+
+    @property
+    def example_id(self):
+        return self._example_id
 
     def __lt__(self, other):
         assert isinstance(other, _CmpCtnt)
@@ -45,14 +55,19 @@ class _CmpCtnt(object):
 
 
 class _JoinWindow(object):
+    """Window of (index, item) pairs. The event times and the hashes of the
+    example ids are kept in numpy arrays next to the items, so that the
+    watermarks are selected by np.partition and example ids are matched in
+    bulk by their hashes"""
     def __init__(self, pt_rate, qt_rate):
         assert 0.0 <= pt_rate <= 1.0, \
             "pt_rate {} should in [0.0, 1.0]".format(pt_rate)
         assert 0.0 <= qt_rate <= 1.0, \
             "qt_rate {} should in [0.0, 1.0]".format(qt_rate)
         self._buffer = []
-        self._cmp_ctnt = []
-        self._cmp_ctnt_sorted = True
+        self._event_times = np.zeros(0, dtype=np.int64)
+        self._example_id_hashes = np.zeros(0, dtype=np.int64)
+        self._pt_cache = {}
         self._pt_rate = pt_rate
         self._qt_rate = qt_rate
         self._committed_pt = None
@@ -61,15 +76,43 @@ class _JoinWindow(object):
         return iter(self._buffer)
 
     def append(self, index, item):
-        if len(self._cmp_ctnt) > 0 and \
-                self._cmp_ctnt[-1] > _CmpCtnt(item):
-            self._cmp_ctnt_sorted = False
-        self._cmp_ctnt.append(_CmpCtnt(item))
+        size = len(self._buffer)
+        if size == len(self._event_times):
+            capacity = max(2 * size, 1024)
+            self._event_times = np.resize(self._event_times, capacity)
+            self._example_id_hashes = \
+                    np.resize(self._example_id_hashes, capacity)
+        self._event_times[size] = item.event_time
+        self._example_id_hashes[size] = hash(item.example_id)
         self._buffer.append((index, item))
+        self._pt_cache = {}
+
+    def extend(self, indices, items, event_times, example_ids):
+        """Append the items at the indices in bulk, their event times and
+        example ids given as columns"""
+        size = len(self._buffer)
+        count = len(items)
+        if size + count > len(self._event_times):
+            capacity = max(2 * size, size + count, 1024)
+            self._event_times = np.resize(self._event_times, capacity)
+            self._example_id_hashes = \
+                    np.resize(self._example_id_hashes, capacity)
+        self._event_times[size:size+count] = event_times
+        self._example_id_hashes[size:size+count] = np.fromiter(
+                (hash(example_id) for example_id in example_ids),
+                dtype=np.int64, count=count)
+        self._buffer.extend(zip(indices, items))
+        self._pt_cache = {}
 
     def size(self):
         return len(self._buffer)
 
+    def event_times(self):
+        return self._event_times[:len(self._buffer)]
+
+    def example_id_hashes(self):
+        return self._example_id_hashes[:len(self._buffer)]
+
     def forward_pt(self):
         if len(self._buffer) == 0:
             return False
@@ -86,14 +129,44 @@ class _JoinWindow(object):
         return self._cal_pt(self._qt_rate)
 
     def reset(self, new_buffer, state_stale):
-        self._cmp_ctnt = [_CmpCtnt(item[1]) for item in new_buffer]
         self._buffer = new_buffer
+        self._event_times = np.array(
+                [item.event_time for _, item in new_buffer], dtype=np.int64)
+        self._example_id_hashes = np.array(
+                [hash(item.example_id) for _, item in new_buffer],
+                dtype=np.int64)
+        self._pt_cache = {}
         if state_stale:
             self._committed_pt = None
-        self._cmp_ctnt_sorted = \
-                all((self._cmp_ctnt[i] < self._cmp_ctnt[i+1] or
-                     self._cmp_ctnt[i] == self._cmp_ctnt[i+1])
-                    for i in range(len(self._cmp_ctnt)-1))
+
+    def retain(self, positions):
+        """Keep the items at the ascending positions only"""
+        self._event_times = self.event_times()[positions]
+        self._example_id_hashes = self.example_id_hashes()[positions]
+        self._buffer = [self._buffer[pos] for pos in positions]
+        self._pt_cache = {}
+
+    def less_than(self, pt):
+        """Return whether the items order before pt, as a bool array"""
+        if pt is None:
+            return np.ones(len(self._buffer), dtype=bool)
+        event_times = self.event_times()
+        mask = event_times < pt.event_time
+        for pos in np.flatnonzero(event_times == pt.event_time):
+            mask[pos] = self._buffer[pos][1].example_id < pt.example_id
+        return mask
+
+    def match_example_ids(self, example_ids):
+        """Return whether the example ids of the items are in example_ids,
+        as a bool array. Only the items whose hash matches are compared"""
+        mask = np.zeros(len(self._buffer), dtype=bool)
+        if not example_ids or not self._buffer:
+            return mask
+        hashes = np.fromiter((hash(example_id) for example_id in example_ids),
+                             dtype=np.int64, count=len(example_ids))
+        for pos in np.flatnonzero(np.isin(self.example_id_hashes(), hashes)):
+            mask[pos] = self._buffer[pos][1].example_id in example_ids
+        return mask
 
     def __getitem__(self, index):
         return self._buffer[index]
@@ -101,13 +174,21 @@ class _JoinWindow(object):
     def _cal_pt(self, rate):
         if not self._buffer:
             return None
-        if not self._cmp_ctnt_sorted:
-            self._cmp_ctnt.sort()
-            self._cmp_ctnt_sorted = True
         pos = int(len(self._buffer) * rate)
         if pos == len(self._buffer):
             pos = len(self._buffer) - 1
-        return self._cmp_ctnt[pos]
+        if pos not in self._pt_cache:
+            # the item of rank pos by (event_time, example_id), only the
+            # items tied on event time are compared by example id
+            event_times = self.event_times()
+            event_time = np.partition(event_times, pos)[pos]
+            rank = pos - np.count_nonzero(event_times < event_time)
+            example_ids = sorted(
+                self._buffer[i][1].example_id
+                for i in np.flatnonzero(event_times == event_time))
+            self._pt_cache[pos] = \
+                    _CmpCtnt(int(event_time), example_ids[rank])
+        return self._pt_cache[pos]
 
 
 class StreamExampleJoiner(ExampleJoiner):
@@ -124,7 +205,6 @@ class StreamExampleJoiner(ExampleJoiner):
         self._leader_join_window = _JoinWindow(0.05, 0.99)
         self._follower_join_window = _JoinWindow(0.05, 0.90)
         self._joined_cache = {}
-        self._leader_unjoined_example_ids = []
         self._follower_example_cache = {}
         self._fill_leader_enough = False
 
@@ -146,6 +226,8 @@ class StreamExampleJoiner(ExampleJoiner):
             return
         sync_example_id_finished, raw_data_finished = \
                 self._prepare_join(state_stale)
+        self._install_example_id_filter(sync_example_id_finished,
+                                        self._count_skipped_item)
         logging.info("streaming joiner: sync_example_id_finished: %s,"
                      "raw_data_finished: %s", sync_example_id_finished,
                      raw_data_finished)
@@ -162,7 +244,7 @@ class StreamExampleJoiner(ExampleJoiner):
                            self._leader_join_window.size(),
                            self._follower_join_window.size(),
                           len(self._follower_example_cache),
-                          len(self._leader_unjoined_example_ids))
+                          self._leader_unjoined_count)
             while delay_dump and \
                     self._fill_follower_join_window(raw_data_finished):
                 follower_exhausted = raw_data_finished and \
@@ -190,7 +272,7 @@ class StreamExampleJoiner(ExampleJoiner):
                            self._leader_join_window.size(),
                            self._follower_join_window.size(),
                           len(self._follower_example_cache),
-                          len(self._leader_unjoined_example_ids))
+                          self._leader_unjoined_count)
             if delay_dump or join_data_finished:
                 break
         if self._get_data_block_builder(False) is not None and \
@@ -220,19 +302,47 @@ class StreamExampleJoiner(ExampleJoiner):
         return True
 
     def _update_join_cache(self):
+        """Join the unjoined leader example ids with the follower items
+        appended since the last update. The leader ids are sorted by hash
+        once the leader window is filled, and the new follower ids are
+        looked up by np.searchsorted, so a step costs by the new items
+        rather than by the window sizes"""
         start_tm = time.time()
-        new_unjoined_example_ids = []
-        for example_id in self._leader_unjoined_example_ids:
-            if example_id in self._follower_example_cache:
-                self._joined_cache[example_id] = \
-                        self._follower_example_cache[example_id]
-            else:
-                new_unjoined_example_ids.append(example_id)
-        self._leader_unjoined_example_ids = new_unjoined_example_ids
+        follower_window = self._follower_join_window
+        start_pos = self._follower_probed_size
+        hashes = follower_window.example_id_hashes()[start_pos:]
+        self._follower_probed_size = follower_window.size()
+        if self._leader_unjoined_count > 0 and len(hashes) > 0:
+            lows = np.searchsorted(self._leader_unjoined_hashes, hashes,
+                                   side='left')
+            highs = np.searchsorted(self._leader_unjoined_hashes, hashes,
+                                    side='right')
+            for pos in np.flatnonzero(highs > lows):
+                example_id = follower_window[start_pos+pos][1].example_id
+                if example_id not in self._follower_example_cache:
+                    continue
+                for k in range(lows[pos], highs[pos]):
+                    leader_pos = self._leader_unjoined_positions[k]
+                    if self._leader_unjoined[k] and example_id == \
+                            self._leader_join_window[leader_pos][1].example_id:
+                        self._leader_unjoined[k] = False
+                        self._leader_unjoined_count -= 1
+                        self._joined_cache[example_id] = \
+                                self._follower_example_cache[example_id]
         metrics.emit_timer(name='stream_joiner_update_join_cache',
                            value=int(time.time()-start_tm),
                            tags=self._metrics_tags)
 
+    def _set_leader_unjoined(self):
+        hashes = self._leader_join_window.example_id_hashes()
+        self._leader_unjoined_positions = np.argsort(hashes, kind='stable')
+        self._leader_unjoined_hashes = \
+                hashes[self._leader_unjoined_positions]
+        self._leader_unjoined = np.ones(len(hashes), dtype=bool)
+        self._leader_unjoined_count = len(hashes)
+        # the follower items are joined with the new leader ids from start
+        self._follower_probed_size = 0
+
     def _dump_joined_items(self):
         start_tm = time.time()
         self._neg_samples = {}
@@ -277,7 +387,11 @@ class StreamExampleJoiner(ExampleJoiner):
         self._leader_join_window.reset([], state_stale)
         self._fill_leader_enough = False
         self._joined_cache = {}
-        self._leader_unjoined_example_ids = []
+        self._leader_unjoined_positions = np.zeros(0, dtype=np.int64)
+        self._leader_unjoined_hashes = np.zeros(0, dtype=np.int64)
+        self._leader_unjoined = np.zeros(0, dtype=bool)
+        self._leader_unjoined_count = 0
+        self._follower_probed_size = 0
         if state_stale:
             self._follower_join_window.reset([], True)
             self._follower_example_cache = {}
@@ -293,8 +407,7 @@ class StreamExampleJoiner(ExampleJoiner):
             else:
                 self._fill_leader_enough = True
             if self._fill_leader_enough:
-                self._leader_unjoined_example_ids = \
-                    [item.example_id for _, item in self._leader_join_window]
+                self._set_leader_unjoined()
             end_pos = self._leader_join_window.size()
             eids = [(self._leader_join_window[idx][0],
                      self._leader_join_window[idx][1].example_id)
@@ -337,50 +450,52 @@ class StreamExampleJoiner(ExampleJoiner):
                 return True
         return join_window.size() >= self._max_window_size
 
-    def _evict_if_useless(self, item):
-        outdated = self._leader_join_window.committed_pt() is None \
-                   or _CmpCtnt(item) < self._leader_join_window.committed_pt()
-        if outdated and item.example_id not in self._joined_cache:
-            self._optional_stats.update_stats(item, kind='unjoined')
-        return outdated or item.example_id in self._joined_cache
-
-    def _evict_if_force(self, item):
-        outdated = self._leader_join_window.qt() is None or \
-                _CmpCtnt(item) < self._leader_join_window.qt()
-        if outdated:
-            self._optional_stats.update_stats(item, kind='unjoined')
-        return outdated
-
-    def _evict_impl(self, candidates, filter_fn):
-        reserved_items = []
-        for (index, item) in candidates:
-            example_id = item.example_id
-            if filter_fn(item):
-                self._follower_example_cache.pop(example_id, None)
-            else:
-                reserved_items.append((index, item))
-        return reserved_items
+    def _count_skipped_item(self, item):
+        # the skipped items never join, count them as the unjoined items
+        # evicted from the follower window
+        self._optional_stats.update_stats(item, kind='unjoined')
+
+    def _evict_items(self, positions, unjoined):
+        window = self._follower_join_window
+        for pos, is_unjoined in zip(positions, unjoined):
+            item = window[pos][1]
+            if is_unjoined:
+                self._optional_stats.update_stats(item, kind='unjoined')
+            self._follower_example_cache.pop(item.example_id, None)
 
     def _evit_stale_follower_cache(self):
         start_tm = time.time()
-        tmp_sz = self._follower_join_window.size()
-        reserved_items = self._evict_impl(self._follower_join_window,
-                                          self._evict_if_useless)
-        logging.info("evict_if_useless %d to %d", tmp_sz, len(reserved_items))
-        if len(reserved_items) < self._max_window_size:
-            self._follower_join_window.reset(reserved_items, False)
-            return
-        tmp_sz = len(reserved_items)
-        reserved_items = self._evict_impl(reserved_items,
-                                          self._evict_if_force)
-        logging.info("evict_if_force %d to %d", tmp_sz, len(reserved_items))
-        self._follower_join_window.reset(reserved_items, False)
+        window = self._follower_join_window
+        tmp_sz = window.size()
+        # evict the items before the committed leader watermark, or joined
+        outdated = window.less_than(self._leader_join_window.committed_pt())
+        joined = window.match_example_ids(self._joined_cache)
+        evicted = outdated | joined
+        positions = np.flatnonzero(evicted)
+        self._evict_items(positions, ~joined[positions])
+        reserved = np.flatnonzero(~evicted)
+        logging.info("evict_if_useless %d to %d", tmp_sz, len(reserved))
+        if len(reserved) >= self._max_window_size:
+            # evict the items before the leader qt by force
+            tmp_sz = len(reserved)
+            forced = window.less_than(self._leader_join_window.qt())[reserved]
+            self._evict_items(reserved[forced],
+                              np.ones(np.count_nonzero(forced), dtype=bool))
+            reserved = reserved[~forced]
+            logging.info("evict_if_force %d to %d", tmp_sz, len(reserved))
+        self._follower_probed_size = \
+                int(np.count_nonzero(reserved < self._follower_probed_size))
+        window.retain(reserved)
         metrics.emit_timer(name='stream_joiner_evit_stale_follower_cache',
                            value=int(time.time()-start_tm),
                            tags=self._metrics_tags)
 
     def _consume_item_until_count(self, visitor, windows,
                                   required_item_count, cache=None):
+        if visitor is self._leader_visitor:
+            self._consume_block_until_count(visitor, windows,
+                                            required_item_count, cache)
+            return
         for (index, item) in visitor:
             if item.example_id == common.InvalidExampleId:
                 logging.warning("ignore item indexed as %d from %s since "\
@@ -397,6 +512,39 @@ class StreamExampleJoiner(ExampleJoiner):
         assert visitor.finished(), "visitor shoud be finished of "\
                                    "required_item is not satisfied"
 
+    def _consume_block_until_count(self, visitor, windows,
+                                   required_item_count, cache=None):
+        # the example ids are consumed by blocks of columns, at most the
+        # missing count at a time so no valid one is consumed beyond it
+        while windows.size() < required_item_count:
+            try:
+                block = visitor.next_block(
+                        required_item_count - windows.size()
+                    )
+            except StopIteration:
+                break
+            example_ids = block.example_ids
+            event_times = block.event_times
+            invalid_eid = np.fromiter(
+                    (eid == common.InvalidExampleId for eid in example_ids),
+                    dtype=bool, count=len(block))
+            invalid_et = event_times == common.InvalidEventTime
+            valid = np.flatnonzero(~(invalid_eid | invalid_et))
+            if len(valid) < len(block):
+                logging.warning("ignore %d items indexed in [%d, %d] from "\
+                                "%s since invalid example id or event time",
+                                len(block) - len(valid), block.indices[0],
+                                block.indices[-1], visitor.name())
+            indices = block.indices[valid].tolist()
+            items = [block.item(pos) for pos in valid]
+            valid_eids = [example_ids[pos] for pos in valid]
+            windows.extend(indices, items, event_times[valid], valid_eids)
+            if cache is not None:
+                cache.update(zip(valid_eids, zip(indices, items)))
+        if windows.size() < required_item_count:
+            assert visitor.finished(), "visitor shoud be finished of "\
+                                       "required_item is not satisfied"
+
     def _finish_data_block(self):
         meta = super(StreamExampleJoiner, self)._finish_data_block()
         self._follower_restart_index = self._follower_visitor.get_index()
@@ -19,7 +19,7 @@ import gc
 import time
 import traceback
 import heapq
-from collections import namedtuple
+from collections import namedtuple, deque
 
 from fedlearner.common import metrics
 from fedlearner.common import common as fcc
@@ -79,6 +79,14 @@ class PrioritySet(object):
     def size(self):
         return len(self.set)
 
+def _key_value(value):
+    # the same value as bytes, str or number should make the same key
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, str):
+        value = str(value)
+    return value.encode()
+
 def make_index_by_attr(keys, item, key_idx=None):
     """ Make multiple index from the keys by best-effort
         Args:
@@ -87,24 +95,19 @@ def make_index_by_attr(keys, item, key_idx=None):
             key_idx: output indeies of the key in keys that indexed
                 successfully
         Returns:
-            index array
+            index array, of tuples (key names, key values...)
     """
-    key_str_arr = []
-    def has_key(item, key_name):
-        value = getattr(item, key_name)
-        return value != common.ALLOWED_FIELDS[key_name].default_value
-
+    key_arr = []
     for idx, key in enumerate(keys):
-        key_arr = key
-        if isinstance(key, str):
-            key_arr = [key]
-        if all([has_key(item, att) for att in key_arr]):
+        names = (key,) if isinstance(key, str) else tuple(key)
+        values = [getattr(item, name) for name in names]
+        if all(value != common.ALLOWED_FIELDS[name].default_value
+               for name, value in zip(names, values)):
             if key_idx is not None:
                 key_idx.append(idx)
-            key_str_arr.append("_".join(
-                ["%s:%s"%(name, common.convert_to_str(getattr(item, name))) \
-                 for name in key_arr]))
-    return key_str_arr
+            key_arr.append((names,) + \
+                    tuple(_key_value(value) for value in values))
+    return key_arr
 
 
 class _JoinerImpl(object):
@@ -124,7 +127,7 @@ class _JoinerImpl(object):
         leader_mismatches = {}
         # keys example: [(req_id, cid), click_id]
         keys = self._expr.keys()
-        follower_dict = follower_window.as_dict(keys)
+        follower_window.set_index_keys(keys)
         idx = 0
         while idx < leader_window.size():
             elem = leader_window[idx]
@@ -136,9 +139,9 @@ class _JoinerImpl(object):
                 keys, leader, key_idx)
             found = False
             for ki, k in enumerate(key_str_arr):
-                if k not in follower_dict:
+                cd = follower_window.find(k)
+                if not cd:
                     continue
-                cd = follower_dict[k]
                 key_idx = key_idx[ki]
                 for i in reversed(range(len(cd))):
                     #A leader can match multiple conversion event, add
@@ -209,6 +212,7 @@ class _SlidingWindow(object):
             self.index = idx
             self.item = item
             self.is_mapped = False
+            self.keys = None
     def __init__(self, init_window_size, max_window_size, mapper):
         self._init_window_size = max(init_window_size, 1)
         self._max_window_size = max_window_size
@@ -219,6 +223,12 @@ class _SlidingWindow(object):
         self._size = 0
         self._debug_extend_cnt = 0
         self._key_map_fn = mapper
+        # the index from the keys made by make_index_by_attr to the
+        # sequence numbers of the elements, which count the appended
+        # elements so that they stay valid as the window moves forward
+        self._index_keys = None
+        self._key_index = {}
+        self._start_seq = 0
 
     def key_map_fn(self, elem):
         assert isinstance(elem, _SlidingWindow.Element), \
@@ -241,24 +251,48 @@ class _SlidingWindow(object):
                 (self._start, self._end, self._size, self._alloc_size,     \
                  self._ring_buffer[self.start():                           \
                                    (self.start()+20)%self._alloc_size])
-    def as_dict(self, keys):
+    def set_index_keys(self, keys):
         """
-            multi-key index construction:
-                buf:    key -> [idx]
-                window: idx -> item
+            multi-key index construction, kept up to date as elements
+            are appended and forwarded:
+                index:  key -> [seq]
+                window: seq - start_seq -> item
         """
-        buf = {}
-        idx = 0
-        while idx < self.size():
-            elem = self.__getitem__(idx)
-            self.key_map_fn(elem)
-            for key in make_index_by_attr(keys, elem.item):
-                if key not in buf:
-                    buf[key] = [idx]
-                else:
-                    buf[key].append(idx)
-            idx += 1
-        return buf
+        if keys != self._index_keys:
+            self._index_keys = list(keys)
+            self._rebuild_index()
+
+    def find(self, key):
+        """Return the window indices of the elements indexed by key"""
+        seqs = self._key_index.get(key)
+        if seqs is None:
+            return []
+        return [seq - self._start_seq for seq in seqs]
+
+    def _index_elem(self, elem, seq):
+        self.key_map_fn(elem)
+        elem.keys = make_index_by_attr(self._index_keys, elem.item)
+        for key in elem.keys:
+            if key not in self._key_index:
+                self._key_index[key] = deque([seq])
+            else:
+                self._key_index[key].append(seq)
+
+    def _unindex_elem(self, elem, seq):
+        for key in elem.keys:
+            seqs = self._key_index[key]
+            assert seqs[0] == seq, "elements should leave in order"
+            seqs.popleft()
+            if not seqs:
+                del self._key_index[key]
+        elem.keys = None
+
+    def _rebuild_index(self):
+        self._key_index = {}
+        if self._index_keys is None:
+            return
+        for idx in range(self._size):
+            self._index_elem(self[idx], self._start_seq + idx)
 
     def start(self):
         return self._start
@@ -287,13 +321,17 @@ class _SlidingWindow(object):
         if self._size >= self._alloc_size:
             self.extend()
         assert self._size < self._alloc_size, "Window failed to extend"
-        self._ring_buffer[self._end] = self.Element(index, item)
+        elem = self.Element(index, item)
+        self._ring_buffer[self._end] = elem
+        if self._index_keys is not None:
+            self._index_elem(elem, self._start_seq + self._size)
         self._end = (self._end + 1) % self._alloc_size
         self._size += 1
 
     def _defragment(self, new_buf):
         """
-        defragment the ring buffer, and copy it to new_buf
+        defragment the ring buffer, and copy it to new_buf. The key index
+        refers to sequence numbers rather than buffer slots, so it holds
         """
         if self._end == 0:
             new_buf[0:self._size] = \
@@ -340,6 +378,8 @@ class _SlidingWindow(object):
         self._end = len(new_buffer)
         self._size = len(new_buffer)
         self._ring_buffer[0:self._size-1] = new_buffer[0:self._size-1]
+        self._start_seq = 0
+        self._rebuild_index()
 
     def _index(self, index):
         return (self._start + index) % self._alloc_size
@@ -356,6 +396,10 @@ class _SlidingWindow(object):
         if optional_stats:
             for i in range(step):
                 optional_stats.update_stats(self[i].item)
+        if self._index_keys is not None:
+            for i in range(step):
+                self._unindex_elem(self[i], self._start_seq + i)
+        self._start_seq += step
         self._start = self._index(step)
         self._size -= step
         return True
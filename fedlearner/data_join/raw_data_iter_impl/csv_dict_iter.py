@@ -101,11 +101,24 @@ class CsvDictIter(RawDataIter):
     def name(cls):
         return 'CSV_DICT'
 
-    def _inner_iter(self, fpath):
+    def _inner_iter(self, fpath, offset=0):
         with gfile.Open(fpath, 'r') as fh:
             rest_buffer = []
             aware_headers = True
             read_finished = False
+            if offset > 0:
+                # the rows from offset follow the headers of the file
+                headers = csv.DictReader(io.StringIO(fh.readline())).fieldnames
+                if self._headers is None:
+                    self._headers = headers
+                elif self._headers != headers:
+                    logging.fatal("the schema of %s is %s, mismatch "\
+                                  "with previous %s", fpath,
+                                  self._headers, headers)
+                    traceback.print_stack()
+                    os._exit(-1) # pylint: disable=protected-access
+                fh.seek(offset)
+                aware_headers = False
             while not read_finished:
                 dict_reader, rest_buffer, read_finished = \
                         self._make_csv_dict_reader(fh, rest_buffer,
@@ -129,8 +142,9 @@ class CsvDictIter(RawDataIter):
 
     def _make_csv_dict_reader(self, fh, rest_buffer, aware_headers):
         if self._options.read_ahead_size <= 0:
-            assert aware_headers
-            return csv.DictReader(fh), [], True
+            if aware_headers:
+                return csv.DictReader(fh), [], True
+            return csv.DictReader(fh, fieldnames=self._headers), [], True
         read_buffer = fh.read(self._options.read_ahead_size)
         read_finished = len(read_buffer.encode())\
                         < self._options.read_ahead_size
@@ -159,3 +173,33 @@ class CsvDictIter(RawDataIter):
             item = next(fiter)
             return fiter, item
         return None, None
+
+    def _support_record_index(self):
+        return True
+
+    def _build_record_offsets(self, fpath, interval):
+        # a row ends at the line end where the count of quote chars so far
+        # is even, and blank lines between rows are skipped by the reader
+        offsets = []
+        with gfile.Open(fpath, 'rb') as fh:
+            offset = len(fh.readline())
+            ordinal, row_begin, quotes = 0, None, 0
+            for line in fh:
+                if row_begin is None:
+                    if not line.strip(b'\r\n'):
+                        offset += len(line)
+                        continue
+                    row_begin = offset
+                quotes += line.count(b'"')
+                offset += len(line)
+                if quotes % 2 == 0:
+                    if ordinal % interval == 0:
+                        offsets.append(row_begin)
+                    ordinal += 1
+                    row_begin, quotes = None, 0
+        return offsets
+
+    def _reset_iter_at_offset(self, fpath, offset):
+        fiter = self._inner_iter(fpath, offset)
+        item = next(fiter)
+        return fiter, item
@@ -18,6 +18,7 @@ from collections import OrderedDict
 import fedlearner.data_join.common as common
 from fedlearner.common.db_client import DBClient
 from fedlearner.data_join.raw_data_iter_impl.validator import Validator
+from fedlearner.data_join.raw_data_iter_impl.record_index import RecordIndex
 
 
 class RawDataIter(object):
@@ -123,6 +124,7 @@ class RawDataIter(object):
                 return
             if self._iter_failed or self._index > target_index:
                 self.reset_iter(self._index_meta, True)
+            self._seek_by_record_index(target_index)
             if self._index < target_index:
                 for index, _ in self:
                     if index == target_index:
@@ -180,6 +182,51 @@ class RawDataIter(object):
                 RawDataIter.name()
             )
 
+    def _seek_by_record_index(self, target_index):
+        """Reopen the file at the indexed record nearest before
+        target_index if it is ahead of the current one, so that at most
+        record_index_interval records are iterated to reach target_index"""
+        interval = self._record_index_interval()
+        start_index = self._index_meta.start_index
+        if interval <= 0 or target_index - self._index < interval:
+            return
+        fpath = self._index_meta.fpath
+        record_index = RecordIndex.get_or_build(
+                fpath, interval, self._build_record_offsets
+            )
+        ordinal, offset = record_index.floor(target_index - start_index)
+        if start_index + ordinal <= self._index:
+            return
+        self._fiter = None
+        self._item = None
+        self._fiter, self._item = self._reset_iter_at_offset(fpath, offset)
+        self._index = start_index + ordinal
+
+    def _record_index_interval(self):
+        # the record ordinal equals the item index only if the validator
+        # never drops records
+        if self._options is None or \
+                self._validator.sample_ratio > 0 or \
+                not self._support_record_index():
+            return 0
+        return self._options.record_index_interval
+
+    def _support_record_index(self):
+        return False
+
+    def _build_record_offsets(self, fpath, interval):
+        """Return the byte offsets of every interval-th record in fpath"""
+        raise NotImplementedError(
+                "_build_record_offsets not implement for class %s" %
+                RawDataIter.name()
+            )
+
+    def _reset_iter_at_offset(self, fpath, offset):
+        raise NotImplementedError(
+                "_reset_iter_at_offset not implement for class %s" %
+                RawDataIter.name()
+            )
+
     def _next(self):
         assert self._fiter is not None, "_fiter must be not None in _next"
         return next(self._fiter)
@@ -0,0 +1,144 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from tensorflow.compat.v1 import gfile
+
+from fedlearner.data_join import common
+
+RecordIndexSuffix = '.idx'
+
+_INDEX_MAGIC = b'RIDX'
+_INDEX_HEADER = struct.Struct('<4sQQQ')
+
+# record indexes built or loaded in this process, keyed by the raw data
+# file path, so a file whose sidecar can not be written is only scanned once
+_CACHE_CAPACITY = 64
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _get_cached(fpath, interval, file_size):
+    with _cache_lock:
+        record_index = _cache.get(fpath)
+        if record_index is None:
+            return None
+        if record_index.interval != interval or \
+                record_index.file_size != file_size:
+            del _cache[fpath]
+            return None
+        _cache.move_to_end(fpath)
+        return record_index
+
+
+def _put_cached(fpath, record_index):
+    with _cache_lock:
+        _cache[fpath] = record_index
+        _cache.move_to_end(fpath)
+        while len(_cache) > _CACHE_CAPACITY:
+            _cache.popitem(last=False)
+
+
+def record_index_fpath(fpath):
+    """The sidecar index of fpath. It is a hidden file in the same
+    directory, so listing the raw data directory for input files skips
+    it"""
+    dirname, fname = os.path.split(fpath)
+    return os.path.join(dirname, '.{}{}'.format(fname, RecordIndexSuffix))
+
+
+class RecordIndex(object):
+    """Sparse index of a raw data file, offsets[k] being the byte offset
+    of the (k * interval)-th record in the file"""
+    def __init__(self, interval, file_size, offsets):
+        self._interval = interval
+        self._file_size = file_size
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def file_size(self):
+        return self._file_size
+
+    def floor(self, ordinal):
+        """Return the greatest indexed ordinal <= ordinal and its offset"""
+        k = min(ordinal // self._interval, len(self._offsets) - 1)
+        if k < 0:
+            return 0, 0
+        return k * self._interval, int(self._offsets[k])
+
+    def dump(self, fpath):
+        tmp_fpath = common.gen_tmp_fpath(os.path.dirname(fpath))
+        with gfile.GFile(tmp_fpath, 'wb') as fh:
+            fh.write(_INDEX_HEADER.pack(_INDEX_MAGIC, self._interval,
+                                        self._file_size,
+                                        len(self._offsets)))
+            fh.write(self._offsets.astype('<i8').tobytes())
+        gfile.Rename(tmp_fpath, fpath, True)
+
+    @classmethod
+    def load(cls, fpath):
+        if not gfile.Exists(fpath):
+            return None
+        with gfile.GFile(fpath, 'rb') as fh:
+            data = fh.read()
+        if len(data) < _INDEX_HEADER.size:
+            return None
+        magic, interval, file_size, count = _INDEX_HEADER.unpack_from(data)
+        offsets = np.frombuffer(data, dtype='<i8', offset=_INDEX_HEADER.size)
+        if magic != _INDEX_MAGIC or len(offsets) != count or interval <= 0:
+            return None
+        return cls(interval, file_size, offsets)
+
+    @classmethod
+    def get_or_build(cls, fpath, interval, build_fn):
+        """Load the sidecar index of fpath, or build it by
+        build_fn(fpath, interval) and write it next to fpath if there is no
+        valid one. The index is also kept in memory, so it is not built
+        again if writing the sidecar failed"""
+        file_size = gfile.Stat(fpath).length
+        record_index = _get_cached(fpath, interval, file_size)
+        if record_index is not None:
+            return record_index
+        index_fpath = record_index_fpath(fpath)
+        try:
+            record_index = cls.load(index_fpath)
+        except Exception as e: # pylint: disable=broad-except
+            logging.warning("failed to load record index %s, reason %s",
+                            index_fpath, e)
+            record_index = None
+        if record_index is not None and \
+                record_index.interval == interval and \
+                record_index.file_size == file_size:
+            _put_cached(fpath, record_index)
+            return record_index
+        record_index = cls(interval, file_size, build_fn(fpath, interval))
+        _put_cached(fpath, record_index)
+        try:
+            record_index.dump(index_fpath)
+        except Exception as e: # pylint: disable=broad-except
+            logging.warning("failed to dump record index %s, reason %s",
+                            index_fpath, e)
+        return record_index
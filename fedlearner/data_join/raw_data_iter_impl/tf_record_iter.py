@@ -15,34 +15,233 @@
 # coding: utf-8
 
 import logging
+import struct
 from collections import OrderedDict
 from contextlib import contextmanager
 
 import tensorflow.compat.v1 as tf
+from tensorflow.compat.v1 import gfile
 import fedlearner.data_join.common as common
 from fedlearner.data_join.raw_data_iter_impl.raw_data_iter import RawDataIter
 
+# field numbers of tf.train.Example and its sub messages in example.proto
+_FEATURES_FIELD = 1
+_FEATURE_MAP_FIELD = 1
+_MAP_KEY_FIELD = 1
+_MAP_VALUE_FIELD = 2
+_BYTES_LIST_FIELD = 1
+_FLOAT_LIST_FIELD = 2
+_INT64_LIST_FIELD = 3
+_LIST_VALUE_FIELD = 1
+
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LENGTH_DELIMITED = 2
+_WIRE_FIXED32 = 5
+
+# a tf record is framed as uint64 length, uint32 masked crc of the length,
+# the data and uint32 masked crc of the data
+_TF_RECORD_HEADER = struct.Struct('<QI')
+_TF_RECORD_FOOTER_SIZE = 4
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 70:
+            raise ValueError("varint is too long")
+
+
+def _iter_fields(buf, begin, end):
+    """Yield (field_number, wire_type, value_begin, value_end) of the
+    fields of the message serialized in buf[begin:end]"""
+    pos = begin
+    while pos < end:
+        key = buf[pos]
+        if key < 0x80:
+            pos += 1
+        else:
+            key, pos = _read_varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == _WIRE_LENGTH_DELIMITED:
+            length = buf[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = _read_varint(buf, pos)
+            value_begin = pos
+            pos += length
+        else:
+            value_begin = pos
+            if wire_type == _WIRE_VARINT:
+                _, pos = _read_varint(buf, pos)
+            elif wire_type == _WIRE_FIXED64:
+                pos += 8
+            elif wire_type == _WIRE_FIXED32:
+                pos += 4
+            else:
+                raise ValueError("unsupported wire type {}".format(wire_type))
+        if pos > end:
+            raise ValueError("message is truncated")
+        yield key >> 3, wire_type, value_begin, pos
+
+
+def _decode_int64(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _decode_feature(buf, begin, end):
+    kind = None
+    values = []
+    for number, _, list_begin, list_end in _iter_fields(buf, begin, end):
+        if number not in (_BYTES_LIST_FIELD, _FLOAT_LIST_FIELD,
+                          _INT64_LIST_FIELD):
+            continue
+        # the lists are members of a oneof, the last one set wins
+        if number != kind:
+            kind = number
+            values = []
+        for vnumber, wire_type, vbegin, vend in \
+                _iter_fields(buf, list_begin, list_end):
+            if vnumber != _LIST_VALUE_FIELD:
+                continue
+            if kind == _BYTES_LIST_FIELD:
+                values.append(bytes(buf[vbegin:vend]))
+            elif kind == _FLOAT_LIST_FIELD:
+                # repeated floats are packed unless written by old encoders
+                values.extend(struct.unpack(
+                    '<{}f'.format((vend - vbegin) // 4), buf[vbegin:vend]))
+            elif wire_type == _WIRE_LENGTH_DELIMITED:
+                pos = vbegin
+                while pos < vend:
+                    value, pos = _read_varint(buf, pos)
+                    values.append(_decode_int64(value))
+            else:
+                values.append(_decode_int64(_read_varint(buf, vbegin)[0]))
+    return values
+
+
+def parse_tf_example_fields(record_str, field_names):
+    """Decode the features named in field_names from a serialized
+    tf.train.Example, as convert_tf_example_to_dict does for all of its
+    features, without parsing the whole example. The other features are
+    skipped by their length"""
+    field_names = {name.encode(): name for name in field_names}
+    features = OrderedDict()
+    end = len(record_str)
+    for number, wire_type, fbegin, fend in _iter_fields(record_str, 0, end):
+        if number != _FEATURES_FIELD or \
+                wire_type != _WIRE_LENGTH_DELIMITED:
+            continue
+        for enumber, _, ebegin, eend in \
+                _iter_fields(record_str, fbegin, fend):
+            if enumber != _FEATURE_MAP_FIELD:
+                continue
+            # encoders write the key of a map entry first, skip the
+            # entries of other features without decoding them
+            if ebegin < eend and record_str[ebegin] == \
+                    _MAP_KEY_FIELD << 3 | _WIRE_LENGTH_DELIMITED:
+                klen, kbegin = _read_varint(record_str, ebegin + 1)
+                if record_str[kbegin:kbegin+klen] not in field_names:
+                    continue
+            key = None
+            value = None
+            for knumber, _, kbegin, kend in \
+                    _iter_fields(record_str, ebegin, eend):
+                if knumber == _MAP_KEY_FIELD:
+                    key = record_str[kbegin:kend]
+                elif knumber == _MAP_VALUE_FIELD:
+                    value = (kbegin, kend)
+            if key in field_names:
+                features[field_names[key]] = [] if value is None else \
+                        _decode_feature(record_str, *value)
+    return features
+
+
+def _read_tf_records(fpath, offset):
+    """Yield the records of the uncompressed tf record file fpath from
+    the record starting at offset"""
+    with gfile.GFile(fpath, 'rb') as fh:
+        fh.seek(offset)
+        while True:
+            header = fh.read(_TF_RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < _TF_RECORD_HEADER.size:
+                raise ValueError("truncated tf record header in "\
+                                 "{}".format(fpath))
+            length, _ = _TF_RECORD_HEADER.unpack(header)
+            data = fh.read(length + _TF_RECORD_FOOTER_SIZE)
+            if len(data) < length + _TF_RECORD_FOOTER_SIZE:
+                raise ValueError("truncated tf record in {}".format(fpath))
+            yield data[:length]
+
 
 class TfExampleItem(RawDataIter.Item):
+    """Item of a serialized tf.train.Example. The fields in ALLOWED_FIELDS
+    are decoded straight from the record on first access, the example is
+    only parsed in full for csv_record and add_extra_fields, so items that
+    are merely passed through never parse it"""
     def __init__(self, record_str, cache_type=None, index=None):
         super().__init__()
+        self._features_parsed = False
         self._cache_type = cache_type
         self._index = index
         if self._cache_type:
             assert self._index is not None,\
                     "store space is disk, index cann't be None"
         self._parse_example_error = False
-        example = self._parse_example(record_str)
-        dic = common.convert_tf_example_to_dict(example)
-        # should not be list for data block
-        new_dict = {}
-        for key, val in dic.items():
-            new_dict[key] = val[0] if len(val) == 1 else val
-        self._features.update({key: new_dict[key] for key in new_dict
-                               if key in common.ALLOWED_FIELDS.keys()})
+        if self._cache_type:
+            # decode the fields before the record goes to the disk cache
+            self._parse_features(record_str)
         self._set_tf_record(record_str)
         self._csv_record = None
-        self._gc_example(example)
+
+    @property
+    def record(self):
+        self._parse_features()
+        return self._features
+
+    def __getattr__(self, item):
+        self._parse_features()
+        return super().__getattr__(item)
+
+    def __getitem__(self, item):
+        self._parse_features()
+        return super().__getitem__(item)
+
+    def __setitem__(self, item, value):
+        self._parse_features()
+        super().__setitem__(item, value)
+
+    def __contains__(self, item):
+        self._parse_features()
+        return super().__contains__(item)
+
+    def _parse_features(self, record_str=None):
+        if self._features_parsed:
+            return
+        self._features_parsed = True
+        if record_str is None:
+            record_str = self.tf_record
+        try:
+            dic = parse_tf_example_fields(record_str,
+                                          common.ALLOWED_FIELDS.keys())
+        except (IndexError, ValueError, struct.error) as e:
+            logging.error("Failed parse tf.Example from record %s, reason %s",
+                          record_str, e)
+            self._parse_example_error = True
+            return
+        # should not be list for data block
+        for key, val in dic.items():
+            self._features[key] = val[0] if len(val) == 1 else val
 
     @classmethod
     def make(cls, example_id, event_time, raw_id, fname=None, fvalue=None):
@@ -91,6 +290,7 @@ class TfExampleItem(RawDataIter.Item):
         return self._csv_record
 
     def add_extra_fields(self, additional_records, cache=False):
+        self._parse_features()
         example = self._parse_example(self.tf_record)
         if example is not None:
             feat = example.features.feature
@@ -173,17 +373,24 @@ class TfRecordIter(RawDataIter):
         if expt is not None:
             raise expt
 
-    def _inner_iter(self, fpath):
+    def _inner_iter(self, fpath, offset=0):
+        for raw_data in self._iter_raw_records(fpath, offset):
+            if not self._validator.check_tfrecord(raw_data):
+                continue
+            index = self._index
+            if index is None:
+                index = 0
+            yield TfExampleItem(raw_data, self._cache_type, index)
+
+    def _iter_raw_records(self, fpath, offset):
+        if offset > 0:
+            for raw_data in _read_tf_records(fpath, offset):
+                yield raw_data
+            return
         with self._data_set(fpath) as data_set:
             for batch in iter(data_set):
                 for raw_data in batch.numpy():
-                    if not self._validator.check_tfrecord(raw_data):
-                        continue
-                    index = self._index
-                    if index is None:
-                        index = 0
-                    yield TfExampleItem(raw_data,
-                                        self._cache_type, index)
+                    yield raw_data
 
     def _reset_iter(self, index_meta):
         if index_meta is not None:
@@ -192,3 +399,31 @@ class TfRecordIter(RawDataIter):
             item = next(fiter)
             return fiter, item
         return None, None
+
+    def _support_record_index(self):
+        # the offsets of compressed records are not seekable
+        return not self._options.compressed_type
+
+    def _build_record_offsets(self, fpath, interval):
+        offsets = []
+        with gfile.GFile(fpath, 'rb') as fh:
+            offset, ordinal = 0, 0
+            while True:
+                header = fh.read(_TF_RECORD_HEADER.size)
+                if not header:
+                    return offsets
+                if len(header) < _TF_RECORD_HEADER.size:
+                    raise ValueError("truncated tf record header in "\
+                                     "{}".format(fpath))
+                if ordinal % interval == 0:
+                    offsets.append(offset)
+                length, _ = _TF_RECORD_HEADER.unpack(header)
+                offset += _TF_RECORD_HEADER.size + length + \
+                        _TF_RECORD_FOOTER_SIZE
+                fh.seek(offset)
+                ordinal += 1
+
+    def _reset_iter_at_offset(self, fpath, offset):
+        fiter = self._inner_iter(fpath, offset)
+        item = next(fiter)
+        return fiter, item
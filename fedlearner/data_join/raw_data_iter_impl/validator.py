@@ -29,6 +29,10 @@ class Validator(object):
                 self._optional_fields.add(key)
             self._checkers[key] = [TypeChecker([field.type])]
 
+    @property
+    def sample_ratio(self):
+        return self._sample_ratio
+
     def _check(self, record):
         fields = set(record.keys())
         for field in self._required_fields:
@@ -221,8 +221,7 @@ class RawDataManifestManager(object):
             pub_data = self._kvstore.get_data(kvstore_key)
             if pub_data is None:
                 break
-            raw_data_pub = text_format.Parse(pub_data, dj_pb.RawDatePub(),
-                                             allow_unknown_field=True)
+            raw_data_pub = common.decode_raw_data_pub(pub_data)
             if raw_data_pub.HasField('raw_data_meta'):
                 add_candidates.append(raw_data_pub.raw_data_meta)
                 next_sub_index += 1
@@ -20,6 +20,7 @@ import os
 import re
 import gc
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 
 import tensorflow_io # pylint: disable=unused-import
 from tensorflow.compat.v1 import gfile
@@ -32,9 +33,12 @@ from fedlearner.data_join.output_writer_impl import create_output_writer
 from fedlearner.data_join.item_batch_seq_processor import \
         ItemBatch, ItemBatchSeqProcessor
 from fedlearner.data_join.routine_worker import RoutineWorker
+from fedlearner.data_join.raw_data_iter_impl import create_raw_data_iter
 from fedlearner.data_join.raw_data_iter_impl.metric_stats import MetricStats
 from fedlearner.data_join.raw_data_visitor import FileBasedMockRawDataVisitor
-from fedlearner.data_join import common
+from fedlearner.data_join import common, visitor
+
+PART_FILES_PER_TASK = 1
 
 class RawDataBatch(ItemBatch):
     def __init__(self, begin_index):
@@ -114,6 +118,41 @@ class RawDataBatchFetcher(ItemBatchSeqProcessor):
     def cleanup_visitor_meta_data(self):
         self._raw_data_visitor.cleanup_meta_data()
 
+def _part_raw_data_files(args):
+    """Scatter the items of fpaths into per-partition tmp files. Run in
+    the worker processes of the parallel partitioner, the indices of the
+    tmp files are relative to the first item of fpaths"""
+    options, part_field, process_index, fpaths = args
+    writers = [RawDataPartitioner.OutputFileWriter(options, partition_id,
+                                                   process_index)
+               for partition_id in range(options.output_partition_num)]
+    metric_stats = MetricStats(options.raw_data_options, {
+            'partition_name': options.partitioner_name,
+            'partition': options.partitioner_rank_id
+        })
+    index = 0
+    for fpath in fpaths:
+        fiter = create_raw_data_iter(options.raw_data_options)
+        try:
+            fiter.reset_iter(visitor.IndexMeta(0, 0, fpath), True)
+        except StopIteration:
+            logging.warning("input file %s is empty", fpath)
+            continue
+        item = fiter.get_item()
+        while True:
+            metric_stats.emit_metric(item)
+            raw_id = getattr(item, part_field)
+            partition_id = CityHash32(raw_id) % options.output_partition_num
+            writers[partition_id].append_item(index, item)
+            index += 1
+            try:
+                _, item = next(fiter)
+            except StopIteration:
+                break
+    logging.info("partitioned %d items of %d files for process index %d",
+                 index, len(fpaths), process_index)
+    return index, [writer.finish_tmp() for writer in writers]
+
 class RawDataPartitioner(object):
     class FileMeta(object):
         def __init__(self, rank_id, process_index, begin_index, end_index):
@@ -187,12 +226,24 @@ class RawDataPartitioner(object):
                         self._begin_index,
                         self._end_index
                     )
-                fpath = os.path.join(self._options.output_dir,
-                                     common.partition_repr(self._partition_id),
-                                     meta.encode_meta_to_fname())
-                gfile.Rename(self.get_tmp_fpath(), fpath, True)
+                RawDataPartitioner.commit_tmp_file(
+                        self._options, self._partition_id,
+                        self.get_tmp_fpath(), meta
+                    )
             return meta
 
+        def finish_tmp(self):
+            """Close the writer but leave the output in the tmp file,
+            returning (tmp_fpath, begin_index, end_index) for the caller to
+            commit by commit_tmp_file"""
+            if self._writer is None:
+                return None
+            self._writer.close()
+            self._writer = None
+            tmp_fpath = self._tmp_fpath
+            self._tmp_fpath = None
+            return tmp_fpath, self._begin_index, self._end_index
+
         def get_tmp_fpath(self):
             return self._tmp_fpath
 
@@ -200,7 +251,7 @@ class RawDataPartitioner(object):
             if self._writer is not None:
                 self._writer.close()
                 self._writer = None
-            if gfile.Exists(self._tmp_fpath):
+            if self._tmp_fpath is not None and gfile.Exists(self._tmp_fpath):
                 gfile.Remove(self._tmp_fpath)
 
         def __del__(self):
@@ -218,8 +269,11 @@ class RawDataPartitioner(object):
                  kvstore_type, use_mock_etcd=False):
         self._options = options
         self._part_field = part_field
-        kvstore = DBClient(kvstore_type, use_mock_etcd)
-        self._raw_data_batch_fetcher = RawDataBatchFetcher(kvstore, options)
+        self._raw_data_batch_fetcher = None
+        if not self._is_parallel_mode():
+            kvstore = DBClient(kvstore_type, use_mock_etcd)
+            self._raw_data_batch_fetcher = \
+                    RawDataBatchFetcher(kvstore, options)
         self._next_part_index = None
         self._dumped_process_index = None
         self._flying_writers = []
@@ -231,7 +285,16 @@ class RawDataPartitioner(object):
 
     def start_process(self):
         with self._cond:
-            if not self._started:
+            if not self._started and self._is_parallel_mode():
+                self._worker_map = {
+                    'raw_data_partitioner': RoutineWorker(
+                    'raw_data_partitioner',
+                    self._raw_data_parallel_part_fn,
+                    self._raw_data_part_cond, 5)
+                }
+                self._worker_map['raw_data_partitioner'].start_routine()
+                self._started = True
+            elif not self._started:
                 self._worker_map = {
                     'raw_data_batch_fetcher': RoutineWorker(
                     'raw_data_batch_fetcher',
@@ -262,7 +325,18 @@ class RawDataPartitioner(object):
             with self._cond:
                 self._cond.wait()
         self.stop_process()
-        self._raw_data_batch_fetcher.cleanup_visitor_meta_data()
+        if self._raw_data_batch_fetcher is not None:
+            self._raw_data_batch_fetcher.cleanup_visitor_meta_data()
+
+    @classmethod
+    def commit_tmp_file(cls, options, partition_id, tmp_fpath, meta):
+        fpath = os.path.join(options.output_dir,
+                             common.partition_repr(partition_id),
+                             meta.encode_meta_to_fname())
+        gfile.Rename(tmp_fpath, fpath, True)
+
+    def _is_parallel_mode(self):
+        return self._options.partitioner_process_num > 1
 
     def _raw_data_part_fn(self):
         if self._check_finished_tag():
@@ -320,6 +394,96 @@ class RawDataPartitioner(object):
             logging.info("-----------------------------------")
         self._notify_part_finished()
 
+    def _raw_data_parallel_part_fn(self):
+        if self._check_finished_tag():
+            logging.warning("raw data has been parttedfor rank id of parti"\
+                            "tioner %d", self._options.partitioner_rank_id)
+            self._notify_part_finished()
+            return
+        self._sync_partitioner_state()
+        assert self._dumped_process_index is not None
+        # every task of contiguous input files is dumped with its index in
+        # the task list as process index, so the dumped process index
+        # tells the tasks to resume from
+        tasks = self._make_part_tasks()
+        self._sync_part_tasks(tasks)
+        begin_task = self._dumped_process_index + 1
+        if begin_task > len(tasks):
+            raise RuntimeError(
+                    "dumped process index {} beyond the {} partition tasks "\
+                    "of partitioner {}".format(
+                        self._dumped_process_index, len(tasks),
+                        self._options.partitioner_rank_id)
+                )
+        next_index = self._get_next_part_index()
+        args = [(self._options, self._part_field, process_index,
+                 tasks[process_index])
+                for process_index in range(begin_task, len(tasks))]
+        with ProcessPoolExecutor(
+                self._options.partitioner_process_num) as pool:
+            # results come in the order of tasks, the tasks after the one
+            # being committed are partitioned ahead into tmp files
+            for process_index, (item_cnt, tmp_files) in \
+                    zip(range(begin_task, len(tasks)),
+                        pool.map(_part_raw_data_files, args)):
+                self._commit_part_task(process_index, next_index, tmp_files)
+                next_index += item_cnt
+                self._set_next_part_index(next_index)
+                logging.info("consumed %d items", next_index-1)
+        self._dump_finished_tag()
+        for partition_id, metas in self._dumped_file_metas.items():
+            logging.info("part %d output %d files by partitioner",
+                          partition_id, len(metas))
+        self._notify_part_finished()
+
+    def _make_part_tasks(self):
+        # the split only depends on the input files, so a restart with
+        # another process number resumes the same tasks
+        fpaths = list(self._options.input_file_paths)
+        return [fpaths[begin:begin+PART_FILES_PER_TASK]
+                for begin in range(0, len(fpaths), PART_FILES_PER_TASK)]
+
+    def _sync_part_tasks(self, tasks):
+        tasks_fpath = self._get_part_tasks_fpath()
+        encoded = '\n'.join(['\t'.join(task) for task in tasks])
+        if gfile.Exists(tasks_fpath):
+            with gfile.GFile(tasks_fpath, 'r') as fh:
+                if fh.read() != encoded:
+                    raise RuntimeError(
+                            "partition tasks of partitioner {} changed "\
+                            "since last run, recorded in {}".format(
+                                self._options.partitioner_rank_id,
+                                tasks_fpath)
+                        )
+            return
+        if self._dumped_process_index >= 0:
+            raise RuntimeError(
+                    "partitioner {} dumped process index {} without "\
+                    "recording its partition tasks in {}".format(
+                        self._options.partitioner_rank_id,
+                        self._dumped_process_index, tasks_fpath)
+                )
+        tmp_fpath = common.gen_tmp_fpath(self._options.output_dir)
+        with gfile.GFile(tmp_fpath, 'w') as fh:
+            fh.write(encoded)
+        gfile.Rename(tmp_fpath, tasks_fpath, True)
+
+    def _commit_part_task(self, process_index, begin_index, tmp_files):
+        for partition_id, tmp_file in enumerate(tmp_files):
+            if tmp_file is None:
+                continue
+            tmp_fpath, task_begin_index, task_end_index = tmp_file
+            meta = RawDataPartitioner.FileMeta(
+                    self._options.partitioner_rank_id, process_index,
+                    begin_index+task_begin_index, begin_index+task_end_index
+                )
+            RawDataPartitioner.commit_tmp_file(self._options, partition_id,
+                                               tmp_fpath, meta)
+            self._dumped_file_metas[partition_id].append(meta)
+            logging.info("dump %s for partition %d",
+                         meta.encode_meta_to_fname(), partition_id)
+        self._dumped_process_index = process_index
+
     def _raw_data_part_cond(self):
         if self._is_part_finished():
             self._notify_part_finished()
@@ -411,7 +575,8 @@ class RawDataPartitioner(object):
                         gfile.Remove(fpath)
                 else:
                     break
-            metas = metas[:self._dumped_process_index+1]
+            metas = [meta for meta in metas
+                     if meta.process_index <= self._dumped_process_index]
             self._dumped_file_metas[partition_id] = metas
             if len(metas) > 0 and metas[-1].end_index > max_dumped_index:
                 max_dumped_index = metas[-1].end_index
@@ -471,3 +636,9 @@ class RawDataPartitioner(object):
                 self._options.output_dir,
                 '_SUCCESS.{:08}'.format(self._options.partitioner_rank_id)
             )
+
+    def _get_part_tasks_fpath(self):
+        return os.path.join(
+                self._options.output_dir,
+                '_PART_TASKS.{:08}'.format(self._options.partitioner_rank_id)
+            )
@@ -15,8 +15,9 @@
 # coding: utf-8
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from google.protobuf import text_format, empty_pb2
+from google.protobuf import empty_pb2
 
 import tensorflow_io # pylint: disable=unused-import
 from tensorflow.compat.v1 import gfile
@@ -25,10 +26,16 @@ from fedlearner.common import data_join_service_pb2 as dj_pb
 
 from fedlearner.data_join import common
 
+# the default limit of operations in one etcd transaction is 128
+RAW_DATA_PUB_BATCH_SIZE = 128
+CHECK_EXISTS_CONCURRENCY = 16
+
 class RawDataPublisher(object):
-    def __init__(self, kvstore, raw_data_pub_dir):
+    def __init__(self, kvstore, raw_data_pub_dir,
+                 batch_size=RAW_DATA_PUB_BATCH_SIZE):
         self._kvstore = kvstore
         self._raw_data_pub_dir = raw_data_pub_dir
+        self._batch_size = max(batch_size, 1)
 
     def publish_raw_data(self, partition_id, fpaths, timestamps=None):
         if not fpaths:
@@ -37,10 +44,9 @@ class RawDataPublisher(object):
         if timestamps is not None and len(fpaths) != len(timestamps):
             raise RuntimeError("the number of raw data file "\
                                "and timestamp mismatch")
+        self._check_raw_data_exists(fpaths)
         new_raw_data_pubs = []
         for index, fpath in enumerate(fpaths):
-            if not gfile.Exists(fpath):
-                raise ValueError('{} is not existed'.format(fpath))
             raw_data_pub = dj_pb.RawDatePub(
                     raw_data_meta=dj_pb.RawDataMeta(
                         file_path=fpath,
@@ -51,10 +57,9 @@ class RawDataPublisher(object):
                 raw_data_pub.raw_data_meta.timestamp.MergeFrom(
                         timestamps[index]
                     )
-            new_raw_data_pubs.append(raw_data_pub)
+            new_raw_data_pubs.append(common.encode_raw_data_pub(raw_data_pub))
         next_pub_index = None
         item_index = 0
-        data = text_format.MessageToString(new_raw_data_pubs[item_index])
         while item_index < len(new_raw_data_pubs):
             next_pub_index = self._forward_pub_index(partition_id,
                                                      next_pub_index)
@@ -62,27 +67,23 @@ class RawDataPublisher(object):
                 logging.warning("partition %d has been published finish tag "\
                                 "at index %d", partition_id, next_pub_index-1)
                 break
-            kvstore_key = common.raw_data_pub_kvstore_key(
-                                                    self._raw_data_pub_dir,
-                                                    partition_id,
-                                                    next_pub_index)
-            if self._kvstore.cas(kvstore_key, None, data):
-                logging.info("Success publish %s at index %d for partition"\
-                             "%d", data, next_pub_index, partition_id)
-                next_pub_index += 1
-                item_index += 1
-                if item_index < len(new_raw_data_pubs):
-                    raw_data_pub = new_raw_data_pubs[item_index]
-                    data = text_format.MessageToString(raw_data_pub)
-        if item_index < len(new_raw_data_pubs) - 1:
+            batch = new_raw_data_pubs[item_index:
+                                      item_index+self._batch_size]
+            if self._publish_batch(partition_id, next_pub_index, batch):
+                logging.info("Success publish %d raw data at index [%d, %d] "\
+                             "for partition %d", len(batch), next_pub_index,
+                             next_pub_index + len(batch) - 1, partition_id)
+                next_pub_index += len(batch)
+                item_index += len(batch)
+        if item_index < len(new_raw_data_pubs):
             logging.warning("%d files are not published since meet finish "\
                             "tag for partition %d. list following",
                             len(new_raw_data_pubs) - item_index, partition_id)
-            for idx, pub in enumerate(new_raw_data_pubs[item_index:]):
-                logging.warning("%d. %s", idx, pub.raw_data_meta.file_path)
+            for idx, fpath in enumerate(fpaths[item_index:]):
+                logging.warning("%d. %s", idx, fpath)
 
     def finish_raw_data(self, partition_id):
-        data = text_format.MessageToString(
+        data = common.encode_raw_data_pub(
                 dj_pb.RawDatePub(raw_data_finished=empty_pb2.Empty())
             )
         next_pub_index = None
@@ -103,6 +104,26 @@ class RawDataPublisher(object):
                              "%d", partition_id)
                 break
 
+    def _check_raw_data_exists(self, fpaths):
+        concurrency = min(CHECK_EXISTS_CONCURRENCY, len(fpaths))
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for fpath, existed in zip(fpaths,
+                                      executor.map(gfile.Exists, fpaths)):
+                if not existed:
+                    raise ValueError('{} is not existed'.format(fpath))
+
+    def _publish_batch(self, partition_id, start_pub_index, batch):
+        """Publish the batch at the consecutive pub indices from
+        start_pub_index, all of them or none if some index is occupied"""
+        kvs = [(common.raw_data_pub_kvstore_key(self._raw_data_pub_dir,
+                                                partition_id,
+                                                start_pub_index + offset),
+                None, data)
+               for offset, data in enumerate(batch)]
+        if len(kvs) == 1:
+            return self._kvstore.cas(*kvs[0])
+        return self._kvstore.batch_cas(kvs)
+
     def _forward_pub_index(self, partition_id, next_pub_index):
         if next_pub_index is None:
             left_index = 0
@@ -134,7 +155,6 @@ class RawDataPublisher(object):
                                                     last_index)
             data = self._kvstore.get_data(kvstore_key)
             if data is not None:
-                pub_item = text_format.Parse(data, dj_pb.RawDatePub(),
-                                             allow_unknown_field=True)
+                pub_item = common.decode_raw_data_pub(data)
                 return pub_item.HasField('raw_data_finished')
         return False
@@ -154,11 +154,34 @@ class RawDataVisitor(visitor.Visitor):
                 RawDataManager(kvstore, data_source, partition_id)
             )
         self._raw_data_options = raw_data_options
+        self._example_id_filter = None
+        self._skip_fn = None
+        self._skipped_count = 0
 
     def active_visitor(self):
         if self.is_visitor_stale():
             self._finished = False
 
+    def set_example_id_filter(self, example_id_filter, skip_fn=None):
+        """Skip the items whose example id is not in example_id_filter
+        while iterating, the indices of the remained items unchanged.
+        skip_fn is called with every skipped item if given"""
+        self._example_id_filter = example_id_filter
+        self._skip_fn = skip_fn
+
+    def get_skipped_count(self):
+        return self._skipped_count
+
+    def _next_internal(self):
+        while True:
+            index, item = super(RawDataVisitor, self)._next_internal()
+            if self._example_id_filter is None or \
+                    item.example_id in self._example_id_filter:
+                return index, item
+            self._skipped_count += 1
+            if self._skip_fn is not None:
+                self._skip_fn(item)
+
     def _new_iter(self):
         return create_raw_data_iter(self._raw_data_options)
 
@@ -16,8 +16,6 @@
 
 import logging
 import threading
-import hashlib
-import random
 import functools
 import os
 import time
@@ -25,8 +23,7 @@ import bisect
 import traceback
 import concurrent.futures as concur_futures
 
-from cityhash import CityHash64 # pylint: disable=no-name-in-module
-from gmpy2 import powmod, divm # pylint: disable=no-name-in-module
+from gmpy2 import mpz # pylint: disable=no-name-in-module
 
 from google.protobuf import empty_pb2
 
@@ -39,7 +36,12 @@ from fedlearner.data_join.raw_data_visitor import \
         FileBasedMockRawDataVisitor, DBBasedMockRawDataVisitor
 from fedlearner.data_join.item_batch_seq_processor import \
         ItemBatch, ItemBatchSeqProcessor
-from fedlearner.data_join.common import int2bytes, bytes2int
+from fedlearner.data_join.common import bytes2int
+from fedlearner.data_join.rsa_psi.rsa_psi_crypto import (
+    CrtRsaSigner, BlindingFactorPool, generate_blinding_factors,
+    crypto_hash_digests, crypto_hash_ints, oneway_hash_join_ids,
+    CRYPTO_HASH_LEN
+)
 
 class IdBatch(ItemBatch):
     def __init__(self, begin_index):
@@ -211,6 +213,9 @@ class PsiRsaSigner(ItemBatchSeqProcessor):
         raise NotImplementedError("say_signer_bye not implemented "\
                                   "in base PsiRsaSigner")
 
+    def stop(self):
+        pass
+
     def _make_item_batch(self, begin_index):
         return SignedIdBatch(begin_index)
 
@@ -340,24 +345,17 @@ class PsiRsaSigner(ItemBatchSeqProcessor):
         with self._lock:
             self._next_batch_index_hint = batch_index_hint
 
-    @staticmethod
-    def _crypto_hash(value):
-        return hashlib.sha256(bytes(str(value), encoding='utf-8')).hexdigest()
-
     @staticmethod
     def _crypto_hash_list(items, ret_int=False):
         if ret_int:
-            return [int(PsiRsaSigner._crypto_hash(item), 16)
-                    for item in items]
-        return [PsiRsaSigner._crypto_hash(item) for item in items]
+            return crypto_hash_ints(items)
+        digests = crypto_hash_digests(items)
+        return [digests[i:i+CRYPTO_HASH_LEN].hex()
+                for i in range(0, len(digests), CRYPTO_HASH_LEN)]
 
     @staticmethod
     def _oneway_hash_list(items):
-        return [hex(CityHash64(str(item)))[2:] for item in items]
-
-    @staticmethod
-    def _rsa_sign_list(items, d, n):
-        return [int(powmod(x, d, n).digits()) for x in items]
+        return oneway_hash_join_ids(items)
 
 class LeaderPsiRsaSigner(PsiRsaSigner):
     def __init__(self, id_batch_fetcher, max_flying_item,
@@ -369,6 +367,7 @@ class LeaderPsiRsaSigner(PsiRsaSigner):
                                                  slow_sign_threshold,
                                                  process_pool_executor)
         self._private_key = private_key
+        self._crt_signer = CrtRsaSigner.from_private_key(private_key)
         self._item_additional_cost = 256 // 8 + \
                                      self._private_key.n.bit_length() // 8
 
@@ -380,12 +379,12 @@ class LeaderPsiRsaSigner(PsiRsaSigner):
         logging.warning("leader signer has no peer signer")
 
     @staticmethod
-    def _leader_sign_func(raw_id_batch, d, n):
+    def _leader_sign_func(raw_id_batch, crt_signer):
         hashed_ids = PsiRsaSigner._crypto_hash_list(
                 raw_id_batch.raw_ids, True
             )
         assert len(hashed_ids) == len(raw_id_batch)
-        signed_hashed_ids = PsiRsaSigner._rsa_sign_list(hashed_ids, d, n)
+        signed_hashed_ids = [crt_signer.sign(x) for x in hashed_ids]
         assert len(signed_hashed_ids) == len(raw_id_batch)
         hashed_signed_hashed_ids = \
                 PsiRsaSigner._oneway_hash_list(signed_hashed_ids)
@@ -411,7 +410,7 @@ class LeaderPsiRsaSigner(PsiRsaSigner):
         start_tm = time.time()
         exec_future = self._process_pool_executor.submit(
                 LeaderPsiRsaSigner._leader_sign_func, raw_id_batch,
-                self._private_key.d, self._private_key.n
+                self._crt_signer
             )
         exec_cb = functools.partial(self._sign_callback, raw_id_batch,
                                     start_tm, notify_future)
@@ -506,7 +505,8 @@ class FollowerPsiRsaSigner(PsiRsaSigner):
                  max_flying_sign_batch, max_flying_sign_rpc,
                  sign_rpc_timeout_ms, slow_sign_threshold,
                  stub_fanout, process_pool_executor,
-                 callback_submitter, public_key, leader_signer_addr):
+                 callback_submitter, public_key, leader_signer_addr,
+                 blinding_pool_size=0):
         super(FollowerPsiRsaSigner, self).__init__(id_batch_fetcher,
                                                    max_flying_item,
                                                    max_flying_sign_batch,
@@ -524,12 +524,22 @@ class FollowerPsiRsaSigner(PsiRsaSigner):
         self._pending_rpc_sign_ctx = []
         self._flying_rpc_num = 0
         self._callback_submitter = callback_submitter
-        self._item_additional_cost = 256 * 2 // 8 + \
-                                     self._public_key.n.bit_length() // 8
+        self._blinding_factor_pool = None
+        if blinding_pool_size > 0:
+            self._blinding_factor_pool = BlindingFactorPool(
+                    public_key.e, public_key.n, blinding_pool_size,
+                    process_pool_executor
+                )
+        self._item_additional_cost = 256 // 8 + \
+                                     self._public_key.n.bit_length() * 2 // 8
 
     def additional_item_mem_usage(self):
         return self._item_additional_cost
 
+    def stop(self):
+        if self._blinding_factor_pool is not None:
+            self._blinding_factor_pool.stop()
+
     def say_signer_bye(self):
         stub = self._get_active_stub()
         try:
@@ -581,11 +591,6 @@ class FollowerPsiRsaSigner(PsiRsaSigner):
                 if stub.rpc_unref():
                     stub.close()
 
-    @staticmethod
-    def _generate_blind_number(item_num, blind_len=256):
-        return [random.SystemRandom().getrandbits(blind_len)
-                for i in range(item_num)]
-
     def _make_sign_future(self, raw_id_batch):
         notify_future = concur_futures.Future()
         self._blind_raw_id_func(raw_id_batch, notify_future)
@@ -593,25 +598,33 @@ class FollowerPsiRsaSigner(PsiRsaSigner):
 
     def _blind_raw_id_func(self, raw_id_batch, notify_future):
         e, n = self._public_key.e, self._public_key.n
+        blind_factors = None
+        if self._blinding_factor_pool is not None:
+            blind_factors = \
+                    self._blinding_factor_pool.get(len(raw_id_batch))
         blind_future = self._process_pool_executor.submit(
                 FollowerPsiRsaSigner._blind_raw_id_batch,
-                raw_id_batch, e, n
+                raw_id_batch, blind_factors, e, n
             )
         blind_cb = functools.partial(self._blind_callback,
                                      raw_id_batch, notify_future)
         blind_future.add_done_callback(blind_cb)
 
     @staticmethod
-    def _blind_raw_id_batch(raw_id_batch, e, n):
+    def _blind_raw_id_batch(raw_id_batch, blind_factors, e, n):
         hashed_ids = PsiRsaSigner._crypto_hash_list(
                 raw_id_batch.raw_ids, True
             )
-        blind_numbers = [random.SystemRandom().getrandbits(256)
-                         for i in range(len(raw_id_batch))]
+        if blind_factors is None:
+            blind_factors = generate_blinding_factors(
+                    e, n, len(raw_id_batch)
+                )
+        n = mpz(n)
         byte_len = n.bit_length() // 8
-        blinded_hashed_ids = [int2bytes((powmod(r, e, n) * x % n).digits(),
-                                        byte_len)
-                              for x, r in zip(hashed_ids, blind_numbers)]
+        blinded_hashed_ids = [int(mpz(re) * x % n).to_bytes(byte_len, 'little')
+                              for x, (re, _) in zip(hashed_ids, blind_factors)]
+        # deblinding only needs the inverses of the blind numbers
+        blind_numbers = [r_inv for _, r_inv in blind_factors]
         return (blinded_hashed_ids, blind_numbers)
 
     def _blind_callback(self, raw_id_batch, notify_future, blind_future):
@@ -714,7 +727,8 @@ class FollowerPsiRsaSigner(PsiRsaSigner):
     @staticmethod
     def _deblind_signed_id_batch(signed_blinded_hashed_ids,
                                  blind_numbers, n):
-        signed_hashed_ids = [int(divm(x, r, n).digits()) for x, r in
+        n = mpz(n)
+        signed_hashed_ids = [mpz(x) * r_inv % n for x, r_inv in
                              zip(signed_blinded_hashed_ids, blind_numbers)]
         hashed_signed_hashed_ids = \
                 PsiRsaSigner._oneway_hash_list(signed_hashed_ids)
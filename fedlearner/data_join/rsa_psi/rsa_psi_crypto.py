@@ -0,0 +1,251 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import hashlib
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from cityhash import CityHash64 # pylint: disable=no-name-in-module
+from gmpy2 import mpz, powmod, invert # pylint: disable=no-name-in-module
+
+from fedlearner.common import metrics
+from fedlearner.data_join.common import bytes2int
+
+SIGN_CHUNK_SIZE = 4096
+BLINDING_BATCH_SIZE = 4096
+BLIND_LEN = 256
+CRYPTO_HASH_LEN = 32
+
+# bytes printed as themselves in the repr of bytes, i.e. printable ascii
+# except the quote and the backslash
+_REPR_PLAIN_BYTES = bytes(c for c in range(0x20, 0x7f)
+                          if c not in (ord("'"), ord('\\')))
+
+def _crypto_hash_input(raw_id):
+    if isinstance(raw_id, bytes):
+        if not raw_id.translate(None, _REPR_PLAIN_BYTES):
+            return b"b'%s'" % raw_id
+    elif isinstance(raw_id, str):
+        return raw_id.encode('utf-8')
+    return str(raw_id).encode('utf-8')
+
+def _crypto_hash_inputs(raw_ids):
+    """The utf-8 encodings of str(raw_id), which the crypto hashes of
+    raw_ids are defined over. A batch of plain bytes ids is checked by one
+    translate and wrapped as their repr without formatting them as str"""
+    raw_ids = list(raw_ids)
+    try:
+        plain = not b''.join(raw_ids).translate(None, _REPR_PLAIN_BYTES)
+    except TypeError:
+        plain = False
+    if plain and all(isinstance(raw_id, bytes) for raw_id in raw_ids):
+        return [b"b'%s'" % raw_id for raw_id in raw_ids]
+    return [_crypto_hash_input(raw_id) for raw_id in raw_ids]
+
+def crypto_hash_digests(raw_ids):
+    """Return the sha256 digests of str(raw_id) for raw_ids as a bytes
+    block of CRYPTO_HASH_LEN bytes per id"""
+    sha256 = hashlib.sha256
+    return b''.join(sha256(x).digest() for x in _crypto_hash_inputs(raw_ids))
+
+def crypto_hash_buffer(buf, offsets):
+    """crypto_hash_digests for the bytes ids buf[offsets[i]:offsets[i+1]]
+    laid out contiguously in buf"""
+    buf = bytes(buf)
+    return crypto_hash_digests(
+            buf[begin:end] for begin, end in zip(offsets[:-1], offsets[1:])
+        )
+
+def digests_to_ints(digests, digest_len=CRYPTO_HASH_LEN):
+    """Read a block of fixed width digests as big-endian integers, i.e.
+    int(hexdigest, 16) of every digest"""
+    return [int.from_bytes(digests[i:i+digest_len], 'big')
+            for i in range(0, len(digests), digest_len)]
+
+def crypto_hash_ints(raw_ids):
+    """int(sha256(str(raw_id)).hexdigest(), 16) for raw_ids"""
+    sha256 = hashlib.sha256
+    return [int.from_bytes(sha256(x).digest(), 'big')
+            for x in _crypto_hash_inputs(raw_ids)]
+
+def oneway_hash_ints(items):
+    """CityHash64 of the decimal representation of items, as an uint64
+    array. Decimal digits are formatted by gmp rather than int.__str__"""
+    return np.fromiter((CityHash64(mpz(item).digits()) for item in items),
+                       dtype=np.uint64)
+
+def oneway_hash_join_ids(items):
+    """The join ids of the signed items, hex(oneway hash) without the 0x
+    prefix"""
+    return ['%x' % h for h in oneway_hash_ints(items).tolist()]
+
+def _sign_bytes_chunk(args):
+    signer, items, byte_len = args
+    return signer.sign_bytes(items, byte_len)
+
+class CrtRsaSigner(object):
+    """RSA signing with the Chinese Remainder Theorem. x^d mod n is
+    recombined from x^dp mod p and x^dq mod q, which are about 3-4x
+    cheaper than one exponentiation over the full modulus"""
+    def __init__(self, p, q, d):
+        self._p = mpz(p)
+        self._q = mpz(q)
+        self._dp = mpz(d) % (self._p - 1)
+        self._dq = mpz(d) % (self._q - 1)
+        self._qinv = invert(self._q, self._p)
+        self.n = self._p * self._q
+
+    @classmethod
+    def from_private_key(cls, private_key):
+        return cls(private_key.p, private_key.q, private_key.d)
+
+    @property
+    def byte_len(self):
+        return self.n.bit_length() // 8
+
+    def sign(self, x):
+        x = mpz(x)
+        m1 = powmod(x, self._dp, self._p)
+        m2 = powmod(x, self._dq, self._q)
+        h = self._qinv * (m1 - m2) % self._p
+        return m2 + h * self._q
+
+    def sign_ints(self, items):
+        return [int(self.sign(x)) for x in items]
+
+    def sign_bytes(self, items, byte_len=None):
+        """Sign little-endian encoded integers, returning signatures
+        encoded the same way in byte_len bytes"""
+        if byte_len is None:
+            byte_len = self.byte_len
+        return [int(self.sign(bytes2int(item))).to_bytes(byte_len, 'little')
+                for item in items]
+
+    def batch_sign_bytes(self, items, process_pool_executor=None,
+                         chunk_size=SIGN_CHUNK_SIZE):
+        """sign_bytes in the process pool if given, spreading large
+        batches across its workers in chunks"""
+        items = list(items)
+        if process_pool_executor is None:
+            return self.sign_bytes(items)
+        args = [(self, items[i:i+chunk_size], self.byte_len)
+                for i in range(0, len(items), chunk_size)]
+        signed_ids = []
+        for chunk in process_pool_executor.map(_sign_bytes_chunk, args):
+            signed_ids.extend(chunk)
+        return signed_ids
+
+def generate_blinding_factors(e, n, count, blind_len=BLIND_LEN):
+    """Return count pairs of (r^e mod n, r^-1 mod n) for random r"""
+    rnd = random.SystemRandom()
+    factors = []
+    while len(factors) < count:
+        r = mpz(rnd.getrandbits(blind_len))
+        try:
+            r_inv = invert(r, n)
+        except ZeroDivisionError:
+            continue
+        factors.append((int(powmod(r, e, n)), int(r_inv)))
+    return factors
+
+def _generate_blinding_factors(args):
+    return generate_blinding_factors(*args)
+
+class BlindingFactorPool(object):
+    """Bounded pool of blinding factors (r^e mod n, r^-1 mod n), refilled
+    by a background thread that generates them in the process pool. With
+    precomputed factors blinding and deblinding an id are one modular
+    multiplication each"""
+    def __init__(self, e, n, capacity, process_pool_executor,
+                 batch_size=BLINDING_BATCH_SIZE, metrics_tags=None):
+        self._e = e
+        self._n = n
+        self._capacity = capacity
+        self._process_pool_executor = process_pool_executor
+        self._batch_size = batch_size
+        self._metrics_tags = metrics_tags
+        self._factors = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._refill_thread = threading.Thread(
+                target=self._refill_routine, name='BlindingFactorPool',
+                daemon=True
+            )
+        self._refill_thread.start()
+
+    def depth(self):
+        with self._cond:
+            return len(self._factors)
+
+    def get(self, count):
+        """Pop count factors, generating the ones the pool runs short of
+        inline"""
+        with self._cond:
+            factors = [self._factors.popleft()
+                       for _ in range(min(count, len(self._factors)))]
+            self._cond.notify_all()
+        if len(factors) < count:
+            miss = count - len(factors)
+            metrics.emit_counter(name='rsa_psi_blinding_pool.miss',
+                                 value=miss, tags=self._metrics_tags)
+            factors.extend(
+                generate_blinding_factors(self._e, self._n, miss)
+            )
+        return factors
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._refill_thread.join()
+
+    def _refill_routine(self):
+        while True:
+            with self._cond:
+                while not self._stopped and \
+                        len(self._factors) >= self._capacity:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                count = min(self._batch_size,
+                            self._capacity - len(self._factors))
+            start_tm = time.time()
+            try:
+                factors = self._process_pool_executor.submit(
+                        _generate_blinding_factors, (self._e, self._n, count)
+                    ).result()
+            except Exception as e: # pylint: disable=broad-except
+                with self._cond:
+                    if self._stopped:
+                        return
+                logging.warning("Failed to generate blinding factors, "\
+                                "reason: %s, retry 1s later", e)
+                time.sleep(1)
+                continue
+            duration = time.time() - start_tm
+            with self._cond:
+                self._factors.extend(factors)
+                depth = len(self._factors)
+                self._cond.notify_all()
+            metrics.emit_store(name='rsa_psi_blinding_pool.depth',
+                               value=depth, tags=self._metrics_tags)
+            metrics.emit_store(name='rsa_psi_blinding_pool.refill_rate',
+                               value=count / max(duration, 1e-6),
+                               tags=self._metrics_tags)
@@ -31,7 +31,8 @@ from fedlearner.data_join.routine_worker import RoutineWorker
 from fedlearner.data_join.raw_data_publisher import RawDataPublisher
 from fedlearner.data_join.rsa_psi.rsa_psi_component import \
         IdBatchFetcher, LeaderPsiRsaSigner, FollowerPsiRsaSigner
-from fedlearner.data_join.sort_run_dumper import SortRunDumper
+from fedlearner.data_join.sort_run_dumper import SortRunDumper, \
+        sort_run_writer_options, sort_run_item_bytes
 from fedlearner.data_join.sort_run_merger import SortRunMerger
 from fedlearner.data_join.common import partition_repr, get_heap_mem_stats
 
@@ -74,17 +75,19 @@ class RsaPsiPreProcessor(object):
                     self._options.stub_fanout,
                     self._process_pool_executor,
                     self._callback_submitter, public_key,
-                    self._options.leader_rsa_psi_signer_addr
+                    self._options.leader_rsa_psi_signer_addr,
+                    self._options.blinding_pool_size
                 )
             self._repr = 'follower-' + 'rsa_psi_preprocessor'
         self._sort_run_dumper = SortRunDumper(options)
+        sort_run_options = sort_run_writer_options(options)
         self._sort_run_merger = SortRunMerger(
                 dj_pb.SortRunMergerOptions(
                     merger_name='sort_run_merger_'+\
                                 partition_repr(options.partition_id),
                     reader_options=dj_pb.RawDataOptions(
-                        raw_data_iter=options.writer_options.output_writer,
-                        compressed_type=options.writer_options.compressed_type,
+                        raw_data_iter=sort_run_options.output_writer,
+                        compressed_type=sort_run_options.compressed_type,
                         read_ahead_size=\
                             options.sort_run_merger_read_ahead_buffer,
                         read_batch_size=\
@@ -92,9 +95,10 @@ class RsaPsiPreProcessor(object):
                     ),
                     writer_options=options.writer_options,
                     output_file_dir=options.output_file_dir,
-                    partition_id=options.partition_id
+                    partition_id=options.partition_id,
+                    merge_fan_in=options.sort_run_merge_fan_in
                 ),
-                self._merger_comparator
+                self._merger_sort_key
             )
         self._produce_item_cnt = 0
         self._comsume_item_cnt = 0
@@ -143,6 +147,7 @@ class RsaPsiPreProcessor(object):
             with self._lock:
                 self._lock.wait()
         self.stop_routine_workers()
+        self._psi_rsa_signer.stop()
         self._process_pool_executor.shutdown()
         if self._callback_submitter is not None:
             self._callback_submitter.shutdown()
@@ -253,9 +258,12 @@ class RsaPsiPreProcessor(object):
         items_buffer = []
         signed_finished = False
         total_item_num = 0
+        total_item_bytes = 0
         max_flying_item = self._options.batch_processor_options.max_flying_item
         sort_run_size = max_flying_item // 2
-        while sort_run_size <= 0 or total_item_num < sort_run_size:
+        memory_budget = self._options.sort_run_memory_budget
+        while (sort_run_size <= 0 or total_item_num < sort_run_size) and \
+                (memory_budget <= 0 or total_item_bytes < memory_budget):
             signed_finished, batch, hint_index = \
                 rsi_signer.fetch_item_batch_by_index(next_index, hint_index)
             if batch is None:
@@ -263,6 +271,8 @@ class RsaPsiPreProcessor(object):
             assert next_index == batch.begin_index
             for item in batch:
                 items_buffer.append(item)
+                total_item_bytes += len(item[0]) + \
+                        sort_run_item_bytes(item[1])
             next_index += len(batch)
             total_item_num += len(batch)
         sorted_items_buffer = sorted(items_buffer, key=lambda item: item[0])
@@ -340,5 +350,5 @@ class RsaPsiPreProcessor(object):
         return self._sort_run_dumper.is_dump_finished()
 
     @staticmethod
-    def _merger_comparator(a, b):
-        return a.example_id < b.example_id
+    def _merger_sort_key(item):
+        return item.example_id
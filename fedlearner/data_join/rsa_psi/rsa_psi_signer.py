@@ -21,13 +21,12 @@ import threading
 from concurrent import futures
 
 import grpc
-from gmpy2 import powmod # pylint: disable=no-name-in-module
 
 from fedlearner.common import common_pb2 as common_pb
 from fedlearner.common import data_join_service_pb2 as dj_pb
 from fedlearner.common import data_join_service_pb2_grpc as dj_grpc
 
-from fedlearner.data_join.common import int2bytes, bytes2int
+from fedlearner.data_join.rsa_psi.rsa_psi_crypto import CrtRsaSigner
 
 class RsaPsiSignServer(dj_grpc.RsaPsiSignServiceServicer):
     def __init__(self, psi_sign_fn, bye_fn):
@@ -51,6 +50,7 @@ class RsaPsiSigner(object):
                  offload_processor_number,
                  slow_sign_threshold):
         self._rsa_private_key = rsa_prv_key
+        self._crt_signer = CrtRsaSigner.from_private_key(rsa_prv_key)
         self._process_pool_executor = None
         if offload_processor_number > 0:
             self._process_pool_executor = \
@@ -64,22 +64,12 @@ class RsaPsiSigner(object):
         self._cond = threading.Condition()
 
     def _psi_sign_fn(self, request):
-        d, n = self._rsa_private_key.d, self._rsa_private_key.n
         start_tm = time.time()
-        response = None
-        if self._process_pool_executor is not None:
-            rids = [rid for rid in request.ids] # pylint: disable=unnecessary-comprehension
-            sign_future = self._process_pool_executor.submit(
-                    RsaPsiSigner._psi_sign_impl, rids, d, n
-                )
-            response = dj_pb.SignIdsResponse(
-                    status=common_pb.Status(code=0),
-                    signed_ids=sign_future.result()
-                )
-        else:
-            response = dj_pb.SignIdsResponse(
+        response = dj_pb.SignIdsResponse(
                 status=common_pb.Status(code=0),
-                signed_ids=RsaPsiSigner._psi_sign_impl(request.ids, d, n)
+                signed_ids=self._crt_signer.batch_sign_bytes(
+                    request.ids, self._process_pool_executor
+                )
             )
         self._record_sign_duration(request.begin_index,
                                    len(request.ids),
@@ -116,12 +106,6 @@ class RsaPsiSigner(object):
                             self._slow_sign_threshold,
                             avg_duration, slow_avg_duration)
 
-    @staticmethod
-    def _psi_sign_impl(items, d, n):
-        byte_len = n.bit_length() // 8
-        return [int2bytes(powmod(bytes2int(item), d, n).digits(), byte_len)
-                for item in items]
-
     def start(self, listen_port, worker_num):
         self._server = grpc.server(
                 futures.ThreadPoolExecutor(max_workers=worker_num)
@@ -22,10 +22,28 @@ from os import path
 import tensorflow_io # pylint: disable=unused-import
 from tensorflow.compat.v1 import gfile
 
+from fedlearner.common import metrics
 from fedlearner.data_join.output_writer_impl import create_output_writer
+from fedlearner.data_join.raw_data_iter_impl.tf_record_iter import \
+        TfExampleItem
 from fedlearner.data_join.common import (DoneFileSuffix, TmpFileSuffix,
                                          gen_tmp_fpath, partition_repr)
 
+def sort_run_writer_options(options):
+    """Writer options of the sort runs, which are the output writer
+    options compressed by sort_run_compressed_type if given"""
+    writer_options = copy.deepcopy(options.writer_options)
+    if options.sort_run_compressed_type and \
+            writer_options.output_writer == 'TF_RECORD':
+        writer_options.compressed_type = options.sort_run_compressed_type
+    return writer_options
+
+def sort_run_item_bytes(item):
+    """The bytes of an item in a sort run before compression"""
+    if isinstance(item, TfExampleItem):
+        return len(item.tf_record)
+    return sum(len(str(value)) + 1 for value in item.csv_record.values())
+
 class SortRunMeta(object):
     def __init__(self, process_index, start_index, end_index):
         self._process_index = process_index
@@ -126,6 +144,8 @@ class SortRunDumper(object):
         self._dump_finished = False
         self._dumped_sort_run_metas = []
         self._fly_sort_run_dumper = None
+        self._writer_options = sort_run_writer_options(options)
+        self._metrics_tags = {'partition': options.partition_id}
         self._sync_manager_state(True)
 
     def get_next_index_to_dump(self):
@@ -157,6 +177,13 @@ class SortRunDumper(object):
             self._fly_sort_run_dumper.append(index, item)
         meta = self._fly_sort_run_dumper.finish_dumper()
         if meta is not None:
+            metrics.emit_counter(name='sort_run_dumper.runs_spilled',
+                                 value=1, tags=self._metrics_tags)
+            metrics.emit_counter(
+                    name='sort_run_dumper.bytes_written',
+                    value=gfile.Stat(self._fly_sort_run_dumper.fpath).length,
+                    tags=self._metrics_tags
+                )
             self._dumped_sort_run_metas.append(meta)
             with self._lock:
                 assert self._next_index_to_dump <= meta.end_index
@@ -216,7 +243,7 @@ class SortRunDumper(object):
         output_dir = self._get_output_dir()
         return SortRunDumper.SortRunWriter(process_index,
                                            output_dir,
-                                           self._options.writer_options)
+                                           self._writer_options)
 
     def _get_output_dir(self):
         return path.join(self.sort_run_dump_dir(),
@@ -14,10 +14,8 @@
 
 # coding: utf-8
 
-try:
-    import queue
-except ImportError:
-    import Queue as queue
+import heapq
+import itertools
 import logging
 import threading
 import os
@@ -25,10 +23,14 @@ import os
 import tensorflow_io # pylint: disable=unused-import
 from tensorflow.compat.v1 import gfile
 
+from fedlearner.common import metrics
+from fedlearner.common import data_join_service_pb2 as dj_pb
 from fedlearner.data_join.raw_data_iter_impl import create_raw_data_iter
 from fedlearner.data_join import common, visitor
 from fedlearner.data_join.output_writer_impl import create_output_writer
 
+DEFAULT_MERGE_BATCH_SIZE = 64
+
 class MergedSortRunMeta(object):
     def __init__(self, partition_id, process_index):
         self._partition_id = partition_id
@@ -64,33 +66,11 @@ class MergedSortRunMeta(object):
         return MergedSortRunMeta(int(segs[0]), int(segs[1]))
 
 class SortRunReader(object):
-    class MergeItem(object):
-        def __init__(self, item, reader_index, comparator):
-            self._item = item
-            self._reader_index = reader_index
-            self._comparator = comparator
-
-        @property
-        def inner_item(self):
-            return self._item
-
-        @property
-        def reader_index(self):
-            return self._reader_index
-
-        def __lt__(self, other):
-            assert isinstance(other, SortRunReader.MergeItem)
-            return self._comparator(self._item, other._item)
-
-        def __getattr__(self, attr):
-            return getattr(self._item, attr)
-
-    def __init__(self, reader_index, fpath,
-                 reader_options, comparator):
+    def __init__(self, reader_index, fpath, reader_options, sort_key):
         self._reader_index = reader_index
         self._fpath = fpath
         self._reader_options = reader_options
-        self._comparator = comparator
+        self._sort_key = sort_key
         self._fiter = None
         if gfile.Exists(fpath):
             self._finished = False
@@ -121,12 +101,29 @@ class SortRunReader(object):
                 else:
                     _, item = next(self._fiter)
                 assert item is not None
-                return SortRunReader.MergeItem(item, self._reader_index,
-                                               self._comparator)
+                return item
             except StopIteration:
                 self._finished = True
         raise StopIteration("%s has been iter finished" % self._fpath)
 
+    def iter_keyed_items(self, batch_size, min_key=None):
+        """Yield (sort key, reader index, item) tuples, reading the run in
+        batches and skipping items sorted before min_key. The tuples order
+        by key then reader index, without comparing the items"""
+        while True:
+            batch = list(itertools.islice(self, batch_size))
+            if len(batch) == 0:
+                return
+            keyed = [(self._sort_key(item), self._reader_index, item)
+                     for item in batch]
+            if min_key is not None:
+                if keyed[-1][0] < min_key:
+                    continue
+                keyed = [ki for ki in keyed if not ki[0] < min_key]
+                min_key = None
+            for keyed_item in keyed:
+                yield keyed_item
+
 class SortRunMergerWriter(object):
     def __init__(self, base_dir, process_index, partition_id, writer_options):
         self._merged_dir = \
@@ -175,15 +172,16 @@ class SortRunMergerWriter(object):
         return self._writer
 
 class SortRunMerger(object):
-    def __init__(self, options, comparator):
+    def __init__(self, options, sort_key):
         self._lock = threading.Lock()
         self._options = options
         self._merge_finished = False
-        self._comparator = comparator
+        self._sort_key = sort_key
         self._merged_dir = os.path.join(
                 self._options.output_file_dir,
                 common.partition_repr(self._partition_id)
             )
+        self._metrics_tags = {'partition': self._partition_id}
         self._create_merged_dir_if_need()
 
     def merge_sort_runs(self, input_fpaths):
@@ -195,22 +193,17 @@ class SortRunMerger(object):
             logging.info("no sort run for partition %d", self._partition_id)
             return []
         dumped_item, next_process_index = self._sync_merged_state()
-        readers = self._create_sort_run_readers(input_fpaths)
-        pque = queue.PriorityQueue(len(input_fpaths) + 1)
-        for idx, reader in enumerate(readers):
-            if not reader.finished():
-                for item in reader:
-                    if dumped_item is None or \
-                            not self._comparator(item, dumped_item):
-                        pque.put(item)
-                        break
+        dumped_key = None
+        if dumped_item is not None:
+            dumped_key = self._sort_key(dumped_item)
+        input_fpaths = self._merge_to_fan_in(input_fpaths, dumped_key)
         writer = self._create_sort_run_merger_writer(next_process_index)
-        while pque.qsize() > 0:
-            item = pque.get()
-            writer.append(item.inner_item)
-            assert item.reader_index < len(readers)
-            self._replenish_item(readers[item.reader_index], pque)
+        for item in self._merge_items(input_fpaths, dumped_key):
+            writer.append(item)
         writer.finish()
+        merge_pass_dir = self._merge_pass_dir(None)
+        if gfile.Exists(merge_pass_dir):
+            gfile.DeleteRecursively(merge_pass_dir)
         return self._list_merged_sort_run_fpath()
 
     def is_merged_finished(self):
@@ -221,12 +214,90 @@ class SortRunMerger(object):
         with self._lock:
             self._merge_finished = True
 
-    @classmethod
-    def _replenish_item(cls, reader, pque):
-        if not reader.finished():
-            for item in reader:
-                pque.put(item)
-                break
+    def _merge_items(self, input_fpaths, min_key=None):
+        readers = self._create_sort_run_readers(input_fpaths)
+        batch_size = self._options.reader_options.read_batch_size
+        if batch_size <= 0:
+            batch_size = DEFAULT_MERGE_BATCH_SIZE
+        keyed_iters = [reader.iter_keyed_items(batch_size, min_key)
+                       for reader in readers if not reader.finished()]
+        for _, _, item in heapq.merge(*keyed_iters):
+            yield item
+
+    def _merge_to_fan_in(self, input_fpaths, min_key=None):
+        """Merge groups of merge_fan_in consecutive runs into longer runs,
+        pass by pass, until at most merge_fan_in runs are left for the
+        final merge. The groups merged in a previous launch are kept. If
+        the final merge has dumped items up to min_key, the runs of the
+        last pass are reused as they are, or the passes only merge the
+        items from min_key if some of them are missing"""
+        fan_in = self._options.merge_fan_in
+        pass_run_nums = []
+        run_num = len(input_fpaths)
+        while fan_in > 1 and run_num > fan_in:
+            run_num = (run_num + fan_in - 1) // fan_in
+            pass_run_nums.append(run_num)
+        metrics.emit_store(name='sort_run_merger.merge_passes',
+                           value=len(pass_run_nums) + 1,
+                           tags=self._metrics_tags)
+        if len(pass_run_nums) == 0:
+            return input_fpaths
+        last_pass = len(pass_run_nums) - 1
+        last_fpaths = [self._merge_pass_fpath(last_pass, group)
+                       for group in range(pass_run_nums[-1])]
+        if min_key is not None and all(gfile.Exists(fpath)
+                                       for fpath in last_fpaths):
+            logging.info("reuse the %d sort runs of merge pass %d for "\
+                         "partition %d", len(last_fpaths), last_pass,
+                         self._partition_id)
+            return last_fpaths
+        for merge_pass in range(len(pass_run_nums)):
+            pass_dir = self._merge_pass_dir(merge_pass)
+            if not gfile.Exists(pass_dir):
+                gfile.MakeDirs(pass_dir)
+            output_fpaths = []
+            for group_index in range(0, len(input_fpaths), fan_in):
+                fpath = self._merge_pass_fpath(merge_pass,
+                                               group_index // fan_in)
+                if not gfile.Exists(fpath):
+                    self._merge_run_group(
+                        input_fpaths[group_index:group_index+fan_in],
+                        fpath, min_key)
+                output_fpaths.append(fpath)
+            logging.info("merge pass %d merged %d sort runs to %d for "\
+                         "partition %d", merge_pass, len(input_fpaths),
+                         len(output_fpaths), self._partition_id)
+            input_fpaths = output_fpaths
+        return input_fpaths
+
+    def _merge_run_group(self, input_fpaths, fpath, min_key=None):
+        # the runs of the pass are written in the format they are read
+        reader_options = self._options.reader_options
+        writer_options = dj_pb.WriterOptions(
+                output_writer=reader_options.raw_data_iter,
+                compressed_type=reader_options.compressed_type
+            )
+        tmp_fpath = common.gen_tmp_fpath(os.path.dirname(fpath))
+        writer = create_output_writer(writer_options, tmp_fpath)
+        for item in self._merge_items(input_fpaths, min_key):
+            writer.write_item(item)
+        writer.close()
+        metrics.emit_counter(name='sort_run_merger.bytes_written',
+                             value=gfile.Stat(tmp_fpath).length,
+                             tags=self._metrics_tags)
+        gfile.Rename(tmp_fpath, fpath, True)
+
+    def _merge_pass_dir(self, merge_pass):
+        pass_dir = os.path.join(self._options.output_file_dir,
+                                'sort_run_merge-tmp',
+                                common.partition_repr(self._partition_id))
+        if merge_pass is None:
+            return pass_dir
+        return os.path.join(pass_dir, 'pass_{:04}'.format(merge_pass))
+
+    def _merge_pass_fpath(self, merge_pass, group):
+        return os.path.join(self._merge_pass_dir(merge_pass), '{:08}{}'
+                            .format(group, common.RawDataFileSuffix))
 
     def _create_sort_run_readers(self, input_fpaths):
         assert len(input_fpaths) > 0
@@ -234,7 +305,7 @@ class SortRunMerger(object):
         for index, input_fpath in enumerate(input_fpaths):
             reader = SortRunReader(index, input_fpath,
                                    self._options.reader_options,
-                                   self._comparator)
+                                   self._sort_key)
             readers.append(reader)
         return readers
 
@@ -279,7 +350,7 @@ class SortRunMerger(object):
                              last_meta.encode_merged_sort_run_fname())
         last_item = None
         for item in SortRunReader(0, fpath, self._options.reader_options,
-                                  self._comparator):
+                                  self._sort_key):
             last_item = item
         assert last_item is not None
         return last_item, last_meta.process_index + 1
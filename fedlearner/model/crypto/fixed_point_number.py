@@ -87,6 +87,25 @@ class FixedPointNumber(object):
 
         return cls(int_fixpoint % n, exponent, n, max_int)
 
+    @classmethod
+    def batch_encode(cls, scalars, n, max_int, precision):
+        """return (encodings, exponent) of an array of floats encoded with
+        the same precision, equivalent to calling encode on each scalar.
+        """
+        exponent = math.floor(math.log(precision, cls.BASE))
+        scalars = np.asarray(scalars, dtype=np.float64)
+        scalars = np.where(np.abs(scalars) < 1e-200, 0.0, scalars)
+        # scaling by a power of two is exact in floating point
+        scaled = np.round(scalars * float(pow(cls.BASE, exponent)))
+        encodings = []
+        for int_fixpoint in map(int, scaled.tolist()):
+            if abs(int_fixpoint) > max_int:
+                raise ValueError('Integer needs to be within +/- %d but got %d'
+                                 % (max_int, int_fixpoint))
+            encodings.append(int_fixpoint % n)
+
+        return encodings, exponent
+
     def decode(self):
         """return decode plaintext.
         """
@@ -103,6 +122,25 @@ class FixedPointNumber(object):
             raise OverflowError('Overflow detected in decode number')
 
         return mantissa * pow(self.BASE, -self.exponent)
+
+    @classmethod
+    def batch_decode(cls, encodings, exponent, n, max_int):
+        """return a float64 array of decoded encodings sharing one exponent.
+        """
+        mantissas = []
+        for encoding in encodings:
+            if encoding >= n:
+                raise ValueError('Attempted to decode corrupted number')
+            elif encoding <= max_int:
+                mantissas.append(encoding)
+            elif encoding >= n - max_int:
+                mantissas.append(encoding - n)
+            else:
+                raise OverflowError('Overflow detected in decode number')
+
+        mantissas = np.fromiter(map(float, mantissas), dtype=np.float64,
+                                count=len(mantissas))
+        return mantissas * pow(cls.BASE, -exponent)
  
     def increase_exponent_to(self, new_exponent):
         """return FixedPointNumber: new encoding with same value but having great exponent.
@@ -18,6 +18,9 @@
 # pylint: disable-all
 
 import random
+from concurrent.futures import ProcessPoolExecutor
+
+import gmpy2
 
 from fedlearner.model.crypto.fixed_point_number import FixedPointNumber
 from fedlearner.model.crypto import gmpy_math 
@@ -103,6 +106,106 @@ class PaillierPublicKey(object):
 
         return encryptednumber
 
+    def batch_raw_encrypt(self, plaintexts, obfuscators, nbytes=None):
+        """Encrypt a batch of raw plaintexts with precomputed obfuscators.
+
+        Uses g^m = 1 + n*m mod n^2, so each number costs two modular
+        multiplications instead of a modular exponentiation. Returns the
+        ciphertexts as little endian bytes of length nbytes if given,
+        otherwise as ints.
+        """
+        if len(obfuscators) < len(plaintexts):
+            raise ValueError("not enough obfuscators: %d < %d" %
+                             (len(obfuscators), len(plaintexts)))
+
+        n = gmpy2.mpz(self.n)
+        nsquare = gmpy2.mpz(self.nsquare)
+        ciphertexts = [
+            int((n * plaintext + 1) * obfuscator % nsquare)
+            for plaintext, obfuscator in zip(plaintexts, obfuscators)]
+        if nbytes is None:
+            return ciphertexts
+
+        return [c.to_bytes(nbytes, 'little') for c in ciphertexts]
+
+    def batch_encrypt(self, values, precision, obfuscators, nbytes=None):
+        """Encode and encrypt a batch of real numbers with the same precision.
+
+        Returns (ciphertexts, exponent), see batch_raw_encrypt.
+        """
+        encodings, exponent = FixedPointNumber.batch_encode(
+            values, self.n, self.max_int, precision)
+
+        return self.batch_raw_encrypt(encodings, obfuscators, nbytes), exponent
+
+
+def _generate_obfuscators(args):
+    n, nsquare, count = args
+    rand = random.SystemRandom()
+    n = gmpy2.mpz(n)
+    nsquare = gmpy2.mpz(nsquare)
+
+    return [int(gmpy2.powmod(rand.randrange(1, n), n, nsquare))
+            for _ in range(count)]
+
+
+class PaillierObfuscatorPool(object):
+    """Precomputes obfuscators r^n mod n^2 in background worker processes.
+
+    The pool keeps about `capacity` obfuscators either ready or being
+    generated, and tops itself up whenever obfuscators are taken, so that
+    the next batch encryption finds them precomputed.
+    """
+    def __init__(self, public_key, capacity, num_workers=1, batch_size=4096):
+        self.public_key = public_key
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self._executor = ProcessPoolExecutor(num_workers)
+        self._ready = []
+        self._pending = []
+        self.refill()
+
+    def __len__(self):
+        return len(self._ready)
+
+    def _collect(self, block=False):
+        while self._pending and (block or self._pending[0].done()):
+            self._ready.extend(self._pending.pop(0).result())
+            block = False
+
+    def refill(self):
+        """submit generation jobs until the pool is full"""
+        self._collect()
+        num_pending = len(self._pending) * self.batch_size
+        while len(self._ready) + num_pending < self.capacity:
+            self._pending.append(self._executor.submit(
+                _generate_obfuscators,
+                (self.public_key.n, self.public_key.nsquare, self.batch_size)))
+            num_pending += self.batch_size
+
+    def get(self, count):
+        """return a list of count obfuscators, computing the missing ones
+        inline when the pool runs dry"""
+        self._collect()
+        while len(self._ready) < count and self._pending:
+            self._collect(block=True)
+        if len(self._ready) < count:
+            self._ready.extend(_generate_obfuscators(
+                (self.public_key.n, self.public_key.nsquare,
+                 count - len(self._ready))))
+
+        obfuscators = self._ready[:count]
+        del self._ready[:count]
+        self.refill()
+
+        return obfuscators
+
+    def close(self):
+        for future in self._pending:
+            future.cancel()
+        self._pending = []
+        self._executor.shutdown(wait=False)
+
 
 class PaillierPrivateKey(object):
     """Contains a private key and associated decryption method.
@@ -174,6 +277,40 @@ class PaillierPrivateKey(object):
 
         return self.crt(mp, mq)
 
+    def batch_raw_decrypt(self, ciphertexts):
+        """return raw plaintexts of a batch of ciphertexts.
+
+        ciphertexts can be ints or little endian bytes, as they are stored in
+        protobuf messages. Decryption is done modulo p^2 and q^2 and then
+        combined with the Chinese Remainder Theorem.
+        """
+        p, q = gmpy2.mpz(self.p), gmpy2.mpz(self.q)
+        p_1, q_1 = p - 1, q - 1
+        psquare, qsquare = gmpy2.mpz(self.psquare), gmpy2.mpz(self.qsquare)
+        hp, hq = gmpy2.mpz(self.hp), gmpy2.mpz(self.hq)
+        q_inverse = gmpy2.mpz(self.q_inverse)
+
+        plaintexts = []
+        for ciphertext in ciphertexts:
+            if isinstance(ciphertext, bytes):
+                ciphertext = int.from_bytes(ciphertext, 'little')
+            ciphertext = gmpy2.mpz(ciphertext)
+            mp = (gmpy2.powmod(ciphertext, p_1, psquare) - 1) // p * hp % p
+            mq = (gmpy2.powmod(ciphertext, q_1, qsquare) - 1) // q * hq % q
+            # mq + u * q < n, no reduction needed
+            u = (mp - mq) * q_inverse % p
+            plaintexts.append(int(mq + u * q))
+
+        return plaintexts
+
+    def batch_decrypt(self, ciphertexts, exponent):
+        """return a float64 array of decrypted & decoded ciphertexts that
+        were encoded with the same exponent.
+        """
+        return FixedPointNumber.batch_decode(
+            self.batch_raw_decrypt(ciphertexts), exponent,
+            self.public_key.n, self.public_key.max_int)
+
     def decrypt(self, encrypted_number):
         """return the decrypted & decoded plaintext of encrypted_number.
         """
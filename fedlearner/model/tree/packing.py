@@ -14,110 +14,148 @@
 
 # coding: utf-8
 import math
+import gmpy2
+import numpy as np
 from fedlearner.model.crypto.fixed_point_number import FixedPointNumber
-from fedlearner.model.crypto.paillier import PaillierEncryptedNumber
 
-# reserve some bits to avoid the result of hess
-# addition overflow to the result of grad
-RESERVED_BIT = 48
 
+class HistogramPacker:
+    """Pack Grad and Hess of Samples and Histogram Bins into Plaintexts
 
-class GradHessPacker:
-    """Pack the Plaintext of Grad and Hess
+    Every sample is encoded as a bin of two slots, grad in the high slot and
+    hess in the low slot. A value is a fixed point number in two's
+    complement of `value_bits` bits, and a slot reserves enough extra bits
+    to sum the values of all samples without carrying into the next slot.
+    After the histograms of a node are aggregated, several bins are packed
+    into one ciphertext, so that fewer ciphertexts are sent and decrypted.
+    A bin only sums the samples of its node, so the bins of smaller nodes
+    take fewer bits and more of them are packed.
     Attributes:
         public_key: public_key
-        private_key: private_key
-        precision: precision for fixed_point_number
-        exponent: exponent for fixed_point_number
-        offset: the offset position to place grad plaintext
-        _n: the modulo when scalar is negative
-        max_int: the maximum of plaintext absolute value of scalar
+        value_bits: bit length of an encoded value
+        slot_bits: bit length of a slot, value_bits plus headroom for sums
+        exponent: exponent for fixed point encoding, only known by the
+            party that encodes and decodes
     """
-    def __init__(self, public_key, precision, exponent):
-        """Init GradHessPakcer
-        """
+    def __init__(self, public_key, value_bits, slot_bits, exponent=None):
         self.public_key = public_key
-        self.precision = precision
+        self.value_bits = int(value_bits)
+        self.slot_bits = int(slot_bits)
         self.exponent = exponent
-        # the bit length of n in public key
-        n_length = math.frexp(self.public_key.n)[1]
-        self.offset = n_length // 2
-        bit_length = self.offset - RESERVED_BIT
-        self._n = 1 << bit_length
-        self.max_int = self._n // 2 - 1
+        # packed plaintext must stay below n
+        self._plaintext_bits = self.public_key.n.bit_length() - 1
+        assert self.bins_per_ciphertext(None) >= 1, \
+            'slot of %d bits is too large for the public key' % slot_bits
+
+    def bin_bits(self, num_samples):
+        """Bit length of a bin summing num_samples samples, the hess slot
+        and the grad sum above it, or of a bin of all samples if None"""
+        if num_samples is None:
+            return 2 * self.slot_bits
+        num_bits = max(int(num_samples), 1).bit_length()
+        return min(self.slot_bits + self.value_bits + num_bits,
+                   2 * self.slot_bits)
+
+    def bins_per_ciphertext(self, num_samples):
+        """Number of bins summing num_samples samples in one ciphertext"""
+        return self._plaintext_bits // self.bin_bits(num_samples)
+
+    @classmethod
+    def create(cls, public_key, precision, num_samples, max_value):
+        """Derive slot widths for num_samples values bounded by max_value
+        Args:
+            public_key: public_key
+            precision: precision for fixed point encoding
+            num_samples: the maximum number of values summed into a bin
+            max_value: the maximum absolute value of grad and hess
+        Returns:
+            HistogramPacker
+        """
+        exponent = math.floor(math.log(precision, FixedPointNumber.BASE))
+        scale = FixedPointNumber.BASE ** exponent
+        num_samples = max(int(num_samples), 1)
+        # bound of a bin sum, including rounding errors of all samples
+        bound = int(math.ceil(max_value * scale)) * num_samples + num_samples
+        value_bits = bound.bit_length() + 1
+        slot_bits = value_bits + num_samples.bit_length()
+        return cls(public_key, value_bits, slot_bits, exponent)
+
+    def _encode(self, values):
+        scale = FixedPointNumber.BASE ** self.exponent
+        scaled = np.round(np.asarray(values, dtype=np.float64) * scale)
+        assert np.isfinite(scaled).all(), 'values must be finite'
+        mask = (1 << self.value_bits) - 1
+        return [int(v) & mask for v in scaled.tolist()]
+
+    def _decode(self, encodings):
+        mask = (1 << self.value_bits) - 1
+        sign = 1 << (self.value_bits - 1)
+        values = []
+        for encoding in encodings:
+            encoding &= mask
+            values.append(float(encoding - (encoding & sign) * 2))
+        return np.asarray(values, dtype=np.float64) * \
+            pow(FixedPointNumber.BASE, -self.exponent)
 
     def pack_grad_hess(self, grad, hess):
-        """Pack Grad and Hess into Plaintext
+        """Pack Grad and Hess of each Sample into one Plaintext
         Args:
             grad: list of grad value
             hess: list of hess value
-            output: output ciphertext or encrypted number
-
         Returns:
-            Plaintext of packed number
+            list of plaintext
         """
         assert len(grad) == len(
             hess), 'the length of grad and hess list should be equal'
-        grad_plaintext = [
-            FixedPointNumber.encode(g, self._n, self.max_int, self.precision)
-            for g in grad
-        ]
-        hess_plaintext = [
-            FixedPointNumber.encode(h, self._n, self.max_int, self.precision)
-            for h in hess
-        ]
-        grad_hess_encoding = [
-            (g_text.encoding << self.offset) + h_text.encoding
-            for g_text, h_text in zip(grad_plaintext, hess_plaintext)
-        ]
-        return grad_hess_encoding
+        return [(g << self.slot_bits) + h for g, h in
+                zip(self._encode(grad), self._encode(hess))]
 
-    def pack_and_encrypt_grad_hess(self, grad, hess):
-        """Pack and Encrypt Grad and Hess
+    def pack_ciphertexts(self, ciphertexts, num_samples):
+        """Pack Ciphertexts of Histogram Bins
+        Bin j of a group is shifted by j * bin_bits with the homomorphic
+        scalar multiplication E(m)^(2^k) = E(m * 2^k), in Horner form so
+        that each ciphertext costs one exponentiation by 2^bin_bits.
         Args:
-            grad: list of grad
-            hess: list of hess
+            ciphertexts: list of ciphertext of bins
+            num_samples: number of samples of the node of the bins
         Returns:
-            encrypted number of packed grad and hess
+            list of packed ciphertext
         """
-        grad_hess_encoding = self.pack_grad_hess(grad, hess)
-        grad_hess_ciphertext = [
-            self.public_key.raw_encrypt(encoding, random_value=None)
-            for encoding in grad_hess_encoding
-        ]
-        enc_numbers = [
-            PaillierEncryptedNumber(self.public_key, i, self.exponent)
-            for i in grad_hess_ciphertext
-        ]
-        return enc_numbers
+        nsquare = gmpy2.mpz(self.public_key.nsquare)
+        shift = gmpy2.mpz(1) << self.bin_bits(num_samples)
+        group_size = self.bins_per_ciphertext(num_samples)
+        packed = []
+        for begin in range(0, len(ciphertexts), group_size):
+            group = ciphertexts[begin:begin + group_size]
+            acc = gmpy2.mpz(group[-1])
+            for ciphertext in reversed(group[:-1]):
+                acc = gmpy2.powmod(acc, shift, nsquare) * ciphertext % nsquare
+            packed.append(int(acc))
+        return packed
 
-    def decrypt_and_unpack_grad_hess(self, grad_hess_ciphertext, private_key):
-        """Decrypt and Unpack Ciphertext into grad and hess
+    def unpack_histograms(self, plaintexts, num_bins, num_samples):
+        """Unpack Decrypted Packed Ciphertexts into Grad and Hess
         Args:
-            grad_hess_ciphertext: packed grad and hess ciphertext
-            private_key: private_key for decryption
+            plaintexts: decrypted plaintext of packed ciphertexts
+            num_bins: total number of bins packed
+            num_samples: number of samples of the node of the bins
         Returns:
-            list of grad and hess
+            array of grad and hess of each bin
         """
-        assert private_key.public_key == self.public_key, \
-            'private key is not paired with public key in GradHessPacker'
-        grad_hess_plaintext = [
-            private_key.raw_decrypt(ciphertext)
-            for ciphertext in grad_hess_ciphertext
-        ]
-        grad_plaintext = [(plaintext >> self.offset) % self._n
-                          for plaintext in grad_hess_plaintext]
-        hess_plaintext = [
-            plaintext % self._n for plaintext in grad_hess_plaintext
-        ]
-        grad = [
-            FixedPointNumber(encoding, self.exponent, self._n,
-                             self.max_int).decode()
-            for encoding in grad_plaintext
-        ]
-        hess = [
-            FixedPointNumber(encoding, self.exponent, self._n,
-                             self.max_int).decode()
-            for encoding in hess_plaintext
-        ]
-        return grad, hess
+        bin_bits = self.bin_bits(num_samples)
+        group_size = self.bins_per_ciphertext(num_samples)
+        bin_mask = (1 << bin_bits) - 1
+        slot_mask = (1 << self.slot_bits) - 1
+        grad = []
+        hess = []
+        for plaintext in plaintexts:
+            for _ in range(group_size):
+                if len(grad) == num_bins:
+                    break
+                value = plaintext & bin_mask
+                grad.append(value >> self.slot_bits)
+                hess.append(value & slot_mask)
+                plaintext >>= bin_bits
+        assert len(grad) == num_bins, \
+            'expect %d bins but got %d' % (num_bins, len(grad))
+        return self._decode(grad), self._decode(hess)
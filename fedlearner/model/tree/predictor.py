@@ -0,0 +1,151 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import numpy as np
+
+PREDICT_BLOCK_SIZE = 1 << 16
+
+
+def _predict_block_helper(args):
+    ensemble, features, cat_features = args
+    return ensemble.assign(features, cat_features)
+
+
+class CompiledEnsemble(object):
+    """Tree ensemble flattened into contiguous node arrays.
+
+    Nodes of all trees are numbered globally, tree i taking nodes
+    offsets[i] to offsets[i+1]. Leaves point to themselves as both
+    children, so samples can be advanced through every tree at once
+    until all of them reach a leaf. Categorical thresholds are stored as
+    rows of a packed bitset indexed by category value.
+    """
+    def __init__(self, trees):
+        nodes = [node for tree in trees for node in tree.nodes]
+        sizes = [len(tree.nodes) for tree in trees]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        base = np.repeat(self.offsets[:-1], sizes)
+
+        self.is_owner = np.asarray([n.is_owner for n in nodes], dtype=bool)
+        self.is_leaf = np.asarray([n.left_child == 0 for n in nodes],
+                                  dtype=bool)
+        self.feature_id = np.asarray([n.feature_id for n in nodes],
+                                     dtype=np.int64)
+        self.threshold = np.asarray([n.threshold for n in nodes],
+                                    dtype=np.float64)
+        self.default_left = np.asarray([n.default_left for n in nodes],
+                                       dtype=bool)
+        self.weight = np.asarray([n.weight for n in nodes], dtype=np.float64)
+        index = np.arange(len(nodes), dtype=np.int64)
+        left = np.asarray([n.left_child for n in nodes], dtype=np.int64)
+        right = np.asarray([n.right_child for n in nodes], dtype=np.int64)
+        self.children = np.stack([
+            np.where(self.is_leaf, index, base + left),
+            np.where(self.is_leaf, index, base + right)])
+
+        # row 0 of the bitset is empty and used by all other nodes
+        self.cat_row = np.zeros(len(nodes), dtype=np.int64)
+        cat_nodes = [i for i, n in enumerate(nodes)
+                     if n.is_cat_feature and not self.is_leaf[i]]
+        num_cats = max(
+            [max(nodes[i].cat_threshold, default=-1) for i in cat_nodes],
+            default=-1) + 1
+        self.num_cats = num_cats
+        self.cat_bits = np.zeros(
+            (len(cat_nodes) + 1, (num_cats + 7) // 8), dtype=np.uint8)
+        for row, i in enumerate(cat_nodes, 1):
+            self.cat_row[i] = row
+            values = np.asarray(nodes[i].cat_threshold, dtype=np.int64)
+            values = values[values >= 0]
+            np.bitwise_or.at(
+                self.cat_bits[row], values >> 3,
+                np.left_shift(1, values & 7).astype(np.uint8))
+
+    @property
+    def num_trees(self):
+        return len(self.offsets) - 1
+
+    def direction(self, features, cat_features, rows, nodes):
+        """Return whether samples rows go to the right child of nodes"""
+        fid = self.feature_id[nodes]
+        num_features = features.shape[1]
+        is_cont = fid < num_features
+
+        if num_features:
+            x = features[rows, np.where(is_cont, fid, 0)]
+        else:
+            x = np.full(len(rows), np.nan)
+        d = ~np.where(np.isnan(x), self.default_left[nodes],
+                      x < self.threshold[nodes])
+
+        num_cat_features = cat_features.shape[1]
+        if num_cat_features and not is_cont.all():
+            cat_fid = np.clip(fid - num_features, 0, num_cat_features - 1)
+            x = cat_features[rows, cat_fid].astype(np.int64)
+            in_range = (x >= 0) & (x < self.num_cats)
+            x = np.where(in_range, x, 0)
+            bits = self.cat_bits[self.cat_row[nodes], x >> 3]
+            is_in = in_range & ((bits >> (x & 7)) & 1).astype(bool)
+            d = np.where(is_cont, d, ~is_in)
+
+        return d
+
+    def advance(self, nodes, direction):
+        return self.children[direction.astype(np.int64), nodes]
+
+    def assign(self, features, cat_features):
+        """Return the leaf of every sample in every tree, as global node
+        ids of shape (num_samples, num_trees)"""
+        num_samples = features.shape[0]
+        nodes = np.tile(self.offsets[:-1], num_samples)
+        # positions in the flattened (num_samples, num_trees) matrix that
+        # have not reached a leaf yet
+        active = np.flatnonzero(~self.is_leaf[nodes])
+        while active.size:
+            active_nodes = nodes[active]
+            direction = self.direction(
+                features, cat_features, active // self.num_trees,
+                active_nodes)
+            active_nodes = self.advance(active_nodes, direction)
+            nodes[active] = active_nodes
+            active = active[~self.is_leaf[active_nodes]]
+        return nodes.reshape(num_samples, self.num_trees)
+
+    def batch_assign(self, features, cat_features, pool=None,
+                     block_size=PREDICT_BLOCK_SIZE):
+        """assign in blocks of rows, in parallel if pool is given"""
+        num_samples = features.shape[0]
+        blocks = [
+            (self, features[i:i+block_size], cat_features[i:i+block_size])
+            for i in range(0, num_samples, block_size)]
+        if pool is not None and len(blocks) > 1:
+            results = list(pool.map(_predict_block_helper, blocks))
+        else:
+            results = [_predict_block_helper(i) for i in blocks]
+        if not results:
+            return np.zeros((0, self.num_trees), dtype=np.int64)
+        return np.concatenate(results)
+
+    def raw_predict(self, assignment, dtype=np.float32):
+        """Sum leaf weights tree by tree given leaves from assign"""
+        raw_prediction = np.zeros(assignment.shape[0], dtype=dtype)
+        for i in range(self.num_trees):
+            raw_prediction += self.weight[assignment[:, i]]
+        return raw_prediction
+
+    def local_assignment(self, assignment, tree_id):
+        """Node ids within tree tree_id, as used in tree protos"""
+        return assignment[:, tree_id] - self.offsets[tree_id]
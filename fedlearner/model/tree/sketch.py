@@ -0,0 +1,110 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import numpy as np
+
+SKETCH_TYPE = np.float32
+DEFAULT_SKETCH_SIZE = 2048
+
+
+class QuantileSketch(object):
+    """Mergeable KLL quantile sketch over one column of floats.
+
+    Items at level h stand for 2^h input values. When a level grows beyond
+    its capacity it is sorted and every other item, starting at a random
+    offset, is promoted to the next level. Capacities shrink geometrically
+    towards the lower levels, so the sketch holds O(k) items and answers
+    rank queries within O(n/k) of the exact rank.
+
+    Until more than max_unique distinct values are seen the sketch also
+    keeps them exactly, so that low cardinality columns can be binned by
+    their distinct values as in exact binning.
+    """
+    def __init__(self, k=DEFAULT_SKETCH_SIZE, max_unique=0, seed=None):
+        self._k = k
+        self._max_unique = max_unique
+        self._rng = np.random.RandomState(seed)
+        self._levels = [np.zeros(0, dtype=SKETCH_TYPE)]
+        self.count = 0
+        self.unique_values = np.zeros(0, dtype=SKETCH_TYPE)
+
+    def _capacity(self, level):
+        depth = len(self._levels) - level - 1
+        return max(int(self._k * (2.0 / 3.0) ** depth), 2)
+
+    def _update_unique(self, values):
+        if self.unique_values is None:
+            return
+        self.unique_values = np.union1d(self.unique_values, values)
+        if len(self.unique_values) > self._max_unique:
+            self.unique_values = None
+
+    def _compress(self):
+        level = 0
+        while level < len(self._levels):
+            items = self._levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self._levels):
+                    self._levels.append(np.zeros(0, dtype=SKETCH_TYPE))
+                items = np.sort(items)
+                # keep one item at this level if the size is odd
+                keep = items[:len(items) % 2]
+                items = items[len(keep):]
+                promoted = items[self._rng.randint(2)::2]
+                self._levels[level] = keep
+                self._levels[level + 1] = np.concatenate(
+                    [self._levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values):
+        """Add a chunk of values, ignoring NaN"""
+        values = np.asarray(values, dtype=SKETCH_TYPE)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        self.count += values.size
+        self._update_unique(values)
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        """Merge another sketch into this one"""
+        self.count += other.count
+        if other.unique_values is None:
+            self.unique_values = None
+        else:
+            self._update_unique(other.unique_values)
+        while len(self._levels) < len(other._levels):
+            self._levels.append(np.zeros(0, dtype=SKETCH_TYPE))
+        for level, items in enumerate(other._levels):
+            self._levels[level] = np.concatenate([self._levels[level], items])
+        self._compress()
+        return self
+
+    def quantiles(self, qs):
+        """Return approximate quantiles, qs being fractions in [0, 1]"""
+        items = np.concatenate(self._levels)
+        weights = np.concatenate([
+            np.full(len(level_items), 1 << level, dtype=np.int64)
+            for level, level_items in enumerate(self._levels)])
+        if not items.size:
+            return np.full(len(qs), np.nan, dtype=SKETCH_TYPE)
+        order = np.argsort(items, kind='mergesort')
+        items = items[order]
+        ranks = np.cumsum(weights[order])
+        index = np.searchsorted(
+            ranks, np.asarray(qs) * ranks[-1], side='left')
+        return items[np.minimum(index, len(items) - 1)]
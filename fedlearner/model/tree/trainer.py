@@ -16,20 +16,27 @@
 
 import os
 import csv
+import json
+import shutil
+import hashlib
 import queue
 import logging
 import argparse
 import traceback
 import itertools
+from concurrent.futures import ProcessPoolExecutor
 from fnmatch import fnmatch
 from typing import List
 import numpy as np
+import pandas as pd
 
 import tensorflow.compat.v1 as tf
 
 from fedlearner.common.argparse_util import str_as_bool
 from fedlearner.trainer.bridge import Bridge
-from fedlearner.model.tree.tree import BoostingTreeEnsamble
+from fedlearner.model.tree.tree import BoostingTreeEnsamble, \
+    BinnedFeatures, bin_features, sketch_thresholds, PACKING_PRECISION
+from fedlearner.model.tree.sketch import QuantileSketch
 from fedlearner.model.tree.trainer_master_client import LocalTrainerMasterClient
 from fedlearner.model.tree.trainer_master_client import DataBlockInfo
 
@@ -150,10 +157,36 @@ def create_argument_parser():
                         type=str_as_bool,
                         default=False, const=True, nargs='?',
                         help='Whether to enable packing grad and hess')
+    parser.add_argument('--packing-precision',
+                        type=float,
+                        default=PACKING_PRECISION,
+                        help='Fixed point precision of grad and hess '
+                             'packed into histogram slots, a higher '
+                             'precision packs fewer bins per ciphertext.')
+    parser.add_argument('--obfuscator-pool-size',
+                        type=int,
+                        default=0,
+                        help='Number of Paillier obfuscators the leader '
+                             'precomputes in background processes. '
+                             '0 disables precomputation.')
     parser.add_argument('--label-field',
                         type=str,
                         default='label',
                         help='selected label name')
+    parser.add_argument('--quantile-sketch',
+                        type=str_as_bool,
+                        default=False, const=True, nargs='?',
+                        help='Whether to compute bin thresholds with '
+                             'mergeable quantile sketches streamed over '
+                             'the data, so that raw features are binned '
+                             'chunk by chunk and never held in memory.')
+    parser.add_argument('--binned-cache-path',
+                        type=str,
+                        default=None,
+                        help='Local directory to cache binned training '
+                             'data in. Later runs on the same data and '
+                             'max_bins memory-map the cache instead of '
+                             'reading raw data.')
 
     return parser
 
@@ -204,27 +237,103 @@ def filter_files(path: str, file_ext: str, file_wildcard: str) -> List[str]:
     return files
 
 
-def read_data(file_type, filename, require_example_ids, require_labels,
-              ignore_fields, cat_fields, label_field):
-    logging.debug('Reading data file from %s', filename)
+READ_CHUNK_SIZE = 65536
 
-    if file_type == 'tfrecord':
-        reader = tf.io.tf_record_iterator(filename)
-        reader, tmp_reader = itertools.tee(reader)
-        first_line = parse_tfrecord(next(tmp_reader))
-        field_names = first_line.keys()
-    else:
-        fin = tf.io.gfile.GFile(filename, 'r')
-        reader = csv.DictReader(fin)
-        field_names = reader.fieldnames
 
-    example_ids = extract_field(
-        field_names, 'example_id', require_example_ids)
-    raw_ids = extract_field(
-        field_names, 'raw_id', False)
-    labels = extract_field(
-        field_names, label_field, require_labels)
+class ColumnBuffer(object):
+    """Growable 2-d buffer with a fixed number of columns.
+
+    Rows are appended in blocks into preallocated storage whose capacity
+    doubles when full, so building an n-row matrix costs O(n) copies.
+    """
+    def __init__(self, num_columns, dtype, capacity=1024):
+        self._data = np.empty((capacity, num_columns), dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
 
+    def extend(self, rows):
+        num_rows = rows.shape[0]
+        if self._size + num_rows > self._data.shape[0]:
+            capacity = max(2 * self._data.shape[0], self._size + num_rows)
+            data = np.empty(
+                (capacity, self._data.shape[1]), dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size:self._size + num_rows] = rows
+        self._size += num_rows
+
+    def to_array(self):
+        self._data.resize(
+            (self._size, self._data.shape[1]), refcheck=False)
+        return self._data
+
+
+# strings parsed as missing values of features, as float() does
+NAN_VALUES = ['', 'nan', 'NaN', 'NAN', '-nan']
+
+
+def _read_field_names(file_type, filename):
+    if file_type == 'tfrecord':
+        reader = tf.io.tf_record_iterator(filename)
+        first_line = next(reader, None)
+        return list(parse_tfrecord(first_line).keys()) if first_line else []
+    with tf.io.gfile.GFile(filename, 'r') as fin:
+        return next(csv.reader([fin.readline()]), [])
+
+
+def _iter_csv_chunks(filename, field_names, cont_columns, cat_columns,
+                     label_field, id_fields, chunk_size):
+    """Parse csv in chunks of rows with the C parser of pandas"""
+    if not field_names:
+        # an empty file has no header for pandas to parse
+        return
+    dtype = {name: str for name in id_fields}
+    dtype.update({name: np.float32 for name in cont_columns})
+    dtype.update({name: np.int32 for name in cat_columns})
+    if label_field in field_names:
+        dtype[label_field] = np.float64
+    fin = tf.io.gfile.GFile(filename, 'r')
+    fin.readline()
+    reader = pd.read_csv(
+        fin, header=None, names=field_names, usecols=list(dtype),
+        dtype=dtype, keep_default_na=False,
+        na_values={name: NAN_VALUES for name in cont_columns},
+        chunksize=chunk_size)
+    for df in reader:
+        yield df[cont_columns].to_numpy(dtype=np.float32), \
+            df[cat_columns].to_numpy(dtype=np.int32), \
+            df[label_field].to_numpy(dtype=np.float64) \
+                if label_field in field_names else None, \
+            {name: df[name].tolist() for name in id_fields}
+    fin.close()
+
+
+def _iter_tfrecord_chunks(filename, cont_columns, cat_columns,
+                          label_field, id_fields, chunk_size):
+    def to_float(x):
+        return float(x if x not in ['', None] else 'nan')
+    reader = map(parse_tfrecord, tf.io.tf_record_iterator(filename))
+    while True:
+        rows = list(itertools.islice(reader, chunk_size))
+        if not rows:
+            break
+        features = np.asarray(
+            [[to_float(line.get(i)) for i in cont_columns] for line in rows],
+            dtype=np.float32).reshape(len(rows), len(cont_columns))
+        cat_features = np.asarray(
+            [[int(line[i]) for i in cat_columns] for line in rows],
+            dtype=np.int32).reshape(len(rows), len(cat_columns))
+        labels = None
+        if label_field in rows[0]:
+            labels = np.asarray(
+                [float(line[label_field]) for line in rows], dtype=np.float64)
+        ids = {name: [str(line[name]) for line in rows] for name in id_fields}
+        yield features, cat_features, labels, ids
+
+
+def _select_columns(field_names, ignore_fields, cat_fields, label_field):
     ignore_fields = set(filter(bool, ignore_fields.strip().split(',')))
     ignore_fields.update(['example_id', 'raw_id', label_field])
     cat_fields = set(filter(bool, cat_fields.strip().split(',')))
@@ -237,85 +346,288 @@ def read_data(file_type, filename, require_example_ids, require_labels,
     cat_columns = list(filter(
         lambda x: x in cat_fields and x not in ignore_fields, field_names))
     cat_columns.sort()
+    return cont_columns, cat_columns
 
-    features = []
-    cat_features = []
-    def to_float(x):
-        return float(x if x not in ['', None] else 'nan')
-    for line in reader:
-        if file_type == 'tfrecord':
-            line = parse_tfrecord(line)
+
+def _iter_chunks(file_type, filename, field_names, cont_columns, cat_columns,
+                 label_field, id_fields, chunk_size):
+    if file_type == 'tfrecord':
+        return _iter_tfrecord_chunks(
+            filename, cont_columns, cat_columns, label_field, id_fields,
+            chunk_size)
+    return _iter_csv_chunks(
+        filename, field_names, cont_columns, cat_columns, label_field,
+        id_fields, chunk_size)
+
+
+def read_data(file_type, filename, require_example_ids, require_labels,
+              ignore_fields, cat_fields, label_field,
+              chunk_size=READ_CHUNK_SIZE, thresholds=None):
+    """Read one data file chunk by chunk. If thresholds are given,
+    continuous features are returned already binned as uint8, each chunk
+    being binned right after it is parsed."""
+    logging.debug('Reading data file from %s', filename)
+
+    field_names = _read_field_names(file_type, filename)
+
+    example_ids = extract_field(
+        field_names, 'example_id', require_example_ids)
+    raw_ids = extract_field(
+        field_names, 'raw_id', False)
+    labels = extract_field(
+        field_names, label_field, require_labels)
+
+    cont_columns, cat_columns = _select_columns(
+        field_names, ignore_fields, cat_fields, label_field)
+    if thresholds is not None:
+        assert len(thresholds) == len(cont_columns), \
+            "thresholds mismatch columns in %s"%filename
+
+    id_fields = [name for name in ['example_id', 'raw_id']
+                 if name in field_names]
+    chunks = _iter_chunks(
+        file_type, filename, field_names, cont_columns, cat_columns,
+        label_field, id_fields, chunk_size)
+
+    features = ColumnBuffer(
+        len(cont_columns), np.float32 if thresholds is None else np.uint8)
+    cat_features = ColumnBuffer(len(cat_columns), np.int32)
+    if labels is not None:
+        labels = ColumnBuffer(1, np.float64)
+    for ifeatures, icat_features, ilabels, ids in chunks:
+        if thresholds is not None:
+            ifeatures = bin_features(ifeatures, thresholds)
+        features.extend(ifeatures)
+        cat_features.extend(icat_features)
+        if labels is not None:
+            labels.extend(ilabels[:, None])
         if example_ids is not None:
-            example_ids.append(str(line['example_id']))
+            example_ids.extend(ids['example_id'])
         if raw_ids is not None:
-            raw_ids.append(str(line['raw_id']))
-        if labels is not None:
-            labels.append(float(line[label_field]))
-        features.append([to_float(line.get(i)) for i in cont_columns])
-        cat_features.append([int(line[i]) for i in cat_columns])
+            raw_ids.extend(ids['raw_id'])
 
-    features = np.array(features, dtype=np.float)
-    cat_features = np.array(cat_features, dtype=np.int32)
+    features = features.to_array()
+    cat_features = cat_features.to_array()
     if labels is not None:
-        labels = np.asarray(labels, dtype=np.float)
+        labels = labels.to_array()[:, 0]
 
     return features, cat_features, cont_columns, cat_columns, \
         labels, example_ids, raw_ids
 
 
+def sketch_data(file_type, filename, ignore_fields, cat_fields, label_field,
+                max_bins, chunk_size=READ_CHUNK_SIZE):
+    """Stream one data file into a QuantileSketch per continuous feature"""
+    logging.debug('Sketching data file %s', filename)
+
+    field_names = _read_field_names(file_type, filename)
+    cont_columns, _ = _select_columns(
+        field_names, ignore_fields, cat_fields, label_field)
+    chunks = _iter_chunks(
+        file_type, filename, field_names, cont_columns, [], None, [],
+        chunk_size)
+    sketches = [QuantileSketch(max_unique=max_bins) for _ in cont_columns]
+    for ifeatures, _, _, _ in chunks:
+        for i, sketch in enumerate(sketches):
+            sketch.update(ifeatures[:, i])
+
+    return cont_columns, sketches
+
+
+def _read_data_helper(args):
+    return read_data(*args)
+
+
+def _sketch_data_helper(args):
+    return sketch_data(*args)
+
+
+def _stitch(parts):
+    """Copy per-file arrays into one preallocated array, dropping each
+    part from the list once copied so it can be freed if the list holds
+    the last reference"""
+    total = sum(part.shape[0] for part in parts)
+    ret = np.empty((total,) + parts[0].shape[1:], dtype=parts[0].dtype)
+    begin = 0
+    for i in range(len(parts)):
+        end = begin + parts[i].shape[0]
+        ret[begin:end] = parts[i]
+        parts[i] = None
+        begin = end
+    return ret
+
+
 def read_data_dir(file_ext: str, file_wildcard: str, file_type: str, path: str,
                   require_example_ids: bool, require_labels: bool,
-                  ignore_fields: str, cat_fields: str, label_field: str):
+                  ignore_fields: str, cat_fields: str, label_field: str,
+                  num_parallel: int = 1, thresholds=None):
     if not tf.io.gfile.isdir(path):
         return read_data(
             file_type, path, require_example_ids,
-            require_labels, ignore_fields, cat_fields, label_field)
+            require_labels, ignore_fields, cat_fields, label_field,
+            thresholds=thresholds)
 
     files = filter_files(path, file_ext, file_wildcard)
     files.sort()
-    features = None
-    for fullname in files:
-        ifeatures, icat_features, icont_columns, icat_columns, \
-            ilabels, iexample_ids, iraw_ids = read_data(
-                file_type, fullname, require_example_ids, require_labels,
-                ignore_fields, cat_fields, label_field
-            )
-        if features is None:
-            features = ifeatures
-            cat_features = icat_features
-            cont_columns = icont_columns
-            cat_columns = icat_columns
-            labels = ilabels
-            example_ids = iexample_ids
-            raw_ids = iraw_ids
-        else:
-            assert cont_columns == icont_columns, \
-                "columns mismatch between files %s vs %s"%(
-                    cont_columns, icont_columns)
-            assert cat_columns == icat_columns, \
-                "columns mismatch between files %s vs %s"%(
-                    cat_columns, icat_columns)
-            features = np.concatenate((features, ifeatures), axis=0)
-            cat_features = np.concatenate(
-                (cat_features, icat_features), axis=0)
-            if labels is not None:
-                labels = np.concatenate((labels, ilabels), axis=0)
-            if example_ids is not None:
-                example_ids.extend(iexample_ids)
-            if raw_ids is not None:
-                raw_ids.extend(iraw_ids)
-
-    assert features is not None, "No data found in %s"%path
+    assert files, "No data found in %s"%path
+
+    args = [
+        (file_type, fullname, require_example_ids, require_labels,
+         ignore_fields, cat_fields, label_field, READ_CHUNK_SIZE, thresholds)
+        for fullname in files]
+    if num_parallel > 1 and len(files) > 1:
+        with ProcessPoolExecutor(min(num_parallel, len(files))) as pool:
+            results = list(pool.map(_read_data_helper, args))
+    else:
+        results = [_read_data_helper(i) for i in args]
+
+    cont_columns, cat_columns = results[0][2], results[0][3]
+    for fullname, ret in zip(files, results):
+        assert cont_columns == ret[2], \
+            "columns mismatch between files %s vs %s in %s"%(
+                cont_columns, ret[2], fullname)
+        assert cat_columns == ret[3], \
+            "columns mismatch between files %s vs %s in %s"%(
+                cat_columns, ret[3], fullname)
+
+    # move the per-file outputs into one list per column, so every part is
+    # only referenced there and freed by _stitch once copied
+    parts = [list(column) for column in zip(*results)]
+    del results
+    features = _stitch(parts[0])
+    cat_features = _stitch(parts[1])
+    labels = None if parts[4][0] is None else _stitch(parts[4])
+    example_ids = None if parts[5][0] is None else \
+        list(itertools.chain.from_iterable(parts[5]))
+    raw_ids = None if parts[6][0] is None else \
+        list(itertools.chain.from_iterable(parts[6]))
 
     return features, cat_features, cont_columns, cat_columns, \
         labels, example_ids, raw_ids
 
 
+def sketch_data_dir(file_ext: str, file_wildcard: str, file_type: str,
+                    path: str, ignore_fields: str, cat_fields: str,
+                    label_field: str, max_bins: int, num_parallel: int = 1):
+    """Compute bin thresholds of continuous features in one streaming pass,
+    merging the quantile sketches of all files"""
+    if tf.io.gfile.isdir(path):
+        files = filter_files(path, file_ext, file_wildcard)
+        files.sort()
+        assert files, "No data found in %s"%path
+    else:
+        files = [path]
+
+    args = [
+        (file_type, fullname, ignore_fields, cat_fields, label_field,
+         max_bins)
+        for fullname in files]
+    if num_parallel > 1 and len(files) > 1:
+        with ProcessPoolExecutor(min(num_parallel, len(files))) as pool:
+            results = list(pool.map(_sketch_data_helper, args))
+    else:
+        results = [_sketch_data_helper(i) for i in args]
+
+    cont_columns, sketches = results[0]
+    for fullname, (columns, file_sketches) in zip(files[1:], results[1:]):
+        assert cont_columns == columns, \
+            "columns mismatch between files %s vs %s in %s"%(
+                cont_columns, columns, fullname)
+        for sketch, file_sketch in zip(sketches, file_sketches):
+            sketch.merge(file_sketch)
+
+    return cont_columns, \
+        [sketch_thresholds(sketch, max_bins) for sketch in sketches]
+
+
+def data_fingerprint(args, path):
+    """Hash the data files' names, sizes and modification times together
+    with the options that decide how they are parsed"""
+    if tf.io.gfile.isdir(path):
+        files = filter_files(path, args.file_ext, args.file_wildcard)
+        files.sort()
+    else:
+        files = [path]
+    md5 = hashlib.md5()
+    for option in [args.file_type, args.ignore_fields, args.cat_fields,
+                   args.label_field, args.verify_example_ids,
+                   args.role != 'follower', args.quantile_sketch]:
+        md5.update(('%s\n'%option).encode())
+    for fullname in files:
+        stat = tf.io.gfile.stat(fullname)
+        md5.update(('%s %d %d\n'%(
+            fullname, stat.length, stat.mtime_nsec)).encode())
+    return md5.hexdigest()
+
+
+def save_binned_cache(path, binned, labels, example_ids,
+                      feature_names, cat_feature_names):
+    logging.info('Saving binned features to cache %s', path)
+    tmp_path = '%s.tmp-%d'%(path, os.getpid())
+    binned.save(tmp_path)
+    if labels is not None:
+        np.save(os.path.join(tmp_path, 'labels.npy'), labels)
+    if example_ids is not None:
+        np.save(os.path.join(tmp_path, 'example_ids.npy'),
+                np.asarray(example_ids, dtype=np.str_))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as fout:
+        json.dump({'feature_names': feature_names,
+                   'cat_feature_names': cat_feature_names}, fout)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another worker finished the same cache first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_binned_cache(path, max_bins):
+    logging.info('Loading binned features from cache %s', path)
+    binned = BinnedFeatures.load(path, max_bins)
+    labels = example_ids = None
+    if os.path.exists(os.path.join(path, 'labels.npy')):
+        labels = np.load(os.path.join(path, 'labels.npy'), mmap_mode='r')
+    if os.path.exists(os.path.join(path, 'example_ids.npy')):
+        example_ids = np.load(
+            os.path.join(path, 'example_ids.npy')).tolist()
+    with open(os.path.join(path, 'meta.json')) as fin:
+        meta = json.load(fin)
+    return binned, labels, example_ids, \
+        meta['feature_names'], meta['cat_feature_names']
+
+
 def train(args, booster):
-    X, cat_X, X_names, cat_X_names, y, example_ids, _ = read_data_dir(
-        args.file_ext, args.file_wildcard, args.file_type, args.data_path,
-        args.verify_example_ids, args.role != 'follower', args.ignore_fields,
-        args.cat_fields, args.label_field)
+    cache_path = None
+    if args.binned_cache_path:
+        cache_path = os.path.join(
+            args.binned_cache_path, '%s-%d'%(
+                data_fingerprint(args, args.data_path), args.max_bins))
+
+    if cache_path and os.path.isdir(cache_path):
+        binned, y, example_ids, X_names, cat_X_names = \
+            load_binned_cache(cache_path, args.max_bins)
+    else:
+        thresholds = None
+        if args.quantile_sketch:
+            _, thresholds = sketch_data_dir(
+                args.file_ext, args.file_wildcard, args.file_type,
+                args.data_path, args.ignore_fields, args.cat_fields,
+                args.label_field, args.max_bins, args.num_parallel)
+        X, cat_X, X_names, cat_X_names, y, example_ids, _ = read_data_dir(
+            args.file_ext, args.file_wildcard, args.file_type,
+            args.data_path, args.verify_example_ids,
+            args.role != 'follower', args.ignore_fields,
+            args.cat_fields, args.label_field, args.num_parallel,
+            thresholds=thresholds)
+        if thresholds is not None:
+            binned = BinnedFeatures.from_binned(
+                X, thresholds, args.max_bins, cat_features=cat_X)
+        else:
+            binned = BinnedFeatures(X, args.max_bins, cat_features=cat_X)
+        del X, cat_X
+        if cache_path:
+            os.makedirs(args.binned_cache_path, exist_ok=True)
+            save_binned_cache(cache_path, binned, y, example_ids,
+                              X_names, cat_X_names)
 
     if args.validation_data_path:
         val_X, val_cat_X, val_X_names, val_cat_X_names, val_y, \
@@ -324,7 +636,7 @@ def train(args, booster):
                 args.file_ext, args.file_wildcard, args.file_type,
                 args.validation_data_path, args.verify_example_ids,
                 args.role != 'follower', args.ignore_fields,
-                args.cat_fields, args.label_field)
+                args.cat_fields, args.label_field, args.num_parallel)
         assert X_names == val_X_names, \
             "Train data and validation data must have same features"
         assert cat_X_names == val_cat_X_names, \
@@ -338,8 +650,8 @@ def train(args, booster):
         tf.io.gfile.makedirs(args.checkpoint_path)
 
     booster.fit(
-        X, y,
-        cat_features=cat_X,
+        None, y,
+        binned=binned,
         checkpoint_path=args.checkpoint_path,
         example_ids=example_ids,
         validation_features=val_X,
@@ -351,8 +663,8 @@ def train(args, booster):
         cat_feature_names=cat_X_names)
 
 
-def write_predictions(filename, pred, example_ids=None, raw_ids=None):
-    logging.debug("Writing predictions to %s.tmp", filename)
+def _write_prediction_lines(fout, pred, example_ids=None, raw_ids=None,
+                            header=True):
     headers = []
     lines = []
     if example_ids is not None:
@@ -365,16 +677,98 @@ def write_predictions(filename, pred, example_ids=None, raw_ids=None):
     lines.append(pred)
     lines = zip(*lines)
 
-    fout = tf.io.gfile.GFile(filename+'.tmp', 'w')
-    fout.write(','.join(headers) + '\n')
+    if header:
+        fout.write(','.join(headers) + '\n')
     for line in lines:
         fout.write(','.join([str(i) for i in line]) + '\n')
+
+
+def write_predictions(filename, pred, example_ids=None, raw_ids=None):
+    logging.debug("Writing predictions to %s.tmp", filename)
+    fout = tf.io.gfile.GFile(filename+'.tmp', 'w')
+    _write_prediction_lines(fout, pred, example_ids, raw_ids)
     fout.close()
 
     logging.debug("Renaming %s.tmp to %s", filename, filename)
     tf.io.gfile.rename(filename+'.tmp', filename, overwrite=True)
 
+
+def iter_data(file_type, filename, require_example_ids, ignore_fields,
+              cat_fields, label_field, chunk_size=READ_CHUNK_SIZE):
+    """Return feature names, id fields and an iterator over chunks of
+    features, categorical features, labels, example ids and raw ids of
+    one file"""
+    field_names = _read_field_names(file_type, filename)
+    extract_field(field_names, 'example_id', require_example_ids)
+    cont_columns, cat_columns = _select_columns(
+        field_names, ignore_fields, cat_fields, label_field)
+    id_fields = [name for name in ['example_id', 'raw_id']
+                 if name in field_names]
+
+    def gen():
+        for features, cat_features, labels, ids in _iter_chunks(
+                file_type, filename, field_names, cont_columns, cat_columns,
+                label_field, id_fields, chunk_size):
+            yield features, cat_features, labels, \
+                ids.get('example_id'), ids.get('raw_id')
+
+    return cont_columns, cat_columns, id_fields, gen()
+
+
+def test_one_file_streaming(args, booster, data_file, output_file):
+    """Predict a file chunk by chunk in local mode, writing predictions
+    as they are computed"""
+    X_names, cat_X_names, id_fields, chunks = iter_data(
+        args.file_type, data_file, args.verify_example_ids,
+        args.ignore_fields, args.cat_fields, args.label_field)
+
+    fout = None
+    if output_file:
+        tf.io.gfile.makedirs(os.path.dirname(output_file))
+        fout = tf.io.gfile.GFile(output_file + '.tmp', 'w')
+        # the header goes first so that an empty file still gets one
+        _write_prediction_lines(
+            fout, [],
+            [] if 'example_id' in id_fields else None,
+            [] if 'raw_id' in id_fields else None)
+
+    preds = []
+    labels = []
+    ids = []
+    def feature_chunks():
+        for X, cat_X, y, example_ids, raw_ids in chunks:
+            ids.append((example_ids, raw_ids))
+            if y is not None and len(y) > 0:
+                labels.append(y)
+            yield X, cat_X
+
+    for pred in booster.iter_predict(
+            feature_chunks(), feature_names=X_names,
+            cat_feature_names=cat_X_names):
+        preds.append(pred)
+        example_ids, raw_ids = ids.pop(0)
+        if fout is not None:
+            _write_prediction_lines(
+                fout, pred, example_ids, raw_ids, header=False)
+
+    if labels:
+        metrics = booster.loss.metrics(
+            np.concatenate(preds), np.concatenate(labels))
+        booster.iter_metrics_handler(metrics, 'eval')
+    else:
+        metrics = {}
+    logging.info("Test metrics: %s", metrics)
+
+    if fout is not None:
+        fout.close()
+        tf.io.gfile.rename(output_file + '.tmp', output_file, overwrite=True)
+
+
 def test_one_file(args, bridge, booster, data_file, output_file):
+    if bridge is None and data_file is not None:
+        test_one_file_streaming(args, booster, data_file, output_file)
+        return
+
     if data_file is None:
         X = cat_X = X_names = cat_X_names = y = example_ids = raw_ids = None
     else:
@@ -548,7 +942,9 @@ def run(args):
             loss_type=args.loss_type,
             send_scores_to_follower=args.send_scores_to_follower,
             send_metrics_to_follower=args.send_metrics_to_follower,
-            enable_packing=args.enable_packing)
+            enable_packing=args.enable_packing,
+            packing_precision=args.packing_precision,
+            obfuscator_pool_size=args.obfuscator_pool_size)
 
         if args.load_model_path:
             booster.load_saved_model(args.load_model_path)
@@ -25,7 +25,8 @@ import numpy as np
 from google.protobuf import text_format
 import tensorflow.compat.v1 as tf
 from fedlearner.common.metric_collector import metric_collector
-from fedlearner.model.tree.packing import GradHessPacker
+from fedlearner.model.tree.packing import HistogramPacker
+from fedlearner.model.tree.predictor import CompiledEnsemble
 from fedlearner.model.tree.loss import LogisticLoss, MSELoss
 from fedlearner.model.crypto import paillier, fixed_point_number
 from fedlearner.common import tree_model_pb2 as tree_pb2
@@ -37,6 +38,9 @@ BST_TYPE = np.float32
 PRECISION = 1e38
 EXPONENT = math.floor(
     math.log(PRECISION, fixed_point_number.FixedPointNumber.BASE))
+# default fixed point precision of grad and hess packed into histogram
+# slots, 1e10 encodes values in units of 16^-8, about 2.3e-10
+PACKING_PRECISION = 1e10
 KEY_NBITS = 1024
 CIPHER_NBYTES = (KEY_NBITS * 2)//8
 
@@ -59,20 +63,23 @@ def _encode_encrypted_numbers(numbers):
         i.ciphertext(False).to_bytes(CIPHER_NBYTES, 'little') \
         for i in numbers]
 
-def _encrypt_numbers(public_key, numbers):
+def _encrypt_numbers(public_key, numbers, obfuscator_pool=None):
+    if obfuscator_pool is not None:
+        ciphertext, _ = public_key.batch_encrypt(
+            numbers, PRECISION, obfuscator_pool.get(len(numbers)),
+            CIPHER_NBYTES)
+        return ciphertext
     return _encode_encrypted_numbers(
         [public_key.encrypt(i, PRECISION) for i in numbers])
 
-def _decrypt_number(private_key, numbers):
-    return [private_key.decrypt(i) for i in numbers]
-
 def _from_ciphertext(public_key, ciphertext):
     return [
         paillier.PaillierEncryptedNumber(
             public_key, int.from_bytes(i, 'little'), EXPONENT)
         for i in ciphertext]
 
-def _encrypt_and_send_numbers(bridge, name, public_key, numbers):
+def _encrypt_and_send_numbers(bridge, name, public_key, numbers,
+                              obfuscator_pool=None):
     num_parts = (len(numbers) + MAX_PARTITION_SIZE - 1)//MAX_PARTITION_SIZE
     bridge.send_proto(
         '%s_partition_info'%name,
@@ -81,7 +88,8 @@ def _encrypt_and_send_numbers(bridge, name, public_key, numbers):
     for i in range(num_parts):
         part = numbers[i*MAX_PARTITION_SIZE:(i+1)*MAX_PARTITION_SIZE]
         msg = tree_pb2.EncryptedNumbers()
-        msg.ciphertext.extend(_encrypt_numbers(public_key, part))
+        msg.ciphertext.extend(
+            _encrypt_numbers(public_key, part, obfuscator_pool))
         bridge.send_proto('%s_part_%d'%(name, i), msg)
 
 def _raw_encrypt_numbers(args):
@@ -92,11 +100,22 @@ def _raw_encrypt_numbers(args):
     ]
     return part_id, ciphertext
 
-def _raw_encrypt_and_send_numbers(bridge, name, public_key, numbers, pool=None):
+def _raw_encrypt_and_send_numbers(bridge, name, public_key, numbers, pool=None,
+                                  obfuscator_pool=None):
     num_parts = (len(numbers) + MAX_PARTITION_SIZE - 1) // MAX_PARTITION_SIZE
     bridge.send_proto('%s_partition_info' % name,
                       tree_pb2.PartitionInfo(num_partitions=num_parts))
-    if not pool:
+    if obfuscator_pool is not None:
+        # obfuscators are precomputed, encryption is cheap enough to be
+        # done inline
+        for part_id in range(num_parts):
+            part = numbers[part_id * MAX_PARTITION_SIZE:
+                           (part_id + 1) * MAX_PARTITION_SIZE]
+            msg = tree_pb2.EncryptedNumbers()
+            msg.ciphertext.extend(public_key.batch_raw_encrypt(
+                part, obfuscator_pool.get(len(part)), CIPHER_NBYTES))
+            bridge.send_proto('%s_part_%d' % (name, part_id), msg)
+    elif not pool:
         for part_id in range(num_parts):
             part = numbers[part_id * MAX_PARTITION_SIZE:
                            (part_id + 1) * MAX_PARTITION_SIZE]
@@ -151,13 +170,90 @@ class BinnedFeatures(object):
         self.cat_num_bins = [
             cat_features[:, i].max()+1 for i in range(cat_features.shape[1])]
 
+        self.num_samples = self.features.shape[0]
         self.num_features = self.features.shape[1]
         self.num_cat_features = self.cat_features.shape[1]
         self.num_all_features = self.num_features + self.num_cat_features
 
+    def save(self, path):
+        """Save binned features as .npy files under directory path. Raw
+        features are not saved."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'binned.npy'), self.binned)
+        np.save(os.path.join(path, 'cat_features.npy'), self.cat_features)
+        np.save(os.path.join(path, 'thresholds.npy'),
+                np.concatenate(self.thresholds + [np.zeros(0, BST_TYPE)]))
+        np.save(os.path.join(path, 'num_bins.npy'),
+                np.asarray(self.num_bins, dtype=np.int64))
+        np.save(os.path.join(path, 'cat_num_bins.npy'),
+                np.asarray(self.cat_num_bins, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path, max_bins, mmap_mode='r'):
+        """Load binned features saved by save, memory-mapping the binned
+        matrices. The loaded object has no raw features."""
+        binned = cls.__new__(cls)
+        binned._max_bins = max_bins
+        binned.features = None
+        binned.binned = np.load(
+            os.path.join(path, 'binned.npy'), mmap_mode=mmap_mode)
+        binned.cat_features = np.load(
+            os.path.join(path, 'cat_features.npy'), mmap_mode=mmap_mode)
+        binned.num_bins = np.load(
+            os.path.join(path, 'num_bins.npy')).tolist()
+        binned.cat_num_bins = np.load(
+            os.path.join(path, 'cat_num_bins.npy')).tolist()
+        thresholds = np.load(os.path.join(path, 'thresholds.npy'))
+        binned.thresholds = np.split(
+            thresholds, np.cumsum([i - 2 for i in binned.num_bins])[:-1]) \
+            if binned.num_bins else []
+
+        binned.num_samples = binned.binned.shape[0]
+        binned.num_features = binned.binned.shape[1]
+        binned.num_cat_features = binned.cat_features.shape[1]
+        binned.num_all_features = \
+            binned.num_features + binned.num_cat_features
+        return binned
+
+    def dequantize(self):
+        """Return features that fall into the same bins as the raw
+        features, i.e. the smallest float no less than the lower
+        threshold of each bin."""
+        features = np.empty(self.binned.shape, dtype=BST_TYPE)
+        for i, threshold in enumerate(self.thresholds):
+            lower = threshold.astype(BST_TYPE)
+            lower = np.where(lower < threshold,
+                             np.nextafter(lower, BST_TYPE(np.inf)), lower)
+            lower = np.concatenate([[-np.inf], lower, [np.nan]])
+            features[:, i] = lower[self.binned[:, i]]
+        return features
+
+    @classmethod
+    def from_binned(cls, binned, thresholds, max_bins, cat_features=None):
+        """Build from features already assigned to bins by bin_features,
+        e.g. by a data loader that drops raw features chunk by chunk.
+        The result has no raw features."""
+        ret = cls.__new__(cls)
+        ret._max_bins = max_bins
+        ret.features = None
+        ret.binned = np.asfortranarray(binned)
+        ret.thresholds = thresholds
+        ret.num_bins = [len(i) + 2 for i in thresholds]
+
+        if cat_features is None:
+            cat_features = np.zeros((binned.shape[0], 0), dtype=np.int32)
+        ret.cat_features = cat_features
+        ret.cat_num_bins = [
+            cat_features[:, i].max()+1 for i in range(cat_features.shape[1])]
+
+        ret.num_samples = ret.binned.shape[0]
+        ret.num_features = ret.binned.shape[1]
+        ret.num_cat_features = ret.cat_features.shape[1]
+        ret.num_all_features = ret.num_features + ret.num_cat_features
+        return ret
+
     def _bin_features(self, features):
         thresholds = []
-        binned = np.zeros_like(features, dtype=np.uint8, order='F')
         for i in range(features.shape[1]):
             x = features[:, i]
             missing_mask = np.isnan(x)
@@ -177,10 +273,28 @@ class BinnedFeatures(object):
                 assert threshold.size == self._max_bins - 1
             thresholds.append(threshold)
 
-            binned[:, i] = np.searchsorted(threshold, x, side='right')
-            binned[missing_mask, i] = threshold.size + 1
+        return bin_features(features, thresholds), thresholds
 
-        return binned, thresholds
+
+def sketch_thresholds(sketch, max_bins):
+    """Compute bin thresholds of one feature from its QuantileSketch. Like
+    exact binning, features with at most max_bins distinct values are
+    split between every two adjacent values."""
+    if sketch.unique_values is not None:
+        unique_x = sketch.unique_values
+        return (unique_x[:-1] + unique_x[1:]) * 0.5
+    return sketch.quantiles(np.linspace(0, 1, num=max_bins + 1)[1:-1])
+
+
+def bin_features(features, thresholds):
+    """Assign features to bins given thresholds of each feature. Missing
+    values go to the last bin."""
+    binned = np.zeros_like(features, dtype=np.uint8, order='F')
+    for i, threshold in enumerate(thresholds):
+        x = features[:, i]
+        binned[:, i] = np.searchsorted(threshold, x, side='right')
+        binned[np.isnan(x), i] = threshold.size + 1
+    return binned
 
 
 def _compute_histogram_helper(args):
@@ -195,6 +309,51 @@ def _compute_histogram_helper(args):
     return hists
 
 
+HIST_BLOCK_SIZE = 1 << 22
+
+
+def _compute_plain_histogram_helper(args):
+    """Build grad and hess histograms of all features in one pass.
+
+    Bins of every feature are laid out back to back in one flat array, so
+    each (sample, feature) pair maps to `offsets[feature] + bin` and the
+    whole block is reduced by a single `np.bincount`. Rows are processed in
+    blocks to bound the size of the temporary index array, and the gather
+    of `binned_features` rows is shared by grad and hess.
+    """
+    base, grad, hess, binned_features, sample_ids, num_bins, dtype = args
+    logging.debug('Computing histogram for feature %d to %d',
+                  base, base + len(num_bins))
+    num_features = len(num_bins)
+    offsets = np.zeros(num_features + 1, dtype=np.int64)
+    np.cumsum(num_bins, out=offsets[1:])
+    total_bins = int(offsets[-1])
+    grad_hist = np.zeros(total_bins, dtype=np.float64)
+    hess_hist = np.zeros(total_bins, dtype=np.float64)
+
+    if num_features > 0:
+        block_size = max(HIST_BLOCK_SIZE // num_features, 1)
+        for begin in range(0, len(sample_ids), block_size):
+            ids = sample_ids[begin:begin + block_size]
+            index = binned_features[ids].astype(np.int64)
+            index += offsets[:-1]
+            index = index.ravel()
+            grad_hist += np.bincount(
+                index, weights=np.repeat(grad[ids], num_features),
+                minlength=total_bins)
+            hess_hist += np.bincount(
+                index, weights=np.repeat(hess[ids], num_features),
+                minlength=total_bins)
+
+    grad_hist = grad_hist.astype(dtype)
+    hess_hist = hess_hist.astype(dtype)
+    grad_hists = [grad_hist[offsets[i]:offsets[i+1]]
+                  for i in range(num_features)]
+    hess_hists = [hess_hist[offsets[i]:offsets[i+1]]
+                  for i in range(num_features)]
+    return grad_hists, hess_hists
+
+
 class HistogramBuilder(object):
     def __init__(self, binned_features, dtype=BST_TYPE,
                  num_parallel=1, pool=None):
@@ -204,6 +363,53 @@ class HistogramBuilder(object):
         self._num_parallel = num_parallel
         self._pool = pool
 
+    def compute_grad_hess_histograms(self, grad, hess, sample_ids):
+        """Compute plaintext grad and hess histograms of all features.
+
+        Returns a (grad_hists, hess_hists) pair of lists with one array per
+        feature, continuous features first.
+        """
+        sample_ids = np.asarray(sample_ids)
+        if not self._pool:
+            args = [
+                (0, grad, hess, self._bins.binned, sample_ids,
+                 self._bins.num_bins, self._dtype),
+                (self._bins.num_features, grad, hess,
+                 self._bins.cat_features, sample_ids,
+                 self._bins.cat_num_bins, self._dtype)]
+            rets = [_compute_plain_histogram_helper(i) for i in args]
+        else:
+            num_jobs = self._num_parallel
+            job_size = \
+                (self._bins.num_features + num_jobs - 1)//num_jobs
+            cat_job_size = \
+                (self._bins.num_cat_features + num_jobs - 1)//num_jobs
+            grad = grad[sample_ids]
+            hess = hess[sample_ids]
+            local_ids = np.arange(len(sample_ids), dtype=np.int64)
+            args = [
+                (job_size*i, grad, hess,
+                 self._bins.binned[
+                     sample_ids, job_size*i:job_size*(i+1)],
+                 local_ids,
+                 self._bins.num_bins[job_size*i:job_size*(i+1)],
+                 self._dtype)
+                for i in range(num_jobs)
+            ] + [
+                (self._bins.num_features + cat_job_size*i, grad, hess,
+                 self._bins.cat_features[
+                     sample_ids, cat_job_size*i:cat_job_size*(i+1)],
+                 local_ids,
+                 self._bins.cat_num_bins[cat_job_size*i:cat_job_size*(i+1)],
+                 self._dtype)
+                for i in range(num_jobs)
+            ]
+            rets = list(self._pool.map(_compute_plain_histogram_helper, args))
+
+        grad_hists = sum([i[0] for i in rets], [])
+        hess_hists = sum([i[1] for i in rets], [])
+        return grad_hists, hess_hists
+
     def compute_histogram(self, values, sample_ids):
         if not self._pool:
             hists = _compute_histogram_helper(
@@ -243,12 +449,13 @@ class HistogramBuilder(object):
 
 
 class GrowerNode(object):
-    def __init__(self, node_id):
+    def __init__(self, node_id, sample_indices=None):
         self.node_id = node_id
         self.num_features = None
         self.feature_id = None
         self.is_cat_feature = None
         self.threshold = None
+        self.split_bin = None
         self.cat_threshold = None
         self.default_left = None
         self.is_owner = None
@@ -259,7 +466,12 @@ class GrowerNode(object):
         self.left_child = None
         self.right_child = None
 
-        self.sample_ids = []
+        # samples of this node are sample_indices[sample_begin:sample_end],
+        # the index array is shared by all nodes of a tree and partitioned
+        # in place when a node is split
+        self.sample_indices = sample_indices
+        self.sample_begin = 0
+        self.sample_end = 0
         self.grad_hists = None
         self.hess_hists = None
 
@@ -271,6 +483,34 @@ class GrowerNode(object):
         self.IG = None
         self.NI = None
 
+    @property
+    def sample_ids(self):
+        return self.sample_indices[self.sample_begin:self.sample_end]
+
+    @property
+    def num_samples(self):
+        return self.sample_end - self.sample_begin
+
+    def partition_samples(self, left_child, right_child, is_left):
+        """Reorder this node's samples in place so that left samples come
+        first, and point the children at the two halves. The relative order
+        within each half is preserved, so both parties stay consistent."""
+        sample_ids = self.sample_ids
+        left_ids = sample_ids[is_left]
+        right_ids = sample_ids[~is_left]
+        self.set_children_samples(left_child, right_child, left_ids, right_ids)
+
+    def set_children_samples(self, left_child, right_child,
+                             left_ids, right_ids):
+        assert len(left_ids) + len(right_ids) == self.num_samples
+        middle = self.sample_begin + len(left_ids)
+        self.sample_indices[self.sample_begin:middle] = left_ids
+        self.sample_indices[middle:self.sample_end] = right_ids
+        left_child.sample_begin = self.sample_begin
+        left_child.sample_end = middle
+        right_child.sample_begin = middle
+        right_child.sample_end = self.sample_end
+
     def is_left_sample(self, binned, idx):
         assert self.is_owner
 
@@ -279,9 +519,11 @@ class GrowerNode(object):
                 idx, self.feature_id - self.num_features]
             return np.in1d(x, self.cat_threshold)
 
-        x = binned.features[idx, self.feature_id]
-        isnan = np.isnan(x)
-        return np.where(isnan, self.default_left, x < self.threshold)
+        # x < thresholds[split_bin] holds iff x falls into a bin no
+        # greater than split_bin, and the last bin holds missing values
+        x = binned.binned[idx, self.feature_id]
+        isnan = x == binned.num_bins[self.feature_id] - 1
+        return np.where(isnan, self.default_left, x <= self.split_bin)
 
     def to_proto(self):
         return tree_pb2.RegressionTreeNodeProto(
@@ -306,7 +548,7 @@ class BaseGrower(object):
                  num_parallel=1, pool=None):
         self._binned = binned
         self._labels = labels
-        self._num_samples = binned.features.shape[0]
+        self._num_samples = binned.num_samples
         self._is_cat_feature = \
             [False] * binned.num_features + [True] * binned.num_cat_features
         self._grad = grad
@@ -336,8 +578,9 @@ class BaseGrower(object):
             binned, dtype, num_parallel, self._pool)
 
         self._nodes = []
+        self._sample_indices = np.arange(self._num_samples, dtype=np.int32)
         self._add_node(0)
-        self._nodes[0].sample_ids = list(range(binned.features.shape[0]))
+        self._nodes[0].sample_end = self._num_samples
         self._num_leaves = 1
 
     def _initialize_feature_importance(self):
@@ -377,9 +620,9 @@ class BaseGrower(object):
         self._compute_Gini_Entropy(left_child)
         self._compute_Gini_Entropy(right_child)
 
-        node_len = len(node.sample_ids)
-        node_right_len = len(right_child.sample_ids)
-        node_left_len = len(left_child.sample_ids)
+        node_len = node.num_samples
+        node_right_len = right_child.num_samples
+        node_left_len = left_child.num_samples
         if node_len == 0:
             node.IG = 0
             node.NI = 0
@@ -403,10 +646,9 @@ class BaseGrower(object):
                                         self._feature_importance.sum()
 
     def _compute_histogram(self, node):
-        node.grad_hists = self._hist_builder.compute_histogram(
-            self._grad, node.sample_ids)
-        node.hess_hists = self._hist_builder.compute_histogram(
-            self._hess, node.sample_ids)
+        node.grad_hists, node.hess_hists = \
+            self._hist_builder.compute_grad_hess_histograms(
+                self._grad, self._hess, node.sample_ids)
 
     def _compute_histogram_from_sibling(self, node, sibling):
         parent = self._nodes[node.parent]
@@ -415,90 +657,142 @@ class BaseGrower(object):
         node.hess_hists = [
             p - l for p, l in zip(parent.hess_hists, sibling.hess_hists)]
 
-    def _compare_split(self, split_info, default_left,
-                       feature_id, split_point,
-                       left_g, left_h, right_g, right_h):
+    def _release_histograms(self, node):
+        # histograms of a split node are not needed once both children
+        # have theirs, drop them to bound memory
+        node.grad_hists = None
+        node.hess_hists = None
+
+    def _split_gain(self, left_g, left_h, right_g, right_h):
         lam = self._l2_regularization
-        lr = self._learning_rate
         sum_g = left_g + right_g
         sum_h = left_h + right_h
-        gain = left_g*left_g/(left_h + lam) + \
-            right_g*right_g/(right_h + lam) - \
-            sum_g*sum_g/(sum_h + lam)
-        if not gain >= 0:
-            logging.warning("the value of gain %f is invalid, left_h: %f, "
-                            "right_h: %f, left_g: %f, right_g: %f, lam: %f",
-                            gain, left_g, right_g, left_h, right_h, lam)
-        if gain > split_info.gain:
-            split_info.gain = gain
-            split_info.feature_id = feature_id
-            split_info.split_point[:] = split_point
-            split_info.default_left = default_left
-            split_info.left_weight = - lr * left_g/(left_h + lam)
-            split_info.right_weight = - lr * right_g/(right_h + lam)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain = left_g*left_g/(left_h + lam) + \
+                right_g*right_g/(right_h + lam) - \
+                sum_g*sum_g/(sum_h + lam)
+        return np.where(np.isnan(gain), -np.inf, gain)
 
     def _find_split_and_push(self, node):
         assert len(self._is_cat_feature) == len(node.grad_hists)
 
-        split_info = tree_pb2.SplitInfo(
-            node_id=node.node_id, gain=-1e38)
-        for fid, is_cat in enumerate(self._is_cat_feature):
-            if is_cat:
-                self._find_cat_split(node, fid, split_info)
-            else:
-                self._find_cont_split(node, fid, split_info)
+        is_cat_feature = np.asarray(self._is_cat_feature, dtype=np.bool_)
+        feature_gains = np.full(len(is_cat_feature), -np.inf)
+        candidates = {}
+        for fids, find_split in [
+                (np.flatnonzero(~is_cat_feature), self._find_cont_split),
+                (np.flatnonzero(is_cat_feature), self._find_cat_split)]:
+            if fids.size == 0:
+                continue
+            gains, splits = find_split(node, fids)
+            feature_gains[fids] = gains
+            candidates.update(zip(fids.tolist(), splits))
+
+        # ties are broken towards the smallest feature id, as in
+        # a sequential scan over features
+        fid = int(np.argmax(feature_gains))
+        gain = feature_gains[fid]
+        assert gain > -1e38, 'the length of split point must not be 0'
+        if gain < 0:
+            logging.warning("the value of gain %f is invalid", gain)
 
-        assert len(split_info.split_point) != 0, \
-            'the length of split point must not be 0'
+        lam = self._l2_regularization
+        lr = self._learning_rate
+        default_left, split_point, left_g, left_h, right_g, right_h = \
+            candidates[fid]
+        split_info = tree_pb2.SplitInfo(
+            node_id=node.node_id,
+            gain=gain,
+            feature_id=fid,
+            split_point=split_point,
+            default_left=default_left,
+            left_weight=- lr * left_g/(left_h + lam),
+            right_weight=- lr * right_g/(right_h + lam))
         self._split_candidates.put((-split_info.gain, split_info))
 
         return split_info.gain, split_info
 
-    def _find_cont_split(self, node, fid, split_info):
-        grad_hist = node.grad_hists[fid]
-        hess_hist = node.hess_hists[fid]
-        sum_g = sum(grad_hist)
-        sum_h = sum(hess_hist)
-        left_g = 0.0
-        left_h = 0.0
-        nan_g = grad_hist[-1]
-        nan_h = hess_hist[-1]
-        for i in range(len(grad_hist) - 2):
-            left_g += grad_hist[i]
-            left_h += hess_hist[i]
-            self._compare_split(
-                split_info, True, fid, [i],
-                left_g + nan_g, left_h + nan_h,
-                sum_g - left_g - nan_g, sum_h - left_h - nan_h)
-            self._compare_split(
-                split_info, False, fid, [i],
-                left_g, left_h,
-                sum_g - left_g, sum_h - left_h)
-
-    def _find_cat_split(self, node, fid, split_info):
-        grad_hist = node.grad_hists[fid]
-        hess_hist = node.hess_hists[fid]
-        sum_g = sum(grad_hist)
-        sum_h = sum(hess_hist)
-        left_g = 0.0
-        left_h = 0.0
-        split_point = []
-        order = [
-            (i, g/h + self._l2_regularization)
-            for i, (g, h) in enumerate(zip(grad_hist, hess_hist))]
-        order.sort(key=lambda x: x[1])
-        for i, _ in order:
-            split_point.append(i)
-            left_g += grad_hist[i]
-            left_h += hess_hist[i]
-            self._compare_split(
-                split_info, True, fid, split_point,
-                left_g, left_h,
-                sum_g - left_g, sum_h)
+    @staticmethod
+    def _stack_histograms(hists):
+        """Stack histograms of different lengths into a zero padded 2-d
+        array"""
+        lengths = np.asarray([len(h) for h in hists], dtype=np.int64)
+        stacked = np.zeros((len(hists), lengths.max()), dtype=np.float64)
+        rows = np.repeat(np.arange(len(hists)), lengths)
+        cols = np.arange(lengths.sum()) - \
+            np.repeat(np.cumsum(lengths) - lengths, lengths)
+        stacked[rows, cols] = np.concatenate(hists)
+        return stacked, lengths
+
+    def _find_cont_split(self, node, fids):
+        """Evaluate every split point of the continuous features `fids` at
+        once. Returns the best gain of each feature and its split."""
+        grad, lengths = self._stack_histograms(
+            [node.grad_hists[fid] for fid in fids])
+        hess, _ = self._stack_histograms(
+            [node.hess_hists[fid] for fid in fids])
+        rows = np.arange(len(fids))
+        sum_g = grad.sum(axis=1, keepdims=True)
+        sum_h = hess.sum(axis=1, keepdims=True)
+        nan_g = grad[rows, lengths - 1][:, None]
+        nan_h = hess[rows, lengths - 1][:, None]
+        left_g = np.cumsum(grad, axis=1)
+        left_h = np.cumsum(hess, axis=1)
+
+        # candidates[:, i, 0] sends missing values left, [:, i, 1] right
+        cand_left_g = np.stack([left_g + nan_g, left_g], axis=2)
+        cand_left_h = np.stack([left_h + nan_h, left_h], axis=2)
+        cand_right_g = sum_g[:, :, None] - cand_left_g
+        cand_right_h = sum_h[:, :, None] - cand_left_h
+        gains = self._split_gain(
+            cand_left_g, cand_left_h, cand_right_g, cand_right_h)
+        valid = np.arange(grad.shape[1])[None, :] < (lengths - 2)[:, None]
+        gains[~valid] = -np.inf
+
+        gains = gains.reshape(len(fids), -1)
+        best = np.argmax(gains, axis=1)
+        best_split, best_dir = np.divmod(best, 2)
+        splits = [
+            (bool(d == 0), [int(i)],
+             cand_left_g[r, i, d], cand_left_h[r, i, d],
+             cand_right_g[r, i, d], cand_right_h[r, i, d])
+            for r, i, d in zip(rows, best_split, best_dir)]
+        return gains[rows, best], splits
+
+    def _find_cat_split(self, node, fids):
+        """Evaluate prefixes of the categories sorted by grad/hess ratio for
+        the categorical features `fids` at once."""
+        grad, lengths = self._stack_histograms(
+            [node.grad_hists[fid] for fid in fids])
+        hess, _ = self._stack_histograms(
+            [node.hess_hists[fid] for fid in fids])
+        rows = np.arange(len(fids))
+        valid = np.arange(grad.shape[1])[None, :] < lengths[:, None]
+        sum_g = grad.sum(axis=1, keepdims=True)
+        sum_h = hess.sum(axis=1, keepdims=True)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = grad/hess + self._l2_regularization
+        # padding and undefined ratios are ordered last
+        ratio[np.isnan(ratio) | ~valid] = np.inf
+        order = np.argsort(ratio, axis=1, kind='stable')
+        left_g = np.cumsum(np.take_along_axis(grad, order, axis=1), axis=1)
+        left_h = np.cumsum(np.take_along_axis(hess, order, axis=1), axis=1)
+        right_g = sum_g - left_g
+        right_h = np.broadcast_to(sum_h, left_h.shape)
+        gains = self._split_gain(left_g, left_h, right_g, right_h)
+        gains[~valid] = -np.inf
+
+        best = np.argmax(gains, axis=1)
+        splits = [
+            (True, order[r, :i+1].tolist(),
+             left_g[r, i], left_h[r, i], right_g[r, i], right_h[r, i])
+            for r, i in zip(rows, best)]
+        return gains[rows, best], splits
 
     def _add_node(self, parent_id):
         node_id = len(self._nodes)
-        node = GrowerNode(node_id)
+        node = GrowerNode(node_id, self._sample_indices)
         node.parent = parent_id
         node.num_features = self._binned.num_features
         self._nodes.append(node)
@@ -509,8 +803,9 @@ class BaseGrower(object):
         node.feature_id = split_info.feature_id
         if node.feature_id < self._binned.num_features:
             node.is_cat_feature = False
+            node.split_bin = split_info.split_point[0]
             node.threshold = self._binned.thresholds[
-                node.feature_id][split_info.split_point[0]]
+                node.feature_id][node.split_bin]
         else:
             node.is_cat_feature = True
             node.cat_threshold = split_info.split_point
@@ -520,8 +815,7 @@ class BaseGrower(object):
         right_child = self._nodes[node.right_child]
 
         is_left = node.is_left_sample(self._binned, node.sample_ids)
-        left_child.sample_ids = list(np.asarray(node.sample_ids)[is_left])
-        right_child.sample_ids = list(np.asarray(node.sample_ids)[~is_left])
+        node.partition_samples(left_child, right_child, is_left)
 
     def _split_next(self):
         _, split_info = self._split_candidates.get()
@@ -558,11 +852,11 @@ class BaseGrower(object):
             split_info.split_point, split_info.gain,
             parent.gini, parent.entropy,
             parent.IG, parent.NI,
-            left_child.weight, len(left_child.sample_ids),
-            right_child.weight, len(right_child.sample_ids),
+            left_child.weight, left_child.num_samples,
+            right_child.weight, right_child.num_samples,
             split_info.default_left and 'left' or 'right')
-        assert len(left_child.sample_ids) + len(right_child.sample_ids) \
-            == len(parent.sample_ids)
+        assert left_child.num_samples + right_child.num_samples \
+            == parent.num_samples
 
     def _log_feature_importance(self):
         logging.info("For current tree, " \
@@ -579,7 +873,7 @@ class BaseGrower(object):
         return proto
 
     def get_prediction(self):
-        prediction = np.zeros(self._binned.features.shape[0], dtype=BST_TYPE)
+        prediction = np.zeros(self._num_samples, dtype=BST_TYPE)
         for node in self._nodes:
             if node.left_child is not None:
                 continue
@@ -594,50 +888,53 @@ class BaseGrower(object):
         while self._num_leaves < self._max_leaves:
             left_child, right_child, split_info = self._split_next()
             self._log_split(left_child, right_child, split_info)
-            self._compute_histogram(left_child)
+            # both parties know the partition, so they agree on building
+            # the smaller child and subtracting it from the parent
+            if left_child.num_samples <= right_child.num_samples:
+                small_child, large_child = left_child, right_child
+            else:
+                small_child, large_child = right_child, left_child
+            self._compute_histogram(small_child)
+            self._compute_histogram_from_sibling(large_child, small_child)
+            self._release_histograms(self._nodes[split_info.node_id])
             self._find_split_and_push(left_child)
-            self._compute_histogram_from_sibling(right_child, left_child)
             self._find_split_and_push(right_child)
 
         self._normalize_feature_importance()
         self._log_feature_importance()
 
-def _decrypt_histogram_helper(args):
-    base, public_key, private_key, hists = args
-    rets = []
-    for i, hist in enumerate(hists):
-        logging.debug('Decrypting histogram for feature %d', base + i)
-        hist = _from_ciphertext(public_key, hist.ciphertext)
-        rets.append(np.asarray(_decrypt_number(private_key, hist)))
-    return rets
-
-
-def _decrypt_packed_histogram_helper(args):
-    base, packer, private_key, hists = args
-    grad_hists = []
-    hess_hists = []
-    for i, hist in enumerate(hists):
-        logging.debug('Decrypting packed histogram for feature %d', base + i)
-        hist = [int.from_bytes(i, 'little') for i in hist.ciphertext]
-        grad_hist, hess_hist = \
-            packer.decrypt_and_unpack_grad_hess(hist, private_key)
-        grad_hists.append(np.asarray(grad_hist))
-        hess_hists.append(np.asarray(hess_hist))
-    return grad_hists, hess_hists
+def _batch_decrypt_helper(args):
+    private_key, ciphertext, raw = args
+    logging.debug('Decrypting %d ciphertexts', len(ciphertext))
+    if raw:
+        return private_key.batch_raw_decrypt(ciphertext)
+    return private_key.batch_decrypt(ciphertext, EXPONENT)
+
+
+def _pack_ciphertexts_helper(args):
+    packer, ciphertext, num_samples = args
+    return packer.pack_ciphertexts(ciphertext, num_samples)
+
+
+def _split_histograms(values, lengths):
+    if not lengths:
+        return []
+    return np.split(values, np.cumsum(lengths)[:-1])
 
 
 class LeaderGrower(BaseGrower):
     def __init__(self, bridge, public_key, private_key,
                  binned, labels, grad, hess, enable_packing=False,
-                 **kwargs):
+                 packer=None, **kwargs):
         super(LeaderGrower, self).__init__(
             binned, labels, grad, hess, dtype=np.float32, **kwargs)
         self._bridge = bridge
         self._public_key = public_key
         self._private_key = private_key
         self._enable_packing = enable_packing
-        if self._enable_packing:
-            self._packer = GradHessPacker(self._public_key, PRECISION, EXPONENT)
+        self._packer = packer
+        assert not enable_packing or packer is not None, \
+            "packer must be set when packing is enabled"
 
         bridge.start()
         follower_num_features, follower_num_cat_features = \
@@ -650,49 +947,50 @@ class LeaderGrower(BaseGrower):
     def _initialize_feature_importance(self):
         self._feature_importance = np.zeros(len(self._nodes[0].grad_hists))
 
-    def _receive_and_decrypt_histogram(self, name):
-        msg = tree_pb2.Histograms()
-        self._bridge.receive_proto(name).Unpack(msg)
+    def _batch_decrypt(self, ciphertext, raw=False):
+        """Decrypt a flat list of ciphertexts, spreading it evenly over
+        the process pool. Returns raw plaintext ints if raw is set, else
+        decoded floats."""
         if not self._pool:
-            return _decrypt_histogram_helper(
-                (0, self._public_key, self._private_key, msg.hists))
+            return _batch_decrypt_helper(
+                (self._private_key, ciphertext, raw))
 
-        job_size = (len(msg.hists) + self._num_parallel - 1)//self._num_parallel
+        job_size = (len(ciphertext) + self._num_parallel - 1) // \
+            self._num_parallel
         args = [
-            (i*job_size,
-             self._public_key, self._private_key,
-             msg.hists[i*job_size:(i+1)*job_size])
+            (self._private_key,
+             ciphertext[i*job_size:(i+1)*job_size], raw)
             for i in range(self._num_parallel)
         ]
-        hists = self._pool.map(_decrypt_histogram_helper, args)
-        return sum(hists, [])
+        rets = list(self._pool.map(_batch_decrypt_helper, args))
+        if raw:
+            return sum(rets, [])
+        return np.concatenate(rets)
 
-    def _receive_and_decrypt_packed_histogram(self, name):
+    def _receive_and_decrypt_histogram(self, name):
         msg = tree_pb2.Histograms()
         self._bridge.receive_proto(name).Unpack(msg)
-        if not self._pool:
-            return _decrypt_packed_histogram_helper(
-                (0, self._packer, self._private_key, msg.hists))
-
-        job_size = (len(msg.hists) + self._num_parallel -
-                    1) // self._num_parallel
-        args = [(i * job_size, self._packer, self._private_key,
-                 msg.hists[i * job_size:(i + 1) * job_size])
-                for i in range(self._num_parallel)]
-        hists = self._pool.map(_decrypt_packed_histogram_helper, args)
-        grad_hists = []
-        hess_hists = []
-        for hist in hists:
-            grad_hists.append(hist[0])
-            hess_hists.append(hist[1])
-        return sum(grad_hists, []), sum(hess_hists, [])
+        lengths = [len(hist.ciphertext) for hist in msg.hists]
+        ciphertext = [c for hist in msg.hists for c in hist.ciphertext]
+        return _split_histograms(self._batch_decrypt(ciphertext), lengths)
+
+    def _receive_and_decrypt_packed_histogram(self, name, num_samples):
+        msg = tree_pb2.Histograms()
+        self._bridge.receive_proto(name).Unpack(msg)
+        # bins of all features are packed back to back
+        lengths = list(msg.num_bins)
+        ciphertext = [c for hist in msg.hists for c in hist.ciphertext]
+        plaintext = self._batch_decrypt(ciphertext, raw=True)
+        grad, hess = self._packer.unpack_histograms(
+            plaintext, sum(lengths), num_samples)
+        return _split_histograms(grad, lengths), \
+            _split_histograms(hess, lengths)
 
     def _compute_histogram(self, node):
         self._bridge.start()
-        grad_hists = self._hist_builder.compute_histogram(
-            self._grad, node.sample_ids)
-        hess_hists = self._hist_builder.compute_histogram(
-            self._hess, node.sample_ids)
+        grad_hists, hess_hists = \
+            self._hist_builder.compute_grad_hess_histograms(
+                self._grad, self._hess, node.sample_ids)
         if not self._enable_packing:
             follower_grad_hists = self._receive_and_decrypt_histogram(
                 'grad_hists')
@@ -700,7 +998,8 @@ class LeaderGrower(BaseGrower):
                 'hess_hists')
         else:
             follower_grad_hists, follower_hess_hists = \
-                self._receive_and_decrypt_packed_histogram('gradhess_hists')
+                self._receive_and_decrypt_packed_histogram(
+                    'gradhess_hists', len(node.sample_ids))
 
         node.grad_hists = grad_hists + follower_grad_hists
         node.hess_hists = hess_hists + follower_hess_hists
@@ -731,8 +1030,8 @@ class LeaderGrower(BaseGrower):
                 'split_info',
                 tree_pb2.SplitInfo(
                     node_id=split_info.node_id, feature_id=-1,
-                    left_samples=left_child.sample_ids,
-                    right_samples=right_child.sample_ids))
+                    left_samples=left_child.sample_ids.tolist(),
+                    right_samples=right_child.sample_ids.tolist()))
         else:
             node.is_owner = False
             fid = split_info.feature_id - self._binned.num_all_features
@@ -746,8 +1045,10 @@ class LeaderGrower(BaseGrower):
             follower_split_info = tree_pb2.SplitInfo()
             self._bridge.receive_proto('follower_split_info') \
                 .Unpack(follower_split_info)
-            left_child.sample_ids = list(follower_split_info.left_samples)
-            right_child.sample_ids = list(follower_split_info.right_samples)
+            node.set_children_samples(
+                left_child, right_child,
+                follower_split_info.left_samples,
+                follower_split_info.right_samples)
 
             self._compute_IG_NI(node, \
                 left_child, right_child)
@@ -762,13 +1063,16 @@ class LeaderGrower(BaseGrower):
 class FollowerGrower(BaseGrower):
     def __init__(self, bridge, public_key, binned, labels,
                 grad, hess, gradhess=None, enable_packing=False,
-                 **kwargs):
+                 packer=None, **kwargs):
         dtype = lambda x: public_key.encrypt(x, PRECISION)
         super(FollowerGrower, self).__init__(
             binned, labels, grad, hess, dtype=dtype, **kwargs)
         self._bridge = bridge
         self._public_key = public_key
         self._enable_packing = enable_packing
+        self._packer = packer
+        assert not enable_packing or packer is not None, \
+            "packer must be set when packing is enabled"
         self._gradhess = gradhess
         bridge.start()
         bridge.send('feature_dim',
@@ -776,6 +1080,8 @@ class FollowerGrower(BaseGrower):
         bridge.commit()
 
     def _compute_histogram_from_sibling(self, node, sibling):
+        # the leader derives the sibling from the decrypted histograms of
+        # the parent, no encrypted histogram is kept on the follower side
         pass
 
     def _normalize_feature_importance(self):
@@ -792,6 +1098,28 @@ class FollowerGrower(BaseGrower):
                 tree_pb2.EncryptedNumbers(ciphertext=ciphertext))
         self._bridge.send_proto(name, msg)
 
+    def _send_packed_histograms(self, name, hists, num_samples):
+        ciphertext = [i.ciphertext(False) for hist in hists for i in hist]
+        if not self._pool:
+            packed = self._packer.pack_ciphertexts(ciphertext, num_samples)
+        else:
+            # jobs must be aligned to groups of packed bins
+            group_size = self._packer.bins_per_ciphertext(num_samples)
+            num_groups = (len(ciphertext) + group_size - 1) // group_size
+            job_size = (num_groups + self._num_parallel - 1) // \
+                self._num_parallel * group_size
+            args = [
+                (self._packer, ciphertext[i*job_size:(i+1)*job_size],
+                 num_samples)
+                for i in range(self._num_parallel)
+            ]
+            packed = sum(self._pool.map(_pack_ciphertexts_helper, args), [])
+
+        msg = tree_pb2.Histograms(num_bins=[len(hist) for hist in hists])
+        msg.hists.append(tree_pb2.EncryptedNumbers(ciphertext=[
+            i.to_bytes(CIPHER_NBYTES, 'little') for i in packed]))
+        self._bridge.send_proto(name, msg)
+
     def _compute_histogram(self, node):
         self._bridge.start()
         if not self._enable_packing:
@@ -804,7 +1132,8 @@ class FollowerGrower(BaseGrower):
         else:
             gradhess_hists = self._hist_builder.compute_histogram(
                 self._gradhess, node.sample_ids)
-            self._send_histograms('gradhess_hists', gradhess_hists)
+            self._send_packed_histograms('gradhess_hists', gradhess_hists,
+                                         len(node.sample_ids))
         self._bridge.commit()
 
     def _split_next(self):
@@ -830,12 +1159,13 @@ class FollowerGrower(BaseGrower):
             self._bridge.send_proto(
                 'follower_split_info',
                 tree_pb2.SplitInfo(
-                    left_samples=left_child.sample_ids,
-                    right_samples=right_child.sample_ids))
+                    left_samples=left_child.sample_ids.tolist(),
+                    right_samples=right_child.sample_ids.tolist()))
         else:
             node.is_owner = False
-            left_child.sample_ids = list(split_info.left_samples)
-            right_child.sample_ids = list(split_info.right_samples)
+            node.set_children_samples(
+                left_child, right_child,
+                split_info.left_samples, split_info.right_samples)
 
         node.gini = float('nan')
         node.entropy = float('nan')
@@ -845,61 +1175,14 @@ class FollowerGrower(BaseGrower):
         self._bridge.commit()
         return left_child, right_child, split_info
 
-def _vectorize_tree(tree):
-    vec = {}
-    vec['is_owner'] = np.asarray([n.is_owner for n in tree.nodes])
-    vec['feature_id'] = np.asarray([n.feature_id for n in tree.nodes])
-    vec['is_cat_feature'] = np.asarray([n.is_cat_feature for n in tree.nodes])
-    vec['threshold'] = np.asarray([n.threshold for n in tree.nodes])
-    vec['cat_threshold'] = [np.asarray(n.cat_threshold) for n in tree.nodes]
-    vec['default_left'] = np.asarray(
-        [n.default_left for n in tree.nodes], dtype=np.bool)
-    vec['is_leaf'] = np.asarray([n.left_child == 0 for n in tree.nodes])
-    vec['weight'] = np.asarray([n.weight for n in tree.nodes])
-    vec['children'] = np.asarray([
-        [n.left_child for n in tree.nodes],
-        [n.right_child for n in tree.nodes]])
-    return vec
-
-def _vectorized_direction(vec, features, cat_features, assignment):
-    fid = vec['feature_id'][assignment]
-    is_cont = fid < features.shape[1]
-
-    cont_fid = np.where(is_cont, fid, 0)
-    cont_X = features[np.arange(features.shape[0]), cont_fid]
-    is_nan = np.isnan(cont_X)
-    less = cont_X < vec['threshold'][assignment]
-    d = ~np.where(is_nan, vec['default_left'][assignment], less)
-
-    if is_cont.sum() < is_cont.size:
-        cond_list = []
-        choice_list = []
-        is_cat = ~is_cont
-        cat_assignment = assignment[is_cat]
-        cat_fid = fid[is_cat] - features.shape[1]
-        cat_X = cat_features[is_cat, cat_fid]
-        for i, cat_threshold in enumerate(vec['cat_threshold']):
-            if vec['is_leaf'][i]:
-                continue
-            cond_list.append(cat_assignment == i)
-            choice_list.append(~np.in1d(cat_X, cat_threshold))
-        d[is_cat] = np.select(cond_list, choice_list)
-
-    return d
-
-def _vectorized_assignment(vec, assignment, direction, peer_direction=None):
-    if peer_direction is not None:
-        is_owner = vec['is_owner'][assignment]
-        direction = np.where(is_owner, direction, peer_direction)
-    new_assignment = vec['children'][direction.astype(np.int32), assignment]
-    return np.where(vec['is_leaf'][assignment], assignment, new_assignment)
-
 class BoostingTreeEnsamble(object):
     def __init__(self, bridge, learning_rate=0.3, max_iters=50, max_depth=6,
                  max_leaves=0, l2_regularization=1.0, max_bins=33,
                  grow_policy='depthwise', num_parallel=1,
                  loss_type='logistic', send_scores_to_follower=False,
-                 send_metrics_to_follower=False, enable_packing=False):
+                 send_metrics_to_follower=False, enable_packing=False,
+                 packing_precision=PACKING_PRECISION,
+                 obfuscator_pool_size=0):
         self._learning_rate = learning_rate
         self._max_iters = max_iters
         self._max_depth = max_depth
@@ -936,8 +1219,13 @@ class BoostingTreeEnsamble(object):
             self._role = 'local'
 
         self._enable_packing = enable_packing
-        if self._role == 'leader' and self._enable_packing:
-            self._packer = GradHessPacker(self._public_key, PRECISION, EXPONENT)
+        self._packing_precision = packing_precision
+
+        # obfuscators r^n mod n^2 are precomputed in background processes
+        # while the leader fits, so that encrypting grad and hess does not
+        # wait on powmod
+        self._obfuscator_pool_size = obfuscator_pool_size
+        self._obfuscator_pool = None
 
     @property
     def loss(self):
@@ -1163,22 +1451,37 @@ class BoostingTreeEnsamble(object):
             features, cat_features, get_raw_score)
 
 
-    def _batch_predict_local(self, features, cat_features, get_raw_score):
-        N = features.shape[0]
-
-        raw_prediction = np.zeros(N, dtype=BST_TYPE)
-        for idx, tree in enumerate(self._trees):
-            logging.debug("Running prediction for tree %d", idx)
-
-            vec_tree = _vectorize_tree(tree)
-            assignment = np.zeros(N, dtype=np.int32)
-            while vec_tree['is_leaf'][assignment].sum() < N:
-                direction = _vectorized_direction(
-                    vec_tree, features, cat_features, assignment)
-                assignment = _vectorized_assignment(
-                    vec_tree, assignment, direction)
+    def iter_predict(self, chunks, get_raw_score=False,
+                     feature_names=None, cat_feature_names=None):
+        """Predict an iterable of (features, cat_features) chunks, e.g.
+        streamed from input files, compiling the ensemble only once.
+        Only supported by local models."""
+        assert self._bridge is None, \
+            "Streaming prediction is only supported in local mode"
+        if feature_names and self._feature_names:
+            assert feature_names == self._feature_names, \
+                "Predict data's feature names does not match loaded model"
+        if cat_feature_names and self._cat_feature_names:
+            assert cat_feature_names == self._cat_feature_names, \
+                "Predict data's feature names does not match loaded model"
+        ensemble = CompiledEnsemble(self._trees)
+        for features, cat_features in chunks:
+            if cat_features is None:
+                cat_features = np.zeros(
+                    (features.shape[0], 0), dtype=np.int32)
+            assignment = ensemble.batch_assign(
+                features, cat_features, pool=self._pool)
+            raw_prediction = ensemble.raw_predict(assignment, dtype=BST_TYPE)
+            if get_raw_score:
+                yield raw_prediction
+            else:
+                yield self._loss.predict(raw_prediction)
 
-            raw_prediction += vec_tree['weight'][assignment]
+    def _batch_predict_local(self, features, cat_features, get_raw_score):
+        ensemble = CompiledEnsemble(self._trees)
+        assignment = ensemble.batch_assign(
+            features, cat_features, pool=self._pool)
+        raw_prediction = ensemble.raw_predict(assignment, dtype=BST_TYPE)
 
         if get_raw_score:
             return raw_prediction
@@ -1186,24 +1489,17 @@ class BoostingTreeEnsamble(object):
 
     def _batch_predict_one_side_follower(self, features, cat_features,
                                          get_raw_score):
-        N = features.shape[0]
+        ensemble = CompiledEnsemble(self._trees)
+        assignment = ensemble.batch_assign(
+            features, cat_features, pool=self._pool)
 
         for idx, tree in enumerate(self._trees):
-            logging.debug("Running prediction for tree %d", idx)
-
-            vec_tree = _vectorize_tree(tree)
-            assignment = np.zeros(
-                N, dtype=_get_dtype_for_max_value(len(tree.nodes)))
-            while vec_tree['is_leaf'][assignment].sum() < N:
-                direction = _vectorized_direction(
-                    vec_tree, features, cat_features, assignment)
-                assignment = _vectorized_assignment(
-                    vec_tree, assignment, direction)
-
+            logging.debug("Sending assignment of tree %d", idx)
             self._bridge.start()
             self._bridge.send(
                 'follower_assignment_%d'%idx,
-                assignment)
+                ensemble.local_assignment(assignment, idx).astype(
+                    _get_dtype_for_max_value(len(tree.nodes))))
             self._bridge.commit()
 
         self._bridge.start()
@@ -1215,20 +1511,20 @@ class BoostingTreeEnsamble(object):
         return self._loss.predict(raw_prediction)
 
     def _batch_predict_one_side_leader(self, get_raw_score):
+        ensemble = CompiledEnsemble(self._trees)
+        assert not ensemble.is_owner.any(), \
+            "Model cannot predict with no data"
         raw_prediction = None
-        for idx, tree in enumerate(self._trees):
+        for idx in range(ensemble.num_trees):
             logging.debug("Running prediction for tree %d", idx)
-            vec_tree = _vectorize_tree(tree)
-            assert not vec_tree['is_owner'].sum(), \
-                "Model cannot predict with no data"
-
             self._bridge.start()
             assignment = self._bridge.receive('follower_assignment_%d'%idx)
             self._bridge.commit()
 
             if raw_prediction is None:
                 raw_prediction = np.zeros(assignment.shape[0], dtype=BST_TYPE)
-            raw_prediction += vec_tree['weight'][assignment]
+            raw_prediction += ensemble.weight[
+                ensemble.offsets[idx] + assignment]
 
         self._bridge.start()
         self._bridge.send(
@@ -1244,14 +1540,15 @@ class BoostingTreeEnsamble(object):
     def _batch_predict_two_side(self, features, cat_features, get_raw_score):
         N = features.shape[0]
         peer_role = 'leader' if self._role == 'follower' else 'follower'
+        ensemble = CompiledEnsemble(self._trees)
+        rows = np.arange(N)
         raw_prediction = np.zeros(N, dtype=BST_TYPE)
-        for idx, tree in enumerate(self._trees):
+        for idx in range(ensemble.num_trees):
             logging.debug("Running prediction for tree %d", idx)
-            vec_tree = _vectorize_tree(tree)
-            assignment = np.zeros(N, dtype=np.int32)
-            while vec_tree['is_leaf'][assignment].sum() < N:
-                direction = _vectorized_direction(
-                    vec_tree, features, cat_features, assignment)
+            assignment = np.full(N, ensemble.offsets[idx], dtype=np.int64)
+            while ensemble.is_leaf[assignment].sum() < N:
+                direction = ensemble.direction(
+                    features, cat_features, rows, assignment)
 
                 self._bridge.start()
                 self._bridge.send(
@@ -1261,10 +1558,11 @@ class BoostingTreeEnsamble(object):
                     '%s_direction_%d'%(peer_role, idx))
                 self._bridge.commit()
 
-                assignment = _vectorized_assignment(
-                    vec_tree, assignment, direction, peer_direction)
+                direction = np.where(
+                    ensemble.is_owner[assignment], direction, peer_direction)
+                assignment = ensemble.advance(assignment, direction)
 
-            raw_prediction += vec_tree['weight'][assignment]
+            raw_prediction += ensemble.weight[assignment]
 
         self._bridge.start()
         if self._role == 'leader':
@@ -1303,26 +1601,43 @@ class BoostingTreeEnsamble(object):
             }
             metric_collector.emit_store(metrics_name, value, metrics_label)
 
-    def fit(self,
-            features,
-            labels=None,
-            cat_features=None,
-            example_ids=None,
-            validation_features=None,
-            validation_labels=None,
-            validation_cat_features=None,
-            validation_example_ids=None,
-            feature_names=None,
-            cat_feature_names=None,
-            checkpoint_path=None,
-            output_path=None):
-        num_examples = features.shape[0]
+    def fit(self, *args, **kwargs):
+        """Fit the ensemble, see _fit for the arguments. The obfuscator
+        pool of the leader lives only during the fit, so its worker
+        processes are shut down when the fit ends"""
+        if self._role == 'leader' and self._obfuscator_pool_size > 0:
+            self._obfuscator_pool = paillier.PaillierObfuscatorPool(
+                self._public_key, self._obfuscator_pool_size,
+                num_workers=self._num_parallel)
+        try:
+            return self._fit(*args, **kwargs)
+        finally:
+            if self._obfuscator_pool is not None:
+                self._obfuscator_pool.close()
+                self._obfuscator_pool = None
+
+    def _fit(self,
+             features,
+             labels=None,
+             cat_features=None,
+             example_ids=None,
+             validation_features=None,
+             validation_labels=None,
+             validation_cat_features=None,
+             validation_example_ids=None,
+             feature_names=None,
+             cat_feature_names=None,
+             checkpoint_path=None,
+             output_path=None,
+             binned=None):
+        # sort feature columns, unless binned features are given, e.g.
+        # loaded from cache
+        if binned is None:
+            binned = BinnedFeatures(
+                features, self._max_bins, cat_features=cat_features)
+        num_examples = binned.num_samples
         assert example_ids is None or num_examples == len(example_ids)
 
-        # sort feature columns
-        binned = BinnedFeatures(
-            features, self._max_bins, cat_features=cat_features)
-
         # load checkpoint if exists
         if checkpoint_path:
             tf.io.gfile.makedirs(checkpoint_path)
@@ -1343,7 +1658,12 @@ class BoostingTreeEnsamble(object):
             if cat_feature_names and self._cat_feature_names:
                 assert cat_feature_names == self._cat_feature_names, \
                     "Training data's feature does not match loaded model"
-            sum_prediction = self.batch_predict(features, get_raw_score=True)
+            if features is None:
+                features = binned.features if binned.features is not None \
+                    else binned.dequantize()
+            sum_prediction = self.batch_predict(
+                features, cat_features=binned.cat_features,
+                get_raw_score=True)
         else:
             self._feature_names = feature_names
             self._cat_feature_names = cat_feature_names
@@ -1451,22 +1771,31 @@ class BoostingTreeEnsamble(object):
             len(self._trees), self._compute_metrics(pred, labels))
 
         self._bridge.start()
+        packer = None
         if not self._enable_packing:
             _encrypt_and_send_numbers(self._bridge, 'grad', self._public_key,
-                                      grad)
+                                      grad, self._obfuscator_pool)
             _encrypt_and_send_numbers(self._bridge, 'hess', self._public_key,
-                                      hess)
+                                      hess, self._obfuscator_pool)
         else:
-            gradhess_plaintest = self._packer.pack_grad_hess(grad, hess)
+            # slot widths depend on the number and range of values
+            # summed into a histogram bin
+            packer = HistogramPacker.create(
+                self._public_key, self._packing_precision, len(grad),
+                max(np.abs(grad).max(), np.abs(hess).max()))
+            self._bridge.send(
+                'gradhess_packing', [packer.value_bits, packer.slot_bits])
+            gradhess_plaintest = packer.pack_grad_hess(grad, hess)
             _raw_encrypt_and_send_numbers(self._bridge, 'gradhess',
                                           self._public_key, gradhess_plaintest,
-                                          self._pool)
+                                          self._pool, self._obfuscator_pool)
         self._bridge.commit()
 
         grower = LeaderGrower(
             self._bridge, self._public_key, self._private_key,
             binned, labels, grad, hess,
             enable_packing=self._enable_packing,
+            packer=packer,
             learning_rate=self._learning_rate,
             max_depth=self._max_depth,
             max_leaves=self._max_leaves,
@@ -1489,18 +1818,21 @@ class BoostingTreeEnsamble(object):
             grad = np.asarray(
                 _receive_encrypted_numbers(self._bridge, 'grad',
                                            self._public_key))
-            assert len(grad) == binned.features.shape[0]
+            assert len(grad) == binned.num_samples
             hess = np.asarray(
                 _receive_encrypted_numbers(self._bridge, 'hess',
                                            self._public_key))
-            assert len(hess) == binned.features.shape[0]
+            assert len(hess) == binned.num_samples
             gradhess = None
+            packer = None
         else:
             grad = None
             hess = None
             gradhess = np.asarray(
                 _receive_encrypted_numbers(self._bridge, 'gradhess',
                                            self._public_key))
+            value_bits, slot_bits = self._bridge.receive('gradhess_packing')
+            packer = HistogramPacker(self._public_key, value_bits, slot_bits)
         self._bridge.commit()
         logging.info(
             'Follower starting iteration %d.',
@@ -1511,6 +1843,7 @@ class BoostingTreeEnsamble(object):
             self._bridge, self._public_key,
             binned, None, grad, hess, gradhess,
             enable_packing=self._enable_packing,
+            packer=packer,
             learning_rate=self._learning_rate,
             max_depth=self._max_depth,
             max_leaves=self._max_leaves,
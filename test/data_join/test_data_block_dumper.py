@@ -231,6 +231,44 @@ class TestDataBlockDumper(unittest.TestCase):
                                  meta.example_ids[iidx])
             self.assertEqual(len(meta.example_ids), iidx +1)
 
+    def test_data_block_dumper_by_rounds(self):
+        self.generate_follower_data_block()
+        self.generate_leader_raw_data()
+        dbd = data_block_dumper.DataBlockDumperManager(
+                self.kvstore, self.data_source_l, 0,
+                dj_pb.RawDataOptions(raw_data_iter='TF_RECORD', read_ahead_size=1<<20, read_batch_size=128),
+                dj_pb.WriterOptions(output_writer='TF_RECORD')
+            )
+        dbm_l = data_block_manager.DataBlockManager(self.data_source_l, 0)
+        # the metas added in one round are dumped in one pass of raw data
+        for metas in [self.dumped_metas[:1], self.dumped_metas[1:4],
+                      self.dumped_metas[4:]]:
+            for meta in metas:
+                success, _ = dbd.add_synced_data_block_meta(meta)
+                self.assertTrue(success)
+            with dbd.make_data_block_dumper() as dumper:
+                dumper()
+            self.assertFalse(dbd.need_dump())
+            self.assertEqual(dbm_l.get_dumped_data_block_count(),
+                             metas[-1].data_block_index + 1)
+        for (idx, meta) in enumerate(self.dumped_metas):
+            self.assertEqual(dbm_l.get_data_block_meta_by_index(idx), meta)
+            data_fpth_l = os.path.join(
+                    common.data_source_data_block_dir(self.data_source_l),
+                    common.partition_repr(0),
+                    common.encode_data_block_fname(
+                        self.data_source_l.data_source_meta.name, meta
+                    )
+                )
+            example_ids = []
+            for record in tf.io.tf_record_iterator(data_fpth_l):
+                example = tf.train.Example()
+                example.ParseFromString(record)
+                example_ids.append(
+                        example.features.feature['example_id'].bytes_list.value[0]
+                    )
+            self.assertEqual(example_ids, list(meta.example_ids))
+
     def tearDown(self):
         if gfile.Exists(self.data_source_f.output_base_dir):
             gfile.DeleteRecursively(self.data_source_f.output_base_dir)
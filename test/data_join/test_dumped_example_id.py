@@ -160,6 +160,54 @@ class TestDumpedExampleId(unittest.TestCase):
             expected_index += 1
         self.assertEqual(10240 * 2, expected_index)
 
+    def _check_example_id_blocks(self, visitor, expected_index, end_index,
+                                 max_count):
+        while True:
+            try:
+                block = visitor.next_block(max_count)
+            except StopIteration:
+                break
+            self.assertTrue(0 < len(block) <= max_count)
+            self.assertEqual(block.begin_index, expected_index)
+            self.assertEqual(list(block.indices),
+                             list(range(expected_index,
+                                        expected_index + len(block))))
+            self.assertEqual(block.example_ids,
+                             ['{}'.format(i).encode() for i in block.indices])
+            self.assertEqual(list(block.event_times),
+                             [150000000+i for i in block.indices])
+            item = block.item(len(block) - 1)
+            self.assertEqual(item.index, block.indices[-1])
+            self.assertEqual(item.event_time, 150000000+item.index)
+            self.assertEqual(item.record['example_id'], item.example_id)
+            expected_index += len(block)
+            self.assertEqual(visitor.get_index(), expected_index - 1)
+            self.assertEqual(visitor.get_item().index, expected_index - 1)
+        self.assertEqual(expected_index, end_index)
+        self.assertTrue(visitor.finished())
+
+    def test_dumped_example_id_block(self):
+        dumper = example_id_dumper.ExampleIdDumperManager(
+                self.kvstore, self.data_source, 0, self.example_id_dump_options
+            )
+        self._dump_example_ids(dumper, 0, 10, 1024)
+        visitor = example_id_visitor.ExampleIdVisitor(self.kvstore, self.data_source, 0)
+        visitor.active_visitor()
+        self._check_example_id_blocks(visitor, 0, 10240, 300)
+        dumper2 = example_id_dumper.ExampleIdDumperManager(
+                self.kvstore, self.data_source, 0, self.example_id_dump_options
+            )
+        self._dump_example_ids(dumper2, 10240, 10, 1024)
+        self.assertTrue(visitor.is_visitor_stale())
+        visitor.active_visitor()
+        self._check_example_id_blocks(visitor, 10240, 10240 * 2, 1000)
+        visitor2 = example_id_visitor.ExampleIdVisitor(self.kvstore, self.data_source, 0)
+        visitor2.seek(886)
+        index, item = next(visitor2)
+        self.assertEqual(index, 887)
+        self.assertEqual(item.index, 887)
+        self._check_example_id_blocks(visitor2, 888, 10240 * 2, 4096)
+
     def tearDown(self):
         if gfile.Exists(self.data_source.output_base_dir):
             gfile.DeleteRecursively(self.data_source.output_base_dir)
@@ -0,0 +1,68 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fedlearner.data_join.example_id_filter import (
+    ExampleIdBloomFilter, example_id_filter_fpath
+)
+
+class TestExampleIdBloomFilter(unittest.TestCase):
+    def setUp(self):
+        self._example_ids = ['{}'.format(i).encode() for i in range(20000)]
+        self._filter = ExampleIdBloomFilter.create(len(self._example_ids),
+                                                   0.01)
+        for i in range(0, len(self._example_ids), 4096):
+            self._filter.add_batch(self._example_ids[i:i+4096])
+        self._filter.set_end_index(len(self._example_ids) - 1)
+        self._tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def test_no_false_negative(self):
+        for example_id in self._example_ids:
+            self.assertTrue(example_id in self._filter)
+        self.assertTrue(self._example_ids[0].decode() in self._filter)
+        self.assertEqual(self._filter.count, len(self._example_ids))
+
+    def test_false_positive_rate(self):
+        probes = ['x{}'.format(i).encode() for i in range(20000)]
+        false_positive = sum(1 for p in probes if p in self._filter)
+        self.assertLess(false_positive / len(probes), 0.02)
+        self.assertAlmostEqual(self._filter.false_positive_rate(), 0.01,
+                               delta=0.005)
+
+    def test_dump_and_load(self):
+        fpath = example_id_filter_fpath(self._tmp_dir)
+        self.assertIsNone(ExampleIdBloomFilter.load(fpath))
+        self._filter.dump(fpath)
+        self.assertEqual(os.listdir(self._tmp_dir), [os.path.basename(fpath)])
+        loaded = ExampleIdBloomFilter.load(fpath)
+        self.assertEqual(loaded.num_bits, self._filter.num_bits)
+        self.assertEqual(loaded.hash_num, self._filter.hash_num)
+        self.assertEqual(loaded.count, self._filter.count)
+        self.assertEqual(loaded.end_index, len(self._example_ids) - 1)
+        for i in range(0, 40000, 7):
+            example_id = '{}'.format(i).encode()
+            self.assertEqual(example_id in loaded,
+                             example_id in self._filter)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import os
+import unittest
+
+import tensorflow.compat.v1 as tf
+tf.enable_eager_execution()
+import tensorflow_io
+from tensorflow.compat.v1 import gfile
+
+from fedlearner.common import data_join_service_pb2 as dj_pb
+from fedlearner.data_join import common
+from fedlearner.data_join.raw_data_partitioner import RawDataPartitioner
+
+class TestRawDataPartitioner(unittest.TestCase):
+    def setUp(self):
+        self._base_dir = './raw_data_partitioner_test'
+        if gfile.Exists(self._base_dir):
+            gfile.DeleteRecursively(self._base_dir)
+        self._input_dir = os.path.join(self._base_dir, 'input')
+        gfile.MakeDirs(self._input_dir)
+        self._partition_num = 4
+        self._input_fpaths = []
+        for file_index in range(12):
+            fpath = os.path.join(self._input_dir, '{:04}{}'.format(
+                file_index, common.RawDataFileSuffix))
+            with tf.io.TFRecordWriter(fpath) as writer:
+                for index in range(file_index * 300, (file_index + 1) * 300):
+                    writer.write(self._make_example(index))
+            self._input_fpaths.append(fpath)
+
+    def tearDown(self):
+        if gfile.Exists(self._base_dir):
+            gfile.DeleteRecursively(self._base_dir)
+
+    @staticmethod
+    def _make_example(index):
+        raw_id = '{:08}'.format(index).encode()
+        feat = {
+            'raw_id': tf.train.Feature(
+                bytes_list=tf.train.BytesList(value=[raw_id])),
+            'feat_0': tf.train.Feature(
+                bytes_list=tf.train.BytesList(value=[b'feat-' + raw_id]))
+        }
+        example = tf.train.Example(features=tf.train.Features(feature=feat))
+        return example.SerializeToString()
+
+    def _make_options(self, output_dir, process_num):
+        return dj_pb.RawDataPartitionerOptions(
+                partitioner_name='test_partitioner',
+                input_file_paths=self._input_fpaths,
+                output_dir=output_dir,
+                output_partition_num=self._partition_num,
+                raw_data_options=dj_pb.RawDataOptions(
+                    raw_data_iter='TF_RECORD',
+                    read_ahead_size=1<<20,
+                    read_batch_size=128
+                ),
+                writer_options=dj_pb.WriterOptions(
+                    output_writer='TF_RECORD'
+                ),
+                partitioner_rank_id=0,
+                batch_processor_options=dj_pb.BatchProcessorOptions(
+                    batch_size=256,
+                    max_flying_item=-1
+                ),
+                memory_limit_ratio=0.7,
+                partitioner_process_num=process_num
+            )
+
+    def _partition(self, output_dir, process_num):
+        partitioner = RawDataPartitioner(
+                self._make_options(output_dir, process_num),
+                'raw_id', 'etcd', True
+            )
+        partitioner.start_process()
+        partitioner.wait_for_finished()
+
+    def _list_metas(self, output_dir, partition_id):
+        partition_dir = os.path.join(output_dir,
+                                     common.partition_repr(partition_id))
+        metas = [RawDataPartitioner.FileMeta.decode_meta_from_fname(f)
+                 for f in gfile.ListDirectory(partition_dir)
+                 if f.endswith(common.RawDataFileSuffix)]
+        return sorted(metas)
+
+    def _read_partition(self, output_dir, partition_id):
+        records = []
+        for meta in self._list_metas(output_dir, partition_id):
+            fpath = os.path.join(output_dir,
+                                 common.partition_repr(partition_id),
+                                 meta.encode_meta_to_fname())
+            file_records = [record.numpy() for record in
+                            tf.data.TFRecordDataset([fpath])]
+            self.assertGreater(len(file_records), 0)
+            records.append((meta.begin_index, meta.end_index, file_records))
+        return records
+
+    def _check_same_output(self, serial_dir, parallel_dir):
+        total_record_num = 0
+        for partition_id in range(self._partition_num):
+            serial = self._read_partition(serial_dir, partition_id)
+            parallel = self._read_partition(parallel_dir, partition_id)
+            self.assertEqual(
+                    [record for _, _, records in serial
+                     for record in records],
+                    [record for _, _, records in parallel
+                     for record in records]
+                )
+            self.assertEqual(serial[0][0], parallel[0][0])
+            self.assertEqual(serial[-1][1], parallel[-1][1])
+            for (_, end_index, _), (begin_index, _, _) in \
+                    zip(parallel[:-1], parallel[1:]):
+                self.assertLess(end_index, begin_index)
+            total_record_num += sum(len(records)
+                                    for _, _, records in parallel)
+        self.assertEqual(total_record_num, 12 * 300)
+
+    def test_parallel_partition(self):
+        serial_dir = os.path.join(self._base_dir, 'serial')
+        parallel_dir = os.path.join(self._base_dir, 'parallel')
+        self._partition(serial_dir, 1)
+        self._partition(parallel_dir, 2)
+        self.assertGreater(len(self._list_metas(parallel_dir, 0)), 1)
+        self._check_same_output(serial_dir, parallel_dir)
+
+    def test_parallel_partition_resume(self):
+        serial_dir = os.path.join(self._base_dir, 'serial')
+        parallel_dir = os.path.join(self._base_dir, 'parallel')
+        self._partition(serial_dir, 1)
+        self._partition(parallel_dir, 2)
+        # stop after task 3 and partway through committing task 4, which
+        # only left its file for partition 0
+        gfile.Remove(os.path.join(parallel_dir, '_SUCCESS.00000000'))
+        task_end_index = None
+        for partition_id in range(self._partition_num):
+            partition_dir = os.path.join(parallel_dir,
+                                         common.partition_repr(partition_id))
+            for meta in self._list_metas(parallel_dir, partition_id):
+                if meta.process_index == 3 and (task_end_index is None or
+                        task_end_index < meta.end_index):
+                    task_end_index = meta.end_index
+                if meta.process_index > 4 or \
+                        (meta.process_index == 4 and partition_id > 0):
+                    gfile.Remove(os.path.join(partition_dir,
+                                              meta.encode_meta_to_fname()))
+        partitioner = RawDataPartitioner(
+                self._make_options(parallel_dir, 2), 'raw_id', 'etcd', True
+            )
+        partitioner._sync_partitioner_state()
+        self.assertEqual(partitioner._dumped_process_index, 3)
+        self.assertEqual(partitioner._get_next_part_index(),
+                         task_end_index + 1)
+        for partition_id in range(self._partition_num):
+            metas = self._list_metas(parallel_dir, partition_id)
+            self.assertEqual(metas[-1].process_index, 3)
+        self._partition(parallel_dir, 2)
+        self._check_same_output(serial_dir, parallel_dir)
+
+    def test_parallel_partition_resume_changed(self):
+        serial_dir = os.path.join(self._base_dir, 'serial')
+        parallel_dir = os.path.join(self._base_dir, 'parallel')
+        self._partition(serial_dir, 1)
+        self._partition(parallel_dir, 2)
+        gfile.Remove(os.path.join(parallel_dir, '_SUCCESS.00000000'))
+        for partition_id in range(self._partition_num):
+            partition_dir = os.path.join(parallel_dir,
+                                         common.partition_repr(partition_id))
+            for meta in self._list_metas(parallel_dir, partition_id):
+                if meta.process_index > 5:
+                    gfile.Remove(os.path.join(partition_dir,
+                                              meta.encode_meta_to_fname()))
+        # the tasks do not depend on the process number
+        self._partition(parallel_dir, 3)
+        self._check_same_output(serial_dir, parallel_dir)
+        gfile.Remove(os.path.join(parallel_dir, '_SUCCESS.00000000'))
+        self._input_fpaths.pop()
+        partitioner = RawDataPartitioner(
+                self._make_options(parallel_dir, 2), 'raw_id', 'etcd', True
+            )
+        with self.assertRaises(RuntimeError):
+            partitioner._raw_data_parallel_part_fn()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from google.protobuf import text_format, empty_pb2
+
+from fedlearner.common import db_client
+from fedlearner.common import data_join_service_pb2 as dj_pb
+from fedlearner.data_join import common
+from fedlearner.data_join.raw_data_publisher import RawDataPublisher
+
+class TestRawDataPublisher(unittest.TestCase):
+    def setUp(self):
+        self._kvstore = db_client.DBClient('etcd', True)
+        self._pub_dir = 'test_raw_data_publisher'
+        self._kvstore.delete_prefix(self._pub_dir)
+        self._tmp_dir = tempfile.mkdtemp()
+        self._fpaths = []
+        for i in range(10):
+            fpath = os.path.join(self._tmp_dir, '{}.rd'.format(i))
+            with open(fpath, 'w') as fh:
+                fh.write(str(i))
+            self._fpaths.append(fpath)
+
+    def tearDown(self):
+        self._kvstore.delete_prefix(self._pub_dir)
+        shutil.rmtree(self._tmp_dir)
+
+    def _get_pub(self, pub_index):
+        data = self._kvstore.get_data(
+                common.raw_data_pub_kvstore_key(self._pub_dir, 0, pub_index)
+            )
+        if data is None:
+            return None
+        return common.decode_raw_data_pub(data)
+
+    def test_publish_raw_data(self):
+        publisher = RawDataPublisher(self._kvstore, self._pub_dir, 4)
+        self.assertRaises(ValueError, publisher.publish_raw_data, 0,
+                          [os.path.join(self._tmp_dir, 'missing.rd')])
+        self.assertIsNone(self._get_pub(0))
+        publisher.publish_raw_data(0, self._fpaths[:7])
+        # published by a publisher of text format before
+        legacy_pub = dj_pb.RawDatePub(
+                raw_data_meta=dj_pb.RawDataMeta(file_path=self._fpaths[7],
+                                                start_index=-1)
+            )
+        self._kvstore.set_data(
+                common.raw_data_pub_kvstore_key(self._pub_dir, 0, 7),
+                text_format.MessageToString(legacy_pub)
+            )
+        publisher.publish_raw_data(0, self._fpaths[8:])
+        for pub_index, fpath in enumerate(self._fpaths):
+            pub = self._get_pub(pub_index)
+            self.assertTrue(pub.HasField('raw_data_meta'))
+            self.assertEqual(pub.raw_data_meta.file_path, fpath)
+            self.assertEqual(pub.raw_data_meta.start_index, -1)
+        self.assertIsNone(self._get_pub(len(self._fpaths)))
+        publisher.finish_raw_data(0)
+        self.assertTrue(
+                self._get_pub(len(self._fpaths)).HasField('raw_data_finished')
+            )
+        publisher.publish_raw_data(0, self._fpaths[:5])
+        self.assertIsNone(self._get_pub(len(self._fpaths) + 1))
+
+    def test_publish_atomically(self):
+        finish_pub = dj_pb.RawDatePub(raw_data_finished=empty_pb2.Empty())
+        occupied = common.raw_data_pub_kvstore_key(self._pub_dir, 0, 5)
+        self._kvstore.set_data(occupied,
+                               common.encode_raw_data_pub(finish_pub))
+        kvs = [(common.raw_data_pub_kvstore_key(self._pub_dir, 0, i),
+                None, str(i)) for i in range(3, 8)]
+        self.assertFalse(self._kvstore.batch_cas(kvs))
+        for i in [3, 4, 6, 7]:
+            self.assertIsNone(self._get_pub(i))
+        self._kvstore.delete(occupied)
+        self.assertTrue(self._kvstore.batch_cas(kvs))
+        for key, _, data in kvs:
+            self.assertEqual(self._kvstore.get_data(key), data.encode())
+
+if __name__ == '__main__':
+    unittest.main()
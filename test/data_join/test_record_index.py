@@ -0,0 +1,133 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import tensorflow.compat.v1 as tf
+tf.enable_eager_execution()
+
+from fedlearner.common import data_join_service_pb2 as dj_pb
+from fedlearner.data_join import visitor
+from fedlearner.data_join.raw_data_iter_impl import create_raw_data_iter
+from fedlearner.data_join.raw_data_iter_impl.record_index import (
+    RecordIndex, record_index_fpath
+)
+
+class TestRecordIndex(unittest.TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self._start_index = 1000
+        self._num = 500
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+    def _gen_tf_record_file(self):
+        fpath = os.path.join(self._tmp_dir, 'raw_data.rd')
+        writer = tf.io.TFRecordWriter(fpath)
+        for i in range(self._num):
+            feat = {'example_id': tf.train.Feature(
+                bytes_list=tf.train.BytesList(
+                    value=['id_{}'.format(i).encode() * (i % 7 + 1)]))}
+            example = tf.train.Example(
+                features=tf.train.Features(feature=feat))
+            writer.write(example.SerializeToString())
+        writer.close()
+        return fpath
+
+    def _gen_csv_file(self):
+        fpath = os.path.join(self._tmp_dir, 'raw_data.csv')
+        with open(fpath, 'w') as fh:
+            fh.write('example_id,event_time,note\n')
+            for i in range(self._num):
+                if i % 13 == 0:
+                    fh.write('\n')
+                note = '"multi\nline ""{}"""'.format(i) if i % 5 == 0 \
+                        else 'n{}'.format(i)
+                fh.write('{},{},{}\n'.format(
+                    'id_{}'.format(i) * (i % 7 + 1), i, note))
+        return fpath
+
+    def _check_seek(self, raw_data_iter, fpath, interval):
+        index_meta = visitor.IndexMeta(0, self._start_index, fpath)
+        rnd = random.Random(2020)
+        targets = [rnd.randint(0, self._num - 1) for _ in range(50)]
+        targets += [self._num - 1, interval, interval - 1, 0]
+        for target in targets:
+            raw_data_iter.reset_iter(index_meta, True)
+            raw_data_iter.seek_to_target(self._start_index + target)
+            self.assertEqual(raw_data_iter.get_index(),
+                             self._start_index + target)
+            expected = 'id_{}'.format(target) * (target % 7 + 1)
+            self.assertEqual(raw_data_iter.get_item().example_id,
+                             expected.encode())
+        index_fpath = record_index_fpath(fpath)
+        self.assertTrue(os.path.exists(index_fpath))
+        self.assertTrue(os.path.basename(index_fpath).startswith('.'))
+        record_index = RecordIndex.load(index_fpath)
+        self.assertEqual(record_index.interval, interval)
+        self.assertEqual(record_index.file_size, os.path.getsize(fpath))
+        self.assertEqual(record_index.floor(interval * 3 + 1)[0],
+                         interval * 3)
+        raw_data_iter.reset_iter(index_meta, True)
+        for index, item in raw_data_iter:
+            target = index - self._start_index
+            expected = 'id_{}'.format(target) * (target % 7 + 1)
+            self.assertEqual(item.example_id, expected.encode())
+        self.assertEqual(raw_data_iter.get_index(),
+                         self._start_index + self._num - 1)
+
+    def test_tf_record_seek(self):
+        fpath = self._gen_tf_record_file()
+        options = dj_pb.RawDataOptions(raw_data_iter='TF_RECORD',
+                                       read_ahead_size=1<<20,
+                                       read_batch_size=16,
+                                       record_index_interval=32)
+        self._check_seek(create_raw_data_iter(options), fpath, 32)
+
+    def test_csv_seek(self):
+        fpath = self._gen_csv_file()
+        for read_ahead_size in [0, 1<<20]:
+            options = dj_pb.RawDataOptions(raw_data_iter='CSV_DICT',
+                                           read_ahead_size=read_ahead_size,
+                                           record_index_interval=32)
+            self._check_seek(create_raw_data_iter(options), fpath, 32)
+
+    def test_build_once_without_sidecar(self):
+        fpath = self._gen_csv_file()
+        build_cnt = [0]
+        def build_fn(fpath, interval):
+            build_cnt[0] += 1
+            return [0]
+        for _ in range(3):
+            record_index = _UnwritableRecordIndex.get_or_build(
+                    fpath, 32, build_fn)
+            self.assertEqual(record_index.interval, 32)
+        self.assertEqual(build_cnt[0], 1)
+        self.assertFalse(os.path.exists(record_index_fpath(fpath)))
+        _UnwritableRecordIndex.get_or_build(fpath, 16, build_fn)
+        self.assertEqual(build_cnt[0], 2)
+
+class _UnwritableRecordIndex(RecordIndex):
+    def dump(self, fpath):
+        raise IOError('read-only directory')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import hashlib
+import random
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+
+import gmpy2
+from cityhash import CityHash64 # pylint: disable=no-name-in-module
+
+from fedlearner.data_join.rsa_psi.rsa_psi_crypto import (
+    CrtRsaSigner, BlindingFactorPool, crypto_hash_buffer, crypto_hash_ints,
+    digests_to_ints, oneway_hash_join_ids
+)
+
+class TestCrtRsaSigner(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2020)
+        self._e = 65537
+        while True:
+            p = gmpy2.next_prime(rnd.getrandbits(512) | (3 << 510))
+            q = gmpy2.next_prime(rnd.getrandbits(512) | (3 << 510))
+            if gmpy2.gcd(self._e, (p - 1) * (q - 1)) == 1:
+                break
+        self._n = p * q
+        self._d = gmpy2.invert(self._e, (p - 1) * (q - 1))
+        self._signer = CrtRsaSigner(p, q, self._d)
+        self._ids = [rnd.getrandbits(256) for _ in range(1000)]
+
+    def test_sign_ints(self):
+        self.assertEqual(self._signer.n, self._n)
+        signed = self._signer.sign_ints(self._ids)
+        for x, s in zip(self._ids, signed):
+            self.assertEqual(s, gmpy2.powmod(x, self._d, self._n))
+            self.assertEqual(gmpy2.powmod(s, self._e, self._n), x)
+
+    def test_batch_sign_bytes(self):
+        byte_len = self._n.bit_length() // 8
+        items = [x.to_bytes(byte_len, 'little') for x in self._ids]
+        expected = [
+            int(gmpy2.powmod(x, self._d, self._n)).to_bytes(byte_len,
+                                                             'little')
+            for x in self._ids]
+        self.assertEqual(self._signer.batch_sign_bytes(items), expected)
+        with ProcessPoolExecutor(2) as pool:
+            self.assertEqual(
+                self._signer.batch_sign_bytes(items, pool, chunk_size=128),
+                expected)
+
+    def test_blinding_factor_pool(self):
+        with ProcessPoolExecutor(2) as pool:
+            blinding_pool = BlindingFactorPool(self._e, self._n, 256, pool,
+                                               batch_size=64)
+            factors = blinding_pool.get(1000)
+            blinding_pool.stop()
+        self.assertEqual(len(factors), 1000)
+        signed = self._signer.sign_ints(
+            [re * x % self._n for x, (re, _) in zip(self._ids, factors)])
+        deblinded = [s * r_inv % self._n
+                     for s, (_, r_inv) in zip(signed, factors)]
+        self.assertEqual(deblinded, self._signer.sign_ints(self._ids))
+
+class TestPsiHash(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2020)
+        self._raw_ids = [b'', b"it's", b'"', b'\\', b'\n\x00\xff', 'str_id',
+                         u'\u4e2d\u6587', 12345]
+        self._raw_ids += ['{}'.format(rnd.randint(0, 1 << 40)).encode()
+                          for _ in range(500)]
+        self._raw_ids += [bytes(rnd.getrandbits(8) for _ in range(16))
+                          for _ in range(100)]
+
+    def test_crypto_hash_ints(self):
+        expected = [
+            int(hashlib.sha256(bytes(str(x), encoding='utf-8')).hexdigest(),
+                16)
+            for x in self._raw_ids]
+        self.assertEqual(crypto_hash_ints(self._raw_ids), expected)
+        bytes_ids = [x for x in self._raw_ids if isinstance(x, bytes)]
+        offsets = [0]
+        for x in bytes_ids:
+            offsets.append(offsets[-1] + len(x))
+        self.assertEqual(
+            digests_to_ints(crypto_hash_buffer(b''.join(bytes_ids), offsets)),
+            crypto_hash_ints(bytes_ids))
+
+    def test_oneway_hash_join_ids(self):
+        items = crypto_hash_ints(self._raw_ids)
+        expected = [hex(CityHash64(str(x)))[2:] for x in items]
+        self.assertEqual(oneway_hash_join_ids(items), expected)
+        self.assertEqual(
+            oneway_hash_join_ids([gmpy2.mpz(x) for x in items]), expected)
+
+if __name__ == '__main__':
+    unittest.main()
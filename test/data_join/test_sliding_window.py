@@ -105,6 +105,29 @@ class TestSlidingWindow(unittest.TestCase):
         res, _ = acc.join(conv_window, show_window, watermark)
         self.assertEqual(conv_size * conv_steps - conv_skips + repeated, len(res))
 
+    def test_sliding_window_key_index(self):
+        keys = Expr("(example_id, lt(event_time))").keys()
+        sliding_win = aj._SlidingWindow(1, 100000000,
+                                        self._mapper.leader_mapping)
+        sliding_win.set_index_keys(keys)
+        idx = 0
+        for step in range(50):
+            sliding_win.forward(random.randint(0, 30))
+            for i in range(random.randint(1, 40)):
+                # example ids repeat so that keys index several elements
+                sliding_win.append(idx, CsvItem({'example_id': str(idx % 97),
+                                                 'event_time': idx,
+                                                 'index': idx}))
+                idx += 1
+            expected = {}
+            for i in range(sliding_win.size()):
+                for key in aj.make_index_by_attr(keys, sliding_win[i].item):
+                    expected.setdefault(key, []).append(i)
+            self.assertEqual(set(expected),
+                             set(sliding_win._key_index))
+            for key, positions in expected.items():
+                self.assertEqual(positions, sliding_win.find(key))
+
     def test_interval_to_timestamp(self):
         test_in = ["1000s", "1n", "10D", "1Y2M1d3h", "1d1y", "1s1S", "111111s", "1234", "0y1n1"]
         test_out = [1000, 60, 864000, 36385200, None, None, 111111, 1234, 61]
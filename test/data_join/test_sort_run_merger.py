@@ -0,0 +1,213 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import os
+import random
+import unittest
+
+import tensorflow.compat.v1 as tf
+tf.enable_eager_execution()
+import tensorflow_io
+from tensorflow.compat.v1 import gfile
+
+from fedlearner.common import data_join_service_pb2 as dj_pb
+from fedlearner.data_join import common
+from fedlearner.data_join.raw_data_iter_impl.tf_record_iter import \
+        TfExampleItem
+from fedlearner.data_join.rsa_psi.rsa_psi_preprocessor import \
+        RsaPsiPreProcessor
+from fedlearner.data_join.sort_run_dumper import \
+        SortRunDumper, sort_run_writer_options
+from fedlearner.data_join.sort_run_merger import SortRunMerger
+
+def _sort_key(item):
+    return item.example_id
+
+def _make_item(example_id):
+    feat = {
+        'example_id': tf.train.Feature(
+            bytes_list=tf.train.BytesList(value=[example_id.encode()])),
+        'feat_0': tf.train.Feature(
+            bytes_list=tf.train.BytesList(
+                value=[b'feat-' + example_id.encode()]))
+    }
+    example = tf.train.Example(features=tf.train.Features(feature=feat))
+    return TfExampleItem(example.SerializeToString())
+
+class _ItemBatch(object):
+    def __init__(self, begin_index, items):
+        self.begin_index = begin_index
+        self._items = items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+class _SignedItemFetcher(object):
+    """Serve the signed items to the sort run dumper of the preprocessor
+    in batches, as the rsa signer does"""
+    def __init__(self, example_ids, batch_size):
+        self._batches = []
+        for begin in range(0, len(example_ids), batch_size):
+            items = [(eid, _make_item(eid), begin + offset) for offset, eid
+                     in enumerate(example_ids[begin:begin+batch_size])]
+            self._batches.append(_ItemBatch(begin, items))
+        self._batch_size = batch_size
+
+    def fetch_item_batch_by_index(self, next_index, hint_index=None):
+        batch_index = next_index // self._batch_size
+        finished = batch_index >= len(self._batches) - 1
+        if batch_index >= len(self._batches):
+            return finished, None, hint_index
+        return finished, self._batches[batch_index], batch_index
+
+    def evict_staless_item_batch(self, index):
+        pass
+
+class TestSortRunMerger(unittest.TestCase):
+    def setUp(self):
+        self._output_dir = './sort_run_merger_output'
+        if gfile.Exists(self._output_dir):
+            gfile.DeleteRecursively(self._output_dir)
+        gfile.MakeDirs(self._output_dir)
+        self._example_ids = ['{:08}'.format(i) for i in range(1000)]
+        random.shuffle(self._example_ids)
+
+    def tearDown(self):
+        if gfile.Exists(self._output_dir):
+            gfile.DeleteRecursively(self._output_dir)
+
+    def _preprocessor_options(self, compressed_type='', memory_budget=0):
+        return dj_pb.RsaPsiPreProcessorOptions(
+                output_file_dir=os.path.join(self._output_dir, 'dump'),
+                partition_id=0,
+                batch_processor_options=dj_pb.BatchProcessorOptions(
+                    batch_size=64,
+                    max_flying_item=1<<14
+                ),
+                writer_options=dj_pb.WriterOptions(
+                    output_writer='TF_RECORD'
+                ),
+                sort_run_memory_budget=memory_budget,
+                sort_run_compressed_type=compressed_type
+            )
+
+    def _dump_sort_runs(self, options, run_num):
+        dumper = SortRunDumper(options)
+        run_size = (len(self._example_ids) + run_num - 1) // run_num
+        for begin in range(0, len(self._example_ids), run_size):
+            items = sorted(
+                    [(eid, begin + offset, _make_item(eid)) for offset, eid
+                     in enumerate(self._example_ids[begin:begin+run_size])]
+                )
+            dumper.dump_sort_runs(iter(items))
+        dumper.finish_dump_sort_run()
+        return dumper
+
+    @staticmethod
+    def _sort_run_fpaths(dumper):
+        output_dir = os.path.join(dumper.sort_run_dump_dir(),
+                                  common.partition_repr(0))
+        return [os.path.join(output_dir, meta.encode_sort_run_fname())
+                for meta in dumper.get_all_sort_runs()]
+
+    def _merge_sort_runs(self, options, input_fpaths, merge_fan_in,
+                         merger_dir):
+        sort_run_options = sort_run_writer_options(options)
+        merger = SortRunMerger(
+                dj_pb.SortRunMergerOptions(
+                    merger_name='sort_run_merger',
+                    reader_options=dj_pb.RawDataOptions(
+                        raw_data_iter=sort_run_options.output_writer,
+                        compressed_type=sort_run_options.compressed_type,
+                        read_ahead_size=1<<20,
+                        read_batch_size=16
+                    ),
+                    writer_options=options.writer_options,
+                    output_file_dir=os.path.join(self._output_dir,
+                                                 merger_dir),
+                    partition_id=0,
+                    merge_fan_in=merge_fan_in
+                ),
+                _sort_key
+            )
+        example_ids = []
+        for fpath in merger.merge_sort_runs(input_fpaths):
+            for record in tf.data.TFRecordDataset([fpath]):
+                example = tf.train.Example.FromString(record.numpy())
+                feat = example.features.feature
+                example_id = feat['example_id'].bytes_list.value[0]
+                self.assertEqual(feat['feat_0'].bytes_list.value[0],
+                                 b'feat-' + example_id)
+                example_ids.append(example_id.decode())
+        return example_ids
+
+    def test_merge_in_passes(self):
+        options = self._preprocessor_options()
+        input_fpaths = self._sort_run_fpaths(self._dump_sort_runs(options, 7))
+        self.assertEqual(len(input_fpaths), 7)
+        single_pass = self._merge_sort_runs(options, input_fpaths,
+                                            0, 'merged_0')
+        self.assertEqual(single_pass, sorted(self._example_ids))
+        for merge_fan_in in [2, 3]:
+            merger_dir = 'merged_{}'.format(merge_fan_in)
+            multi_pass = self._merge_sort_runs(options, input_fpaths,
+                                               merge_fan_in, merger_dir)
+            self.assertEqual(multi_pass, single_pass)
+            self.assertFalse(gfile.Exists(os.path.join(
+                self._output_dir, merger_dir, 'sort_run_merge-tmp',
+                common.partition_repr(0))))
+
+    def test_zlib_sort_runs(self):
+        options = self._preprocessor_options(compressed_type='ZLIB')
+        self.assertEqual(sort_run_writer_options(options).compressed_type,
+                         'ZLIB')
+        self.assertEqual(options.writer_options.compressed_type, '')
+        input_fpaths = self._sort_run_fpaths(self._dump_sort_runs(options, 4))
+        with self.assertRaises(Exception):
+            list(tf.data.TFRecordDataset([input_fpaths[0]]))
+        zlib_records = list(tf.data.TFRecordDataset([input_fpaths[0]],
+                                                    compression_type='ZLIB'))
+        self.assertEqual(len(zlib_records), len(self._example_ids) // 4)
+        example_ids = self._merge_sort_runs(options, input_fpaths,
+                                            2, 'merged')
+        self.assertEqual(example_ids, sorted(self._example_ids))
+
+    def test_spill_by_memory_budget(self):
+        item_bytes = len(self._example_ids[0]) + \
+                len(_make_item(self._example_ids[0]).tf_record)
+        options = self._preprocessor_options(memory_budget=item_bytes * 100)
+        processor = RsaPsiPreProcessor.__new__(RsaPsiPreProcessor)
+        processor._options = options
+        processor._sort_run_dumper = SortRunDumper(options)
+        processor._psi_rsa_signer = _SignedItemFetcher(self._example_ids, 50)
+        processor._comsume_item_cnt = 0
+        while not processor._sort_run_dumper.is_dump_finished():
+            processor._sort_run_dump_fn()
+        self.assertEqual(processor._comsume_item_cnt, len(self._example_ids))
+        sort_runs = processor._sort_run_dumper.get_all_sort_runs()
+        self.assertEqual(len(sort_runs), len(self._example_ids) // 100)
+        for meta in sort_runs:
+            self.assertEqual(meta.end_index - meta.start_index + 1, 100)
+        input_fpaths = self._sort_run_fpaths(processor._sort_run_dumper)
+        example_ids = self._merge_sort_runs(options, input_fpaths,
+                                            4, 'merged')
+        self.assertEqual(example_ids, sorted(self._example_ids))
+
+if __name__ == '__main__':
+    unittest.main()
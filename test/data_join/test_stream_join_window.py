@@ -0,0 +1,66 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import random
+import unittest
+
+from fedlearner.data_join.joiner_impl import stream_joiner as sj
+from fedlearner.data_join.raw_data_iter_impl.csv_dict_iter import CsvItem
+
+class TestJoinWindow(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2020)
+        self._window = sj._JoinWindow(0.05, 0.99)
+        self._keys = []
+        for idx in range(2000):
+            example_id = '{}'.format(rnd.randint(0, 1000))
+            event_time = rnd.randint(0, 100)
+            item = CsvItem({'example_id': example_id,
+                            'event_time': event_time})
+            self._window.append(idx, item)
+            self._keys.append((item.event_time, item.example_id))
+
+    def _sorted_pt(self, rate):
+        keys = sorted(self._keys)
+        pos = min(int(len(keys) * rate), len(keys) - 1)
+        return sj._CmpCtnt(*keys[pos])
+
+    def test_watermark(self):
+        self.assertTrue(self._window.forward_pt())
+        self.assertEqual(self._window.committed_pt(), self._sorted_pt(0.05))
+        self.assertEqual(self._window.qt(), self._sorted_pt(0.99))
+        self.assertFalse(self._window.forward_pt())
+
+    def test_less_than(self):
+        pt = self._sorted_pt(0.5)
+        self.assertEqual(list(self._window.less_than(pt)),
+                         [sj._CmpCtnt(*key) < pt for key in self._keys])
+        self.assertTrue(self._window.less_than(None).all())
+
+    def test_retain(self):
+        example_ids = {b'1', b'7', b'42'}
+        mask = self._window.match_example_ids(example_ids)
+        self.assertEqual(list(mask),
+                         [key[1] in example_ids for key in self._keys])
+        positions = [pos for pos in range(len(mask)) if not mask[pos]]
+        items = [self._window[pos] for pos in positions]
+        self._window.retain(positions)
+        self._keys = [self._keys[pos] for pos in positions]
+        self.assertEqual(list(self._window), items)
+        self.assertEqual(self._window.qt(), self._sorted_pt(0.99))
+
+if __name__ == '__main__':
+    unittest.main()
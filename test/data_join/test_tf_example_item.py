@@ -0,0 +1,95 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import random
+import unittest
+
+import tensorflow.compat.v1 as tf
+
+from fedlearner.data_join import common
+from fedlearner.data_join.raw_data_iter_impl.tf_record_iter import \
+        TfExampleItem, parse_tf_example_fields
+
+class TestTfExampleItem(unittest.TestCase):
+    def setUp(self):
+        rnd = random.Random(2020)
+        self._records = []
+        for i in range(200):
+            example = tf.train.Example()
+            feat = example.features.feature
+            feat['example_id'].bytes_list.value.append(
+                    '{}'.format(i).encode())
+            feat['event_time'].int64_list.value.append(
+                    rnd.randint(-2**63, 2**63-1))
+            if i % 2 == 0:
+                feat['raw_id'].bytes_list.value.extend([b'a', b'b'])
+            if i % 3 == 0:
+                feat['label'].int64_list.value.extend([])
+            if i % 5 == 0:
+                feat['joined'].int64_list.value.extend([-1, 2**40])
+            for k in range(20):
+                feat['f{}'.format(k)].float_list.value.append(rnd.random())
+                feat['g{}'.format(k)].bytes_list.value.append(b'x' * k)
+            self._records.append(example.SerializeToString())
+
+    def _parse_allowed_fields(self, record_str):
+        example = tf.train.Example()
+        example.ParseFromString(record_str)
+        dic = common.convert_tf_example_to_dict(example)
+        return {key: val[0] if len(val) == 1 else val
+                for key, val in dic.items()
+                if key in common.ALLOWED_FIELDS}
+
+    def test_parse_tf_example_fields(self):
+        for record_str in self._records:
+            example = tf.train.Example()
+            example.ParseFromString(record_str)
+            fields = ['example_id', 'raw_id', 'f3', 'g5', 'missing']
+            expected = {key: val for key, val in
+                        common.convert_tf_example_to_dict(example).items()
+                        if key in fields}
+            self.assertEqual(
+                    dict(parse_tf_example_fields(record_str, fields)),
+                    expected
+                )
+
+    def test_lazy_item(self):
+        for record_str in self._records:
+            item = TfExampleItem(record_str)
+            self.assertEqual(item.tf_record, record_str)
+            self.assertEqual(dict(item.record),
+                             self._parse_allowed_fields(record_str))
+            item = TfExampleItem(record_str)
+            self.assertEqual(item.example_id,
+                             self._parse_allowed_fields(record_str)\
+                                     ['example_id'])
+
+    def test_add_extra_fields(self):
+        item = TfExampleItem(self._records[1])
+        item.add_extra_fields({'label': 1, 'raw_id': b'rid'})
+        self.assertEqual(item.label, 1)
+        self.assertEqual(item.raw_id, b'rid')
+        self.assertEqual(dict(TfExampleItem(item.tf_record).record),
+                         self._parse_allowed_fields(item.tf_record))
+        self.assertEqual(item.csv_record['label'], [1])
+
+    def test_broken_record(self):
+        item = TfExampleItem(self._records[0][:-3])
+        self.assertEqual(item.example_id, common.InvalidExampleId)
+        self.assertEqual(item.csv_record, {})
+
+if __name__ == '__main__':
+    unittest.main()
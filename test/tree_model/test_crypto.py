@@ -14,7 +14,9 @@
 
 # coding: utf-8
 
+import logging
 import unittest
+import numpy as np
 from fedlearner.model.crypto import paillier
 
 
@@ -34,6 +36,78 @@ class TestPaillier(unittest.TestCase):
 
         self.assertAlmostEqual(c, a + b)
 
+    def test_batch_encrypt(self):
+        public_key, private_key = paillier.PaillierKeypair.generate_keypair()
+        pool = paillier.PaillierObfuscatorPool(
+            public_key, 64, num_workers=2, batch_size=16)
+        self.addCleanup(pool.close)
+        values = np.random.normal(size=100)
+        ciphertexts, exponent = public_key.batch_encrypt(
+            values, 1e30, pool.get(len(values)), nbytes=256)
+
+        self.assertEqual(len(ciphertexts), len(values))
+        decrypted = [
+            private_key.decrypt(paillier.PaillierEncryptedNumber(
+                public_key, int.from_bytes(c, 'little'), exponent))
+            for c in ciphertexts]
+        np.testing.assert_almost_equal(decrypted, values)
+
+        raw = public_key.batch_raw_encrypt(
+            [0, 1, 12345], pool.get(3))
+        self.assertEqual(
+            [private_key.raw_decrypt(c) for c in raw], [0, 1, 12345])
+
+    def test_batch_decrypt(self):
+        public_key, private_key = paillier.PaillierKeypair.generate_keypair()
+        values = np.random.normal(size=100)
+        encrypted = [public_key.encrypt(v, 1e30) for v in values]
+        encrypted[1] = encrypted[1] + encrypted[2]
+        values[1] = values[1] + values[2]
+
+        ciphertexts = [
+            e.ciphertext(False).to_bytes(256, 'little') for e in encrypted]
+        decrypted = private_key.batch_decrypt(
+            ciphertexts, encrypted[0].exponent)
+        np.testing.assert_almost_equal(decrypted, values)
+
+        raw = [e.ciphertext(False) for e in encrypted]
+        self.assertEqual(private_key.batch_raw_decrypt(raw),
+                         [private_key.raw_decrypt(c) for c in raw])
+
+    def test_batch_encrypt_matches_per_number(self):
+        public_key, private_key = paillier.PaillierKeypair.generate_keypair()
+        values = np.random.normal(size=200)
+        pool = paillier.PaillierObfuscatorPool(public_key, 0)
+        try:
+            ciphertexts, exponent = public_key.batch_encrypt(
+                values, 1e30, pool.get(len(values)))
+        finally:
+            pool.close()
+
+        per_number = [
+            private_key.decrypt(public_key.encrypt(v, 1e30)) for v in values]
+        batch = private_key.batch_decrypt(ciphertexts, exponent)
+        np.testing.assert_almost_equal(batch, per_number)
+        np.testing.assert_almost_equal(batch, values)
+
+    def test_batch_encrypt_benchmark(self):
+        public_key, _ = paillier.PaillierKeypair.generate_keypair()
+        values = np.random.normal(size=1000)
+        pool = paillier.PaillierObfuscatorPool(public_key, 0)
+        self.addCleanup(pool.close)
+        obfuscators = pool.get(len(values))
+
+        per_number = timeit.timeit(
+            lambda: [public_key.encrypt(v, 1e30) for v in values], number=1)
+        batch = timeit.timeit(
+            lambda: public_key.batch_encrypt(values, 1e30, obfuscators),
+            number=1)
+        # timing only, wall clock is too noisy to assert on
+        logging.info("encrypting %d numbers: per-number %fs, "
+                     "batch with precomputed obfuscators %fs",
+                     len(values), per_number, batch)
+
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     unittest.main()
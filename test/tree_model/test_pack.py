@@ -14,56 +14,69 @@
 
 # coding: utf-8
 
-import random
 import logging
 import unittest
 import numpy as np
-from fedlearner.model.tree.packing import GradHessPacker
-from fedlearner.model.tree.tree import EXPONENT, PRECISION
-from fedlearner.model.crypto.paillier import PaillierKeypair
+from fedlearner.model.tree.packing import HistogramPacker
+from fedlearner.model.tree.tree import PACKING_PRECISION
+from fedlearner.model.crypto.paillier import PaillierKeypair, \
+    PaillierEncryptedNumber
 
 
-class TestPackGradHess(unittest.TestCase):
+class TestHistogramPacker(unittest.TestCase):
 
-    def __init__(self, *args, **kwargs):
-        super(TestPackGradHess, self).__init__(*args, **kwargs)
+    def _test_pack_histograms(self, num_samples, node_samples, precision):
         public_key, private_key = PaillierKeypair.generate_keypair()
-        self.private_key = private_key
-        self.pack = GradHessPacker(public_key, PRECISION, EXPONENT)
+        num_bins = 30
+        grad = np.random.normal(size=num_samples) * 10
+        hess = np.random.random(size=num_samples)
+        packer = HistogramPacker.create(
+            public_key, precision, num_samples,
+            max(np.abs(grad).max(), np.abs(hess).max()))
+        self.assertGreater(packer.bins_per_ciphertext(num_samples), 1)
+        self.assertGreaterEqual(packer.bins_per_ciphertext(node_samples),
+                                packer.bins_per_ciphertext(num_samples))
 
-    def _test_pack(self, grad, hess):
-        """Test GradHessPacker
-        compare
-        1. the difference between result before and after pack
-        2. the difference between sum_grad, sum_hess and the result using pack
-        Args:
-            grad: the grad for pack
-            hess: the hess for pack
-        """
-        grad_hess_encrypted = self.pack.pack_and_encrypt_grad_hess(grad, hess)
-        grad_hess_ciphertext = [i.ciphertext(False) for i in grad_hess_encrypted]
-        g, h = self.pack.decrypt_and_unpack_grad_hess(grad_hess_ciphertext, self.private_key)
-        np.testing.assert_almost_equal(grad, g, decimal=32)
-        np.testing.assert_almost_equal(hess, h, decimal=32)
+        # the histograms of a node only sum the samples of the node
+        sample_ids = np.random.choice(num_samples, node_samples,
+                                      replace=False)
+        bins = np.random.randint(0, num_bins, size=node_samples)
+        encrypted = [
+            PaillierEncryptedNumber(public_key, public_key.raw_encrypt(i))
+            for i in packer.pack_grad_hess(grad[sample_ids],
+                                           hess[sample_ids])]
+        zero = PaillierEncryptedNumber(public_key, public_key.raw_encrypt(0))
+        hist = np.asarray([zero for _ in range(num_bins)])
+        np.add.at(hist, bins, encrypted)
 
-        sum_g = sum(grad)
-        sum_h = sum(hess)
+        # the follower only knows the slot widths
+        follower_packer = HistogramPacker(
+            public_key, packer.value_bits, packer.slot_bits)
+        packed = follower_packer.pack_ciphertexts(
+            [i.ciphertext(False) for i in hist], node_samples)
+        group_size = packer.bins_per_ciphertext(node_samples)
+        self.assertEqual(len(packed),
+                         (num_bins + group_size - 1) // group_size)
 
-        sgh_encrypt = sum(grad_hess_encrypted)
-        sgh_ciphertext = sgh_encrypt.ciphertext(False)
-        sg, sh = self.pack.decrypt_and_unpack_grad_hess([sgh_ciphertext], self.private_key)
-        np.testing.assert_almost_equal(sum_g, sg)
-        np.testing.assert_almost_equal(sum_h, sh)
+        g, h = packer.unpack_histograms(
+            private_key.batch_raw_decrypt(packed), num_bins, node_samples)
+        # each value is off by at most half a unit of the fixed point,
+        # rtol only covers the float64 rounding of the sums
+        atol = node_samples * 0.5 * 16.0 ** -packer.exponent
+        np.testing.assert_allclose(
+            g, np.bincount(bins, grad[sample_ids], num_bins),
+            rtol=1e-12, atol=atol)
+        np.testing.assert_allclose(
+            h, np.bincount(bins, hess[sample_ids], num_bins),
+            rtol=1e-12, atol=atol)
 
-    def test_pack(self):
+    def test_pack_histograms(self):
+        self._test_pack_histograms(200, 200, PACKING_PRECISION)
+        self._test_pack_histograms(200, 200, 1e20)
 
-        grad = [random.randint(-1e100, 1e100) for i in range(1000)]
-        hess = [random.randint(-1e100, 1e100) for i in range(1000)]
-        self._test_pack(grad, hess)
+    def test_pack_node_histograms(self):
+        self._test_pack_histograms(1000, 30, PACKING_PRECISION)
 
-        grad = (2 * np.random.random(size=1000) - 1) * 1e6
-        hess = (2 * np.random.random(size=1000) - 1) * 1e6
-        self._test_pack(grad, hess)
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,92 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from fedlearner.common import tree_model_pb2 as tree_pb2
+from fedlearner.model.tree.predictor import CompiledEnsemble
+
+
+class TestCompiledEnsemble(unittest.TestCase):
+    num_features = 4
+    num_cat_features = 2
+
+    def make_tree(self, max_depth):
+        tree = tree_pb2.RegressionTreeProto()
+        def build(depth):
+            node = tree.nodes.add(
+                node_id=len(tree.nodes), is_owner=True,
+                default_left=bool(np.random.randint(2)),
+                weight=np.random.normal())
+            if depth < max_depth and np.random.random() < 0.8:
+                if np.random.random() < 0.3:
+                    node.is_cat_feature = True
+                    node.feature_id = self.num_features + \
+                        np.random.randint(self.num_cat_features)
+                    node.cat_threshold.extend(np.random.choice(
+                        10, np.random.randint(1, 5), replace=False).tolist())
+                else:
+                    node.feature_id = np.random.randint(self.num_features)
+                    node.threshold = np.random.normal()
+                left = build(depth + 1)
+                right = build(depth + 1)
+                node.left_child = left.node_id
+                node.right_child = right.node_id
+            return node
+        build(0)
+        return tree
+
+    def predict_one(self, tree, x, cat_x):
+        node = tree.nodes[0]
+        while node.left_child:
+            if node.is_cat_feature:
+                go_left = cat_x[node.feature_id - self.num_features] \
+                    in node.cat_threshold
+            elif np.isnan(x[node.feature_id]):
+                go_left = node.default_left
+            else:
+                go_left = x[node.feature_id] < node.threshold
+            node = tree.nodes[
+                node.left_child if go_left else node.right_child]
+        return node.node_id
+
+    def test_predict(self):
+        np.random.seed(0)
+        trees = [self.make_tree(5) for _ in range(10)]
+        X = np.random.normal(size=(1000, self.num_features))
+        X[np.random.random(X.shape) < 0.2] = np.nan
+        cat_X = np.random.randint(
+            0, 12, size=(1000, self.num_cat_features)).astype(np.int32)
+
+        ensemble = CompiledEnsemble(trees)
+        with ProcessPoolExecutor(2) as pool:
+            assignment = ensemble.batch_assign(
+                X, cat_X, pool=pool, block_size=128)
+        self.assertEqual(assignment.shape, (1000, 10))
+        expected_pred = np.zeros(1000, dtype=np.float32)
+        for i, tree in enumerate(trees):
+            expected = [
+                self.predict_one(tree, x, cat_x) for x, cat_x in zip(X, cat_X)]
+            np.testing.assert_equal(
+                ensemble.local_assignment(assignment, i), expected)
+            expected_pred += [tree.nodes[j].weight for j in expected]
+        np.testing.assert_almost_equal(
+            ensemble.raw_predict(assignment), expected_pred, decimal=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
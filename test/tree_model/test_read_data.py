@@ -0,0 +1,166 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import tempfile
+import unittest
+from argparse import Namespace
+from pathlib import Path
+import numpy as np
+from fedlearner.model.tree.tree import BinnedFeatures, BoostingTreeEnsamble
+from fedlearner.model.tree.trainer import read_data, read_data_dir, \
+    sketch_data_dir, data_fingerprint, save_binned_cache, load_binned_cache, \
+    test_one_file_streaming, write_predictions
+
+class TestReadData(unittest.TestCase):
+
+    def _write_csv(self, path, num_rows, part):
+        with open(path, 'w') as fout:
+            fout.write('example_id,f2,f1,label,c1\n')
+            for i in range(num_rows):
+                f1 = '' if i % 7 == 0 else str(i * 0.25)
+                fout.write('%03d_%d,%s,%s,%d,%d\n'%(
+                    i, part, 'nan' if i % 5 == 0 else i, f1, i % 2, i % 4))
+
+    def test_read_data_dir(self):
+        path = Path(tempfile.mkdtemp(), 'test').resolve()
+        path.mkdir()
+        for part in range(3):
+            self._write_csv(str(path.joinpath('%d.csv'%part)), 100, part)
+
+        features, cat_features, cont_columns, cat_columns, \
+            labels, example_ids, raw_ids = read_data_dir(
+                '.csv', '', 'csv', str(path), True, True, '', 'c1', 'label',
+                num_parallel=2)
+        self.assertEqual(cont_columns, ['f1', 'f2'])
+        self.assertEqual(cat_columns, ['c1'])
+        self.assertEqual(features.shape, (300, 2))
+        self.assertEqual(features.dtype, np.float32)
+        self.assertEqual(cat_features.shape, (300, 1))
+        self.assertEqual(len(example_ids), 300)
+        self.assertEqual(example_ids[:2], ['000_0', '001_0'])
+        self.assertEqual(example_ids[100], '000_1')
+        self.assertIsNone(raw_ids)
+        self.assertEqual(np.isnan(features).sum(axis=0).tolist(), [45, 60])
+        np.testing.assert_equal(labels[:4], [0, 1, 0, 1])
+
+        # small chunks give the same result as one chunk
+        chunked = read_data(
+            'csv', str(path.joinpath('0.csv')), True, True, '', 'c1', 'label',
+            chunk_size=7)
+        np.testing.assert_equal(chunked[0], features[:100])
+        np.testing.assert_equal(chunked[1], cat_features[:100])
+
+    def test_sketch_data_dir(self):
+        path = Path(tempfile.mkdtemp(), 'test').resolve()
+        path.mkdir()
+        for part in range(3):
+            self._write_csv(str(path.joinpath('%d.csv'%part)), 100, part)
+
+        cont_columns, thresholds = sketch_data_dir(
+            '.csv', '', 'csv', str(path), '', 'c1', 'label', 16,
+            num_parallel=2)
+        self.assertEqual(cont_columns, ['f1', 'f2'])
+        self.assertEqual([len(i) for i in thresholds], [15, 15])
+
+        features, cat_features, _, _, labels, _, _ = read_data_dir(
+            '.csv', '', 'csv', str(path), True, True, '', 'c1', 'label')
+        binned, binned_cat_features, _, _, binned_labels, _, _ = \
+            read_data_dir(
+                '.csv', '', 'csv', str(path), True, True, '', 'c1', 'label',
+                thresholds=thresholds)
+        self.assertEqual(binned.dtype, np.uint8)
+        exact = BinnedFeatures(features, 16, cat_features=cat_features)
+        sketched = BinnedFeatures.from_binned(
+            binned, thresholds, 16, cat_features=binned_cat_features)
+        self.assertEqual(sketched.num_bins, exact.num_bins)
+        np.testing.assert_equal(sketched.binned == 16, exact.binned == 16)
+        np.testing.assert_equal(binned_labels, labels)
+        # sketch ranks are close to exact ones
+        self.assertLess(
+            np.abs(sketched.binned.astype(np.int32) - exact.binned).mean(),
+            0.5)
+
+    def test_binned_cache(self):
+        path = Path(tempfile.mkdtemp(), 'test').resolve()
+        path.mkdir()
+        self._write_csv(str(path.joinpath('0.csv')), 100, 0)
+        args = Namespace(
+            role='leader', file_ext='.csv', file_wildcard='', file_type='csv',
+            ignore_fields='', cat_fields='c1', label_field='label',
+            verify_example_ids=True, quantile_sketch=False)
+        fingerprint = data_fingerprint(args, str(path))
+        self.assertEqual(fingerprint, data_fingerprint(args, str(path)))
+        args.cat_fields = ''
+        self.assertNotEqual(fingerprint, data_fingerprint(args, str(path)))
+        args.cat_fields = 'c1'
+
+        features, cat_features, cont_columns, cat_columns, \
+            labels, example_ids, _ = read_data_dir(
+                '.csv', '', 'csv', str(path), True, True, '', 'c1', 'label')
+        binned = BinnedFeatures(features, 33, cat_features=cat_features)
+        cache_path = str(path.joinpath('cache-%s'%fingerprint))
+        save_binned_cache(cache_path, binned, labels, example_ids,
+                          cont_columns, cat_columns)
+        loaded, loaded_labels, loaded_ids, loaded_columns, \
+            loaded_cat_columns = load_binned_cache(cache_path, 33)
+        np.testing.assert_equal(np.asarray(loaded.binned), binned.binned)
+        np.testing.assert_equal(loaded_labels, labels)
+        self.assertEqual(loaded_ids, example_ids)
+        self.assertEqual(loaded_columns, cont_columns)
+        self.assertEqual(loaded_cat_columns, cat_columns)
+
+        self._write_csv(str(path.joinpath('1.csv')), 10, 1)
+        self.assertNotEqual(fingerprint, data_fingerprint(args, str(path)))
+
+    def test_one_file_streaming(self):
+        path = Path(tempfile.mkdtemp(), 'test').resolve()
+        path.mkdir()
+        data_file = str(path.joinpath('0.csv'))
+        self._write_csv(data_file, 100, 0)
+        features, cat_features, _, _, labels, example_ids, _ = read_data(
+            'csv', data_file, True, True, '', 'c1', 'label')
+        booster = BoostingTreeEnsamble(None, max_iters=2, max_depth=2)
+        booster.fit(features, labels, cat_features=cat_features)
+        args = Namespace(
+            file_type='csv', ignore_fields='', cat_fields='c1',
+            label_field='label', verify_example_ids=True)
+
+        expected = str(path.joinpath('expected.csv'))
+        write_predictions(
+            expected,
+            booster.batch_predict(features, cat_features=cat_features),
+            example_ids)
+        output = str(path.joinpath('output', '0.csv'))
+        test_one_file_streaming(args, booster, data_file, output)
+        with open(expected) as fin:
+            self.assertEqual(Path(output).read_text(), fin.read())
+
+        # a file without rows still gets a header line
+        empty_file = str(path.joinpath('empty.csv'))
+        Path(empty_file).write_text('example_id,f2,f1,label,c1\n')
+        test_one_file_streaming(args, booster, empty_file, output)
+        self.assertEqual(Path(output).read_text(), 'example_id,prediction\n')
+
+        Path(empty_file).write_text('f2,f1,label,c1\n')
+        with self.assertRaises(AssertionError):
+            test_one_file_streaming(args, booster, empty_file, output)
+        args.verify_example_ids = False
+        test_one_file_streaming(args, booster, empty_file, output)
+        self.assertEqual(Path(output).read_text(), 'prediction\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# Copyright 2020 The FedLearner Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# coding: utf-8
+
+import unittest
+import numpy as np
+from fedlearner.model.tree.sketch import QuantileSketch
+
+
+class TestQuantileSketch(unittest.TestCase):
+    def _rank_error(self, data, sketch, qs):
+        data = np.sort(data)
+        values = sketch.quantiles(qs)
+        ranks = np.searchsorted(data, values, side='right') / len(data)
+        return np.abs(ranks - qs).max()
+
+    def test_quantiles(self):
+        np.random.seed(0)
+        data = np.random.lognormal(size=200000).astype(np.float32)
+        data[::10] = np.nan
+        sketch = QuantileSketch(seed=0)
+        for chunk in np.array_split(data, 37):
+            sketch.update(chunk)
+        nonmissing = data[~np.isnan(data)]
+        self.assertEqual(sketch.count, len(nonmissing))
+        self.assertIsNone(sketch.unique_values)
+        qs = np.linspace(0, 1, 33)[1:-1]
+        self.assertLess(self._rank_error(nonmissing, sketch, qs), 0.01)
+
+    def test_merge(self):
+        np.random.seed(1)
+        data = np.random.normal(size=(8, 50000)).astype(np.float32)
+        data[3] += 5
+        sketches = [QuantileSketch(seed=i) for i in range(8)]
+        for sketch, part in zip(sketches, data):
+            sketch.update(part)
+        merged = sketches[0]
+        for sketch in sketches[1:]:
+            merged.merge(sketch)
+        self.assertEqual(merged.count, data.size)
+        qs = np.linspace(0, 1, 33)[1:-1]
+        self.assertLess(self._rank_error(data.ravel(), merged, qs), 0.01)
+
+    def test_unique_values(self):
+        left = QuantileSketch(max_unique=4)
+        right = QuantileSketch(max_unique=4)
+        left.update([1, 2, 2, np.nan])
+        right.update([2, 3, 3])
+        left.merge(right)
+        np.testing.assert_equal(left.unique_values, [1, 2, 3])
+        right.update([4, 5])
+        left.merge(right)
+        self.assertIsNone(left.unique_values)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,12 +14,15 @@
 
 # coding: utf-8
 
+import shutil
+import tempfile
 import threading
 import unittest
 import numpy as np
 
 import fedlearner as fl
-from fedlearner.model.tree.tree import BoostingTreeEnsamble
+from fedlearner.model.tree.tree import BoostingTreeEnsamble, \
+    BinnedFeatures, HistogramBuilder
 from fedlearner.common import tree_model_pb2 as tree_pb2
 from sklearn.datasets import load_iris
 
@@ -118,6 +121,57 @@ class TestBoostingTree(unittest.TestCase):
         thread.join()
         np.testing.assert_almost_equal(local_pred, leader_pred)
 
+    def test_histogram(self):
+        X, _ = self.make_data()
+        cat_X = self.quantize_data(X[:, 2:])
+        binned = BinnedFeatures(X[:, :2], 33, cat_features=cat_X)
+        grad = np.random.normal(size=X.shape[0])
+        hess = np.random.random(size=X.shape[0])
+        sample_ids = np.random.choice(X.shape[0], 100, replace=False)
+
+        builder = HistogramBuilder(binned)
+        grad_hists, hess_hists = builder.compute_grad_hess_histograms(
+            grad, hess, sample_ids)
+        all_binned = np.concatenate([binned.binned, cat_X], axis=1)
+        num_bins = binned.num_bins + binned.cat_num_bins
+        self.assertEqual(len(grad_hists), len(num_bins))
+        for fid, num in enumerate(num_bins):
+            expected_grad = np.zeros(num)
+            expected_hess = np.zeros(num)
+            np.add.at(expected_grad, all_binned[sample_ids, fid],
+                      grad[sample_ids])
+            np.add.at(expected_hess, all_binned[sample_ids, fid],
+                      hess[sample_ids])
+            np.testing.assert_almost_equal(
+                grad_hists[fid], expected_grad, decimal=5)
+            np.testing.assert_almost_equal(
+                hess_hists[fid], expected_hess, decimal=5)
+
+    def test_binned_features_cache(self):
+        X, _ = self.make_data()
+        cat_X = self.quantize_data(X[:, 2:])
+        binned = BinnedFeatures(X[:, :2], 33, cat_features=cat_X)
+        path = tempfile.mkdtemp()
+        try:
+            binned.save(path)
+            loaded = BinnedFeatures.load(path, 33)
+            np.testing.assert_equal(np.asarray(loaded.binned), binned.binned)
+            np.testing.assert_equal(
+                np.asarray(loaded.cat_features), binned.cat_features)
+            self.assertEqual(loaded.num_bins, binned.num_bins)
+            self.assertEqual(loaded.cat_num_bins, binned.cat_num_bins)
+            for threshold, expected in zip(
+                    loaded.thresholds, binned.thresholds):
+                np.testing.assert_equal(threshold, expected)
+
+            features = loaded.dequantize()
+            for i, threshold in enumerate(binned.thresholds):
+                np.testing.assert_equal(
+                    features[:, i] < threshold[:, None],
+                    X[:, i] < threshold[:, None])
+        finally:
+            shutil.rmtree(path)
+
     def test_boosting_tree(self):
         X, y = self.make_data()
 